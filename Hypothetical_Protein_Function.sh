@@ -2,18 +2,22 @@
 
 USAGE=$(cat <<-END
 Usage:
-    $(basename "$0") [-h] [-c] [-e] [-r] [-g genome.gbff] [-f fasta.faa] [-p 3]
+    $(basename "$0") [-h] [-c] [-e] [-r] [-g genome.gbff] [-n 10] [-s 42] [-f fasta.faa] [-p 3] [-j 4]
 
 -h  Displays help page.
 -c  Optional flag to compare protein function annotation in header sequence to this script's output.
--e  Optional flag to extract amino acid sequences denoted as hypothetical in the fasta header.
+-e  Optional flag to only process amino acid sequences denoted as hypothetical in the fasta header (case-insensitive).
 -g  Optional .gbff or .gbk file from which amino acid sequences will randomly be extracted and compared to this script's output.
--r  Optional flag to remove duplicate fasta entries.
+-n  Optional number of sequences to extract with '-g'. Asked for if omitted.
+-s  Optional seed for the random extraction with '-g'. Asked for if omitted and run interactively.
+-r  Optional flag to skip duplicate fasta entries. Skipped headers are listed with the header kept in their place in <fasta>_duplicates.csv.
 -f  Fasta file containing amino acid sequences.
 -p  Optional word number (character string separated by whitespace) or regex pattern to match annotated function in fasta header.
     Default behavior is to extract all characters after the second whitespace.
     This is only needed when comparing functional annotation in the header sequence to this script's output.
     Example generic regex pattern: 'r">.*(.*).*\s"'
+-j  Optional number of processes used for substring generation and protein function inference (default 1).
+    Output is identical whatever the number of processes.
 
 Header sequence IDs are determined by default as the characters immediately following the '>' until the first whitespace.
 These IDs will be used for intermediate file naming so try to avoid special characters.
@@ -23,7 +27,7 @@ This script determines protein function based on the amino acid sequences provid
 
 If the '-c' option is used with '-g', only the fasta file derived from the .gbff file will be used for protein function determination.
 
-Keep in mind that the Biopython module is required to parse the .gbff or .gbk file if included.
+The .gbff or .gbk file is parsed with a built-in scanner; Biopython is not required.
 
 Each sequence is trimmed to the first 400 amino acids and then submitted to the ESMFold API:
     "https://api.esmatlas.com/foldSequence/v1/pdb/"
@@ -36,8 +40,16 @@ This substring is reported along with the header, percentage of descriptions con
 the average SeqID, and the sequence submitted to ESMFold.
 
 Please keep in mind that this script utilizes APIs that are considered shared resources.
-As such, the ESMFold API is limited to 50 requests at a time,
-and the Foldseek API request loop will break after the rate limit has been reached.
+As such, ESMFold API requests are rate limited (bursts of up to 50 requests, then 1 request per second)
+with at most 4 requests in flight, and requests rejected with 429 or 5xx are retried with exponential backoff,
+and Foldseek submissions pause and resume when the rate limit is reached, keeping at most 4 tickets in flight.
+
+Predicted structures and Foldseek results are cached by amino acid sequence in ~/.cache/HyProFunc
+(or the directory named by the HYPROFUNC_CACHE environment variable) and reused by later runs.
+The cache is limited to 10 GB; least recently used entries are removed first.
+
+Timings of every request and stage, retries and rate limit waits are written as JSON lines to
+metrics.jsonl in the output directory, and summarized at the end of the log.
 
 Please also note that the ESMFold API has known SSL certificate issues:
     "https://github.com/facebookresearch/esm/discussions/627"
@@ -55,8 +67,11 @@ COMPARE=false
 EXTRACT=false
 REMOVE_DUPS=false
 PATTERN=""
+JOBS=1
+NUM_SEQS_TO_EXTRACT=""
+SEED=""
 
-while getopts "h?cerg:f:p:" opt; do
+while getopts "h?cerg:n:s:f:p:j:" opt; do
     case "$opt" in
     h|\?)
         echo "$USAGE"
@@ -70,10 +85,16 @@ while getopts "h?cerg:f:p:" opt; do
         ;;
     g)  GBFF="${OPTARG}"
         ;;
+    n)  NUM_SEQS_TO_EXTRACT="${OPTARG}"
+        ;;
+    s)  SEED="${OPTARG}"
+        ;;
     f)  ORIGINAL_FASTA="${OPTARG}"
         ;;
     p) PATTERN="${OPTARG}"
         ;;
+    j)  JOBS="${OPTARG}"
+        ;;
     esac
 done
 
@@ -95,8 +116,11 @@ echo "Option -c was '$COMPARE'" >> "$log_file"
 echo "Option -e was '$EXTRACT'" >> "$log_file"
 echo "Option -r was '$REMOVE_DUPS'" >> "$log_file"
 echo "Option -g was '$GBFF'" >> "$log_file"
+echo "Option -n was '$NUM_SEQS_TO_EXTRACT'" >> "$log_file"
+echo "Option -s was '$SEED'" >> "$log_file"
 echo "Option -f was '$ORIGINAL_FASTA'" >> "$log_file"
 echo "Option -p was '$PATTERN'" >> "$log_file"
+echo "Option -j was '$JOBS'" >> "$log_file"
 
 D="${SCRIPT_DIR}"
 
@@ -109,37 +133,37 @@ fi
 
 # if gbff file input, perform AA sequence extraction
 if [[ -n "${GBFF}" ]]; then
-    read -p "How many sequences should randomly be extracted from ${GBFF}? " NUM_SEQS_TO_EXTRACT
+    if [[ -z "${NUM_SEQS_TO_EXTRACT}" ]]; then
+        read -p "How many sequences should randomly be extracted from ${GBFF}? " NUM_SEQS_TO_EXTRACT
+    fi
     echo "${NUM_SEQS_TO_EXTRACT} random amino acid sequences will be extracted from ${GBFF}."
     #Once extracted, now we need to reroute original fasta
-    "${D}"/bin/AA_Sequence_Extract.py ${GBFF} ${NUM_SEQS_TO_EXTRACT} | tee FastaFilePath.txt
+    "${D}"/bin/AA_Sequence_Extract.py ${GBFF} ${NUM_SEQS_TO_EXTRACT} ${SEED:+--seed ${SEED}} | tee FastaFilePath.txt
     ORIGINAL_FASTA=$(tail -n 1 FastaFilePath.txt | awk '{print $NF}')
     echo $ORIGINAL_FASTA
 fi
 
 
 FASTA_FN="${ORIGINAL_FASTA%.*}"
+FASTA=${ORIGINAL_FASTA}
+FASTB="${FASTA_FN}"
+# Header selection and duplicate removal are done by Pipeline.py as it reads the fasta file,
+# so no filtered copies of it are written.
+PREPROCESS=()
 
-# optional extraction of hypothetical proteins
+# optional extraction of hypothetical proteins (case-insensitive header match)
 if [[ "$EXTRACT" == "true" ]]; then
-    echo "Extracting hypothetical proteins from ${ORIGINAL_FASTA}"
-    awk '/^>/ {header = $0} /hypothetical/ && /^>/ {print header; next} /^>/ {header=""; next} header {print}' \
-    ${ORIGINAL_FASTA} > ${FASTA_FN}_hypothetical.faa
-    FASTA=${FASTA_FN}_hypothetical.faa
-    echo "Extracted hypothetical proteins saved in ${FASTA}"
-else
-    FASTA=${ORIGINAL_FASTA}
+    echo "Only hypothetical proteins in ${ORIGINAL_FASTA} will be processed."
+    PREPROCESS+=(--select hypothetical)
+    FASTB=${FASTB}_hypothetical
 fi
 
 # optional removal of duplicate fasta entries (AA sequence must match exactly)
 if [[ "$REMOVE_DUPS" == "true" ]]; then
-    FASTA_PRE="${FASTA%.*}"
-    echo "Removing duplicate fasta entries from ${FASTA}"
-    "${D}"/bin/Remove_Fasta_Duplicates.py ${FASTA} ${FASTA_PRE}_nodups.faa
-    FASTB=${FASTA_PRE}_nodups
-    echo "Created file: ${FASTA_PRE}_nodups.faa"
-else
-    FASTB="${FASTA%.*}"
+    echo "Duplicate fasta entries will be skipped."
+    PREPROCESS+=(--dedup --mapping ${FASTB}_duplicates.csv)
+    echo "Removed headers and the headers kept in their place will be listed in ${FASTB}_duplicates.csv"
+    FASTB=${FASTB}_nodups
 fi
 
 if [ ! -d "./$FASTB" ]; then
@@ -155,59 +179,9 @@ if [[ "$COMPARE" == "true" ]]; then
     "${D}"/bin/Header_functions.py ${ORIGINAL_FASTA} ./${FASTB}/ ${PATTERN}
 fi
 
-"${D}"/bin/ESMFold_API.py ${FASTA} ./${FASTB}/ "${D}"/ESM.pem
-
-for PDB in ./${FASTB}/*.pdb
-    do
-    BASE="${PDB%.*}"
-    BNAME=$(basename "$BASE")
-    if [[ -f "./${FASTB}/${BNAME}_no_prob_one" ]]; then
-        echo "Skipping Foldseek for $PDB because Foldseek has already been run and no hits were found with prob = 1."
-        continue
-    elif [[ -f "./${FASTB}/${BNAME}_empty" ]]; then
-        echo "Skipping Foldseek for $PDB because Foldseek has already been run and no hits were found."
-        continue
-    elif [[ -f "./${FASTB}/${BNAME}_no_info" ]]; then
-        echo "Skipping Foldseek for $PDB because Foldseek has already been run and no informative hits were found."
-        continue
-    fi
-    if [[ -f "./${FASTB}/substrings_${BNAME}.csv" && -f "./${FASTB}/Select_${BNAME}.csv" ]]
-        then echo "Skipping Foldseek for $PDB because substrings_${BNAME}.csv and Select_${BNAME}.csv found"
-    else
-        if [[ -f "./${FASTB}/result.tar.gz" ]]; then rm ./${FASTB}/result.tar.gz; fi
-        echo "Processing $PDB with Foldseek"
-        "${D}"/bin/Foldseek_API.py ${PDB} ./${FASTB}/
-        if [[ -f "./${FASTB}/RateLimitReached" ]] ; then
-            echo "Exiting Foldseek loop!"
-            break
-        elif [[ -f "./${FASTB}/result.tar.gz" ]]; then
-            #script uses three databases so results are output in three .m8 files after unzipping
-            tar -xzf ./${FASTB}/result.tar.gz -C ./${FASTB}
-            cat ./${FASTB}/*.m8 > ${BASE}.tsv; rm ./${FASTB}/*.m8; rm ./${FASTB}/result.tar.gz
-            echo "Generating substrings for $BASE"
-            "${D}"/bin/Generate_substrings.py ${BASE}.tsv; rm ${BASE}.tsv
-        else
-            echo "Exit status = $? : Foldseek API request not completed for ${PDB}. Skipping substring generation."
-        fi
-    fi
-done
-
-if [[ -f "./${FASTB}/RateLimitReached" ]]; then rm ./${FASTB}/RateLimitReached; fi
-
-if [[ -f "./${FASTB}/Protein_Functions.csv" ]]; then
-     # determine which files have already been processed and remove them from the loop.
-     "${D}"/bin/filter_files.py ./${FASTB}/Protein_Functions.csv ./${FASTB}/ 'Select_*.csv' print_values
-     FILE_LIST=$("${D}"/bin/filter_files.py ./${FASTB}/Protein_Functions.csv ./${FASTB}/ 'Select_*.csv')
-else
-    FILE_LIST=$(ls ./${FASTB}/Select_*.csv)
-fi
-
-#for SELECT in ./${FASTB}/Select_*.csv; do
-for SELECT in $FILE_LIST; do
-    SBNAME=$(basename "${SELECT%.*}")
-    echo "Determining protein function for sequence $SBNAME"
-    "${D}"/bin/Protein_function_inference.py ${SELECT}
-done
+# Structure prediction, structure search, substring generation and function inference
+# all run in a single Python process.
+"${D}"/bin/Pipeline.py ${FASTA} ./${FASTB}/ "${D}"/ESM.pem "${PREPROCESS[@]}" -j ${JOBS} --metrics ./${FASTB}/metrics.jsonl
 
 NUM_FUNCTIONS_DETERMINED=$(($(wc -l ./${FASTB}/Protein_Functions.csv | tr ' ' '\n' | head -1) - 1))
 NUM_UNSUCCESSFUL=$(ls ./${FASTB}/*{no_prob_one,empty,no_info} 2>/dev/null | wc -l)
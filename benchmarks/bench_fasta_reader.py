@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+import argparse
+import gzip
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+from Fasta_reader import FastaIndex, normalize_header, read_fasta
+
+try:
+    from Bio import SeqIO
+except ImportError:
+    SeqIO = None
+
+# Measures the throughput of the shared fasta reader (memory-mapped, in blocks and gzip) against the
+# line-by-line parse_fasta the scripts used before and, if Biopython is installed, Bio.SeqIO.
+# All readers must return the same header IDs and sequences.
+# Usage:
+#   benchmarks/bench_fasta_reader.py --records 100000 500000
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+
+# Writes `records` proteins of 50 to 1000 residues, wrapped at 60 characters like NCBI .faa files
+def write_synthetic_fasta(path, records, seed=0):
+    rng = random.Random(seed)
+    with open(path, 'w') as file:
+        for i in range(records):
+            sequence = ''.join(rng.choices(AMINO_ACIDS, k=rng.randint(50, 1000)))
+            file.write(f">WP_{i:09d}.1 hypothetical protein [Escherichia coli]\n")
+            for start in range(0, len(sequence), 60):
+                file.write(sequence[start:start + 60] + '\n')
+
+
+# Reference implementation: the parse_fasta previously copied into each script
+def parse_fasta_lines(fasta_file):
+    with open(fasta_file, 'r') as file:
+        header_sequence_pairs = []
+        header = None
+        sequence = []
+        for line in file:
+            line = line.strip()
+            if line.startswith(">"):
+                if header:
+                    header_sequence_pairs.append((header, ''.join(sequence)))
+                header = line[1:].replace('|','_').replace('(','-').replace(')','-').split()[0]
+                sequence = []
+            else:
+                sequence.append(line.replace(' ', ''))
+        if header:
+            header_sequence_pairs.append((header, ''.join(sequence)))
+    return header_sequence_pairs
+
+
+def shared_reader(path, use_mmap=True):
+    return [(normalize_header(description), sequence) for description, sequence in read_fasta(path, use_mmap)]
+
+
+def biopython(path):
+    return [(normalize_header(record.description), str(record.seq)) for record in SeqIO.parse(path, 'fasta')]
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks fasta parsing throughput on synthetic protein files.")
+    parser.add_argument('--records', type=int, nargs='+', default=[100000])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        print(f"{'records':>9} {'reader':<22} {'seconds':>8} {'MB/s':>8}")
+        for records in args.records:
+            path = os.path.join(directory, 'proteins.faa')
+            write_synthetic_fasta(path, records, args.seed)
+            with open(path, 'rb') as plain, gzip.open(path + '.gz', 'wb', compresslevel=1) as compressed:
+                shutil.copyfileobj(plain, compressed)
+            megabytes = os.path.getsize(path) / 1e6
+
+            readers = [('parse_fasta (lines)', parse_fasta_lines, path),
+                       ('read_fasta (mmap)', shared_reader, path),
+                       ('read_fasta (blocks)', lambda p: shared_reader(p, use_mmap=False), path),
+                       ('read_fasta (gzip)', shared_reader, path + '.gz')]
+            if SeqIO is not None:
+                readers.append(('Bio.SeqIO', biopython, path))
+            else:
+                print("Biopython is not installed; skipping Bio.SeqIO.")
+
+            expected = None
+            for name, function, source in readers:
+                result, seconds = timed(function, source)
+                if expected is None:
+                    expected = result
+                elif result != expected:
+                    sys.exit(f"{name} returned different records for {records} records")
+                print(f"{records:>9} {name:<22} {seconds:>8.2f} {megabytes / seconds:>8.1f}")
+
+            index, seconds = timed(FastaIndex, path)
+            print(f"{records:>9} {'FastaIndex build':<22} {seconds:>8.2f} {megabytes / seconds:>8.1f}")
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+BIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin')
+sys.path.insert(0, BIN)
+
+from Foldseek_API import FoldseekLocalBackend, search_structures
+from Generate_substrings import generate_substrings
+from Mock_API_servers import fake_pdb
+from Mock_foldseek import read_structure
+
+from bench_fasta_reader import AMINO_ACIDS
+
+# Runs the local foldseek search backend (Foldseek_API.py --foldseek-db) against the tiny database bundled in
+# benchmarks/data/foldseek_db (12 AlphaFold-style structures with their descriptions), searched as two
+# databases. The queries are mutated copies of the bundled structures, plus one structure foldseek cannot read.
+# Checks that:
+#   - every structure outside the batch holding the unreadable one gets a result archive with one
+#     alis_<name>.m8 table per database, holding only its own hits, its source structure among them with prob 1,
+#     and that Generate_substrings.py reads the archive (the hits of an uncharacterized protein have no
+#     informative description)
+#   - the failing batch is left unsearched and the other batches are still searched
+#   - the foldseek command lines stay short whatever the number of structures (only checked with the stand-in)
+# By default foldseek is Mock_foldseek.py; --foldseek runs the same plumbing with a real foldseek, in which case
+# only the archives' layout is checked. Exits with an error if a check fails.
+# Usage:
+#   benchmarks/bench_foldseek_local.py --structures 2500
+#   benchmarks/bench_foldseek_local.py --structures 20 --batch-size 8 --foldseek foldseek
+
+DATABASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'foldseek_db')
+
+# Longest command line the stand-in may be run with, far below any ARG_MAX
+MAX_COMMAND_BYTES = 4096
+
+
+# Changes `count` residues, which leaves most of the 3-mers of the sequence in place
+def mutate(sequence, rng, count=2):
+    residues = list(sequence)
+    for position in rng.sample(range(len(residues)), count):
+        residues[position] = rng.choice(AMINO_ACIDS)
+    return ''.join(residues)
+
+
+# Writes the query structures and returns their paths and the bundled structure each was made from
+def write_queries(directory, structures, bad, seed=0):
+    rng = random.Random(seed)
+    targets = sorted(os.path.splitext(name)[0] for name in os.listdir(DATABASE))
+    sequences = {target: read_structure(os.path.join(DATABASE, target + '.pdb'))[1] for target in targets}
+    pdbs, sources = [], {}
+    for i in range(structures):
+        pdb = os.path.join(directory, f'Q{i:05d}.pdb')
+        if i == bad:
+            with open(pdb, 'w') as file:
+                file.write("END\n")
+        else:
+            sources[pdb] = rng.choice(targets)
+            with open(pdb, 'wb') as file:
+                file.write(fake_pdb(mutate(sequences[sources[pdb]], rng)))
+        pdbs.append(pdb)
+    return pdbs, sources
+
+
+# Rows of every .m8 table of a result archive, by member name
+def archive_tables(path):
+    with tarfile.open(path, 'r:gz') as tar:
+        return {member.name: [line.split('\t') for line in tar.extractfile(member).read().decode().splitlines()]
+                for member in tar.getmembers() if member.isfile()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Checks the local foldseek search backend against a tiny bundled database.")
+    parser.add_argument('--structures', type=int, default=2500)
+    parser.add_argument('--batch-size', type=int, help="Structures per query database (default the backend's).")
+    parser.add_argument('--foldseek', default=os.path.join(BIN, 'Mock_foldseek.py'), help="foldseek executable.")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    stand_in = args.foldseek == os.path.join(BIN, 'Mock_foldseek.py')
+
+    work = tempfile.mkdtemp(prefix='bench_foldseek_local_')
+    out_dir = os.path.join(work, 'run') + os.sep
+    os.makedirs(out_dir)
+    log = os.path.join(work, 'commands.log')
+    os.environ['MOCK_FOLDSEEK_LOG'] = log
+    database = os.path.join(work, 'tiny')
+    subprocess.run([args.foldseek, 'createdb', DATABASE, database], stdout=subprocess.DEVNULL, check=True)
+
+    backend = FoldseekLocalBackend(out_dir, [('tiny', database), ('tiny-copy', database)], foldseek=args.foldseek,
+                                   batch_size=args.batch_size)
+    bad = args.structures // 2
+    pdbs, sources = write_queries(out_dir, args.structures, bad, args.seed)
+    failed = set(pdbs[bad // backend.batch_size * backend.batch_size:][:backend.batch_size])
+    start = time.perf_counter()
+    search_structures(backend, pdbs)
+    seconds = time.perf_counter() - start
+
+    errors = []
+    for pdb in pdbs:
+        archive = backend.archive_path(pdb)
+        if pdb in failed:
+            if os.path.exists(archive):
+                errors.append(f"{pdb} was searched although its batch failed")
+            continue
+        if not os.path.exists(archive):
+            errors.append(f"{pdb} has no result archive")
+            continue
+        tables = archive_tables(archive)
+        if sorted(tables) != ['alis_tiny-copy.m8', 'alis_tiny.m8']:
+            errors.append(f"{archive} holds {', '.join(sorted(tables))}")
+        elif stand_in:
+            name = os.path.splitext(os.path.basename(pdb))[0]
+            for table, rows in tables.items():
+                if any(row[0] != name for row in rows):
+                    errors.append(f"{archive} {table} holds hits of other structures")
+                if not any(row[1].startswith(sources[pdb] + ' ') and row[10] == '1.0' for row in rows):
+                    errors.append(f"{archive} {table} lacks the hit of {sources[pdb]}")
+    sample = [pdb for pdb in pdbs if pdb not in failed][:10]
+    if stand_in and any(generate_substrings(backend.archive_path(pdb)) not in ('substrings', '_no_info') for pdb in sample):
+        errors.append("Generate_substrings.py could not read a result archive")
+    longest = 0
+    if os.path.exists(log):
+        with open(log) as file:
+            longest = max(int(line) for line in file)
+    shutil.rmtree(work, ignore_errors=True)
+
+    print(f"{args.structures} structures in batches of {backend.batch_size}: {seconds:.1f} s "
+          f"({args.structures / seconds:.0f} structures/s)")
+    print(f"{len(failed)} structures left unsearched with the unreadable one; longest foldseek command line {longest} bytes")
+    if stand_in and longest > MAX_COMMAND_BYTES:
+        errors.append(f"A foldseek command line took {longest} bytes")
+    if errors:
+        sys.exit('\n'.join(errors[:20]))
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+
+BIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin')
+sys.path.insert(0, BIN)
+
+from Fasta_reader import read_fasta
+from Generate_substrings import generate_substrings
+from Mock_API_servers import make_server
+from Preprocess_fasta import FastaPreprocessor
+from Protein_function_inference import infer_function
+from Remove_Fasta_Duplicates import remove_duplicates_fasta
+
+from bench_fasta_reader import AMINO_ACIDS, write_synthetic_fasta
+from bench_substrings import synthetic_descriptions
+
+# Reproducible benchmarks of the pipeline stages on synthetic data:
+#   substrings   Generate_substrings.py on Foldseek result archives
+#   inference    Protein_function_inference.py on the substring tables of those archives
+#   fasta        fasta parsing, duplicate removal and single-pass preprocessing
+#   end_to_end   Pipeline.py against the local mock ESMFold and Foldseek servers, with request latency
+#                and optionally the servers' rate limits
+# Synthetic result archives mimic the web server's: three .m8 tables per query, hit counts spread
+# log-normally (some queries have no hits, many have hundreds, capped at 1000 per database), and
+# descriptions of 1 to 8 words that recur within a query like the names of related AlphaFold entries.
+#
+# Results can be saved as JSON and compared with the results of another commit; changes worse than
+# the threshold are reported as regressions and make the script exit with status 1.
+# Usage:
+#   benchmarks/bench_pipeline.py --save base.json
+#   git checkout my-branch && benchmarks/bench_pipeline.py --compare base.json --threshold 0.2
+#   benchmarks/bench_pipeline.py --benchmarks end_to_end --sequences 50 --fold-latency 0.2 --esmfold-limit 5
+
+BENCHMARKS = ['substrings', 'inference', 'fasta', 'end_to_end']
+DATABASES = ['afdb50', 'afdb-swissprot', 'afdb-proteome']
+MAX_HITS = 1000
+
+
+# Hits per database: log-normal around 150, with 5% of queries finding nothing
+def hit_count(rng):
+    if rng.random() < 0.05:
+        return 0
+    return min(MAX_HITS, int(rng.lognormvariate(math.log(150), 1.0)))
+
+
+# Writes one query's result archive and returns its number of rows
+def write_hit_archive(path, rng):
+    descriptions = synthetic_descriptions(200, rng.randrange(2**32))
+    # the share of hits with prob = 1 varies from query to query
+    prob_one = rng.betavariate(2, 2)
+    rows = 0
+    with tarfile.open(path, 'w:gz') as tar:
+        for database in DATABASES:
+            lines = []
+            for i in range(hit_count(rng)):
+                prob = 1.0 if rng.random() < prob_one else round(rng.random(), 3)
+                lines.append('\t'.join(['query', f'AF-P{i:05d}-F1-model_v4 {rng.choice(descriptions)}',
+                                        f'{rng.random():.3f}', '300', '0', '0', '1', '300', '1', '300',
+                                        f'{prob}', '1.0E-10', '500']))
+            data = ''.join(line + '\n' for line in lines).encode()
+            info = tarfile.TarInfo(f'alis_{database}.m8')
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+            rows += len(lines)
+    return rows
+
+
+def make_archives(directory, count, seed):
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    rows = 0
+    for i in range(count):
+        rows += write_hit_archive(os.path.join(directory, f'SEQ_{i:05d}.tar.gz'), rng)
+    return rows
+
+
+# Calls function(*args) with its printed output discarded
+def quiet(function, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def bench_substrings(work, args):
+    directory = os.path.join(work, 'substrings')
+    shutil.rmtree(directory, ignore_errors=True)
+    rows = make_archives(directory, args.archives, args.seed)
+    archives = sorted(os.path.join(directory, name) for name in os.listdir(directory))
+    _, seconds = timed(lambda: [quiet(generate_substrings, archive) for archive in archives])
+    return {'seconds': seconds, 'archives_per_s': len(archives) / seconds, 'rows_per_s': rows / seconds}
+
+
+def bench_inference(work, args):
+    directory = os.path.join(work, 'substrings')
+    if not os.path.isdir(directory):
+        bench_substrings(work, args)
+    selected = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                      if name.startswith('Select_') and name.endswith('.csv'))
+    header_sequences = {os.path.basename(path)[len('Select_'):-len('.csv')]: 'M' * 100 for path in selected}
+    _, seconds = timed(lambda: [quiet(infer_function, path, header_sequences) for path in selected])
+    return {'seconds': seconds, 'sequences_per_s': len(selected) / seconds}
+
+
+def bench_fasta(work, args):
+    path = os.path.join(work, 'proteins.faa')
+    # the second copy repeats the sequences of the first quarter, so a fifth of the records are duplicates
+    write_synthetic_fasta(path, args.fasta_records, args.seed)
+    duplicates = os.path.join(work, 'duplicates.faa')
+    write_synthetic_fasta(duplicates, args.fasta_records // 4, args.seed)
+    with open(path, 'ab') as out, open(duplicates, 'rb') as src:
+        shutil.copyfileobj(src, out)
+    megabytes = os.path.getsize(path) / 1e6
+
+    _, parse_seconds = timed(lambda: sum(1 for _ in read_fasta(path)))
+    _, dedup_seconds = timed(quiet, remove_duplicates_fasta, path, os.path.join(work, 'unique.faa'))
+    preprocessor = FastaPreprocessor(keywords=['hypothetical'], min_length=100, deduplicate=True, sort=True)
+    _, preprocess_seconds = timed(lambda: quiet(lambda: sum(1 for _ in preprocessor.process(read_fasta(path)))))
+    return {'seconds': parse_seconds + dedup_seconds, 'parse_mb_per_s': megabytes / parse_seconds,
+            'dedup_mb_per_s': megabytes / dedup_seconds, 'preprocess_mb_per_s': megabytes / preprocess_seconds}
+
+
+def bench_end_to_end(work, args):
+    rng = random.Random(args.seed)
+    fasta = os.path.join(work, 'end_to_end.faa')
+    with open(fasta, 'w') as file:
+        for i in range(args.sequences):
+            file.write(f">SEQ_{i:05d}\n{''.join(rng.choices(AMINO_ACIDS, k=rng.randint(50, 400)))}\n")
+    out_dir = os.path.join(work, 'end_to_end') + os.sep
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.makedirs(out_dir)
+
+    server = make_server(search_time=args.search_time, fold_latency=args.fold_latency,
+                         esmfold_limit=args.esmfold_limit, foldseek_limit=args.foldseek_limit,
+                         hits_per_database=args.hits)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}'
+    command = [sys.executable, os.path.join(BIN, 'Pipeline.py'), fasta, out_dir,
+               os.path.join(BIN, '..', 'ESM.pem'), '--no-cache', '-j', str(args.jobs),
+               '--esmfold-url', url + '/foldSequence/v1/pdb/', '--foldseek-url', url + '/api',
+               '--rate', str(args.client_rate), '--foldseek-rate', str(args.client_rate),
+               '--metrics', os.path.join(out_dir, 'metrics.jsonl')]
+    try:
+        _, seconds = timed(lambda: subprocess.run(command, stdout=subprocess.DEVNULL, check=True))
+    finally:
+        server.shutdown()
+        server.server_close()
+    return {'seconds': seconds, 'sequences_per_s': args.sequences / seconds}
+
+
+# Keeps the fastest of `repeat` runs
+def run_benchmark(name, work, args):
+    function = globals()['bench_' + name]
+    return min((function(work, args) for _ in range(args.repeat)), key=lambda result: result['seconds'])
+
+
+# Throughputs (per second) are better higher, times better lower
+def relative_change(metric, old, new):
+    change = (new - old) / old if old else 0.0
+    return change if metric.endswith('_per_s') else -change
+
+
+# Prints the gain of every metric against the baseline (positive is faster) and returns the regressions
+def compare(results, baseline, threshold):
+    regressions = []
+    print(f"{'benchmark':<12} {'metric':<18} {'baseline':>12} {'current':>12} {'gain':>8}")
+    for name, metrics in results['benchmarks'].items():
+        for metric, value in metrics.items():
+            old = baseline.get('benchmarks', {}).get(name, {}).get(metric)
+            if old is None:
+                continue
+            improvement = relative_change(metric, old, value)
+            flag = ''
+            if improvement < -threshold:
+                flag = 'REGRESSION'
+                regressions.append((name, metric))
+            print(f"{name:<12} {metric:<18} {old:>12.3f} {value:>12.3f} {improvement:>+7.1%} {flag}")
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BIN, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks the pipeline stages on synthetic data and flags regressions.")
+    parser.add_argument('--benchmarks', nargs='+', choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument('--archives', type=int, default=50, help="Synthetic Foldseek result archives.")
+    parser.add_argument('--fasta-records', type=int, default=100000, help="Records of the synthetic fasta file.")
+    parser.add_argument('--sequences', type=int, default=20, help="Sequences in the end-to-end run.")
+    parser.add_argument('--jobs', type=int, default=1, help="Pipeline.py -j in the end-to-end run.")
+    parser.add_argument('--hits', type=int, default=200, help="Hits per database returned by the mock Foldseek server.")
+    parser.add_argument('--fold-latency', type=float, default=0.05, help="Seconds per mock ESMFold request.")
+    parser.add_argument('--search-time', type=float, default=0.2, help="Seconds until a mock Foldseek ticket is COMPLETE.")
+    parser.add_argument('--esmfold-limit', type=float, help="Mock ESMFold requests per second.")
+    parser.add_argument('--foldseek-limit', type=float, help="Mock Foldseek ticket submissions per second.")
+    parser.add_argument('--client-rate', type=float, default=50.0, help="Pipeline.py --rate and --foldseek-rate.")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs of each benchmark; the fastest is kept.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', metavar='FILE', help="Write the results to this JSON file.")
+    parser.add_argument('--compare', metavar='FILE', help="Compare with results saved by an earlier run.")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Relative slowdown reported as a regression (default 0.2, i.e. 20%%).")
+    args = parser.parse_args()
+
+    results = {'commit': git_commit(), 'date': datetime.datetime.now().isoformat(timespec='seconds'),
+               'python': platform.python_version(), 'parameters': vars(args), 'benchmarks': {}}
+    work = tempfile.mkdtemp()
+    try:
+        for name in args.benchmarks:
+            results['benchmarks'][name] = run_benchmark(name, work, args)
+            print(f"{name:<12} " + '  '.join(f"{metric} {value:.3f}" for metric, value in results['benchmarks'][name].items()))
+    finally:
+        shutil.rmtree(work)
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"Results written to {args.save}")
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        print(f"Compared with commit {baseline.get('commit')} ({baseline.get('date')})")
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
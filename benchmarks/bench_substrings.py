@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+import argparse
+import itertools
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+from Generate_substrings import most_common_substrings
+
+# Benchmarks the most-common-substring search of Generate_substrings.py against the previous
+# per-length enumeration on synthetic hit tables, and checks that both give identical rows.
+# The incremental scan with a minimum support (--min-support percent of rows) is timed as well.
+# Usage:
+#   benchmarks/bench_substrings.py --rows 1000 2000 5000 --min-support 10
+
+WORDS = ['ABC', 'transporter', 'permease', 'ATP-binding', 'lipoprotein', 'DNA-binding', 'response',
+         'regulator', 'sensor', 'histidine', 'kinase', 'TetR', 'family', 'Glycosyltransferase', 'Serine',
+         'protease', 'Methyltransferase', 'Clp', 'proteolytic', 'subunit', 'alpha', 'beta', 'hydrolase',
+         'fold', 'Zinc', 'metalloprotease', 'Peptidase', 'M23', 'Membrane', 'Two-component', 'system']
+
+
+# Descriptions of 1 to 8 words drawn from a skewed vocabulary, like cleaned AlphaFold hit names.
+# As in real hit tables, the same descriptions recur: rows are drawn from a pool of distinct names.
+def synthetic_descriptions(rows, seed=0):
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(WORDS))]
+    pool = [' '.join(rng.choices(WORDS, weights, k=rng.randint(1, 8))) for _ in range(max(1, rows // 5))]
+    return rng.choices(pool, [1 / (rank + 1) for rank in range(len(pool))], k=rows)
+
+
+# Reference implementation: enumerates and counts every substring of every length separately
+def most_common_substrings_by_length(descriptions, total_rows):
+    csv_data = []
+    for length in range(3, 60):
+        all_substrings = list(itertools.chain.from_iterable(
+            [desc[i:i + length] for i in range(len(desc) - length + 1)] for desc in descriptions))
+        substring_counts = Counter(all_substrings)
+        if substring_counts:
+            most_common_substring, count = substring_counts.most_common(1)[0]
+            rows_with_substring = sum(1 for desc in descriptions if most_common_substring in desc)
+            csv_data.append([length, most_common_substring, count, (rows_with_substring / total_rows) * 100])
+    return csv_data
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks the substring search on synthetic hit tables.")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 2000, 5000])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--min-support', type=float, default=10.0)
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'by length (s)':>14} {'automaton (s)':>14} {'speedup':>8} {'min support (s)':>16} {'lengths':>8}")
+    for rows in args.rows:
+        descriptions = synthetic_descriptions(rows, args.seed)
+        expected, reference_time = timed(most_common_substrings_by_length, descriptions, rows)
+        result, automaton_time = timed(most_common_substrings, descriptions, rows)
+        if result != expected:
+            sys.exit(f"Substring rows differ from the reference implementation for {rows} rows")
+        frequent, frequent_time = timed(most_common_substrings, descriptions, rows, args.min_support)
+        print(f"{rows:>8} {reference_time:>14.3f} {automaton_time:>14.3f} {reference_time / automaton_time:>7.1f}x "
+              f"{frequent_time:>16.3f} {len(frequent):>8}")
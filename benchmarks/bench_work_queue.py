@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+import argparse
+import csv
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin')
+sys.path.insert(0, BIN)
+
+from Mock_API_servers import make_server
+
+from bench_fasta_reader import AMINO_ACIDS
+
+# Runs Work_queue.py with several local worker processes against the mock ESMFold and Foldseek servers,
+# and kills one worker with SIGKILL while it holds a lease. Checks that:
+#   - every sequence is done once and merged into Protein_Functions.csv, including the killed worker's,
+#     which another worker claims once its lease runs out
+#   - the workers together stay within the servers' rate limits: with --rate set just below the mock
+#     ESMFold limit, no request is answered with 429 and no Foldseek submission with RATELIMIT
+#   - no SQLite database of the run directory or the worker directories is in WAL mode, which does not
+#     work on storage shared by several hosts
+# With --unshared, each worker is given a rate limit file of its own, as if the limits applied per worker,
+# to show the 429s the shared limits avoid; the rate limit check is then reported but not enforced.
+# Exits with an error if a check fails.
+# Usage:
+#   benchmarks/bench_work_queue.py --sequences 24 --workers 3 --esmfold-limit 2
+#   benchmarks/bench_work_queue.py --unshared
+
+
+def write_fasta(path, sequences, seed=0):
+    rng = random.Random(seed)
+    with open(path, 'w') as file:
+        for i in range(sequences):
+            file.write(f">SEQ_{i:05d}\n{''.join(rng.choices(AMINO_ACIDS, k=rng.randint(50, 400)))}\n")
+
+
+def query(queue, sql, *parameters):
+    connection = sqlite3.connect(queue, timeout=60)
+    try:
+        return connection.execute(sql, parameters).fetchall()
+    finally:
+        connection.close()
+
+
+# Waits until `worker` holds a claim and returns its headers
+def wait_for_claim(queue, worker, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        held = query(queue, "SELECT header FROM items WHERE worker = ? AND status = 'claimed'", worker)
+        if held:
+            return [header for header, in held]
+        time.sleep(0.05)
+    sys.exit(f"Worker {worker} claimed nothing in {timeout} s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Checks the work queue with local workers, one of them killed mid-lease.")
+    parser.add_argument('--sequences', type=int, default=24)
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--lease', type=float, default=3.0, help="Lease in seconds; the killed worker's claims wait this long.")
+    parser.add_argument('--esmfold-limit', type=float, default=2.0, help="ESMFold requests per second the mock server allows.")
+    parser.add_argument('--foldseek-limit', type=float, default=5.0, help="Foldseek submissions per second the mock server allows.")
+    parser.add_argument('--unshared', action='store_true', help="Give each worker its own rate limit file.")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix='bench_work_queue_')
+    run_dir = os.path.join(work, 'run') + os.sep
+    os.makedirs(run_dir)
+    fasta = os.path.join(work, 'sequences.faa')
+    write_fasta(fasta, args.sequences, args.seed)
+    queue = os.path.join(run_dir, 'work_queue.sqlite')
+
+    server = make_server(search_time=0.2, esmfold_limit=args.esmfold_limit, foldseek_limit=args.foldseek_limit)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}'
+    script = os.path.join(BIN, 'Work_queue.py')
+    subprocess.run([sys.executable, script, 'enqueue', fasta, run_dir], stdout=subprocess.DEVNULL, check=True)
+
+    # clients run just below the servers' limits, with no bursts; every Foldseek request (submission, poll
+    # or download) takes a token, while the mock server only limits submissions
+    options = [os.path.join(BIN, '..', 'ESM.pem'), '--no-cache', '--batch-size', str(args.batch_size),
+               '--lease', str(args.lease), '--esmfold-url', url + '/foldSequence/v1/pdb/', '--foldseek-url', url + '/api',
+               '--rate', str(0.8 * args.esmfold_limit), '--burst', '1',
+               '--foldseek-rate', str(0.8 * args.foldseek_limit), '--foldseek-burst', '1']
+    workers = {}
+    start = time.perf_counter()
+    try:
+        for i in range(args.workers):
+            worker = f'worker{i}'
+            command = [sys.executable, script, 'worker', run_dir, *options, '--worker-id', worker]
+            if args.unshared:
+                command += ['--shared-rate-limits', os.path.join(work, f'{worker}_rate_limits.sqlite')]
+            workers[worker] = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+        killed = wait_for_claim(queue, 'worker0')
+        workers['worker0'].kill()
+        workers['worker0'].wait()
+        print(f"Killed worker0 holding {', '.join(killed)}")
+        for worker, process in workers.items():
+            if process.wait(timeout=600) != 0 and worker != 'worker0':
+                sys.exit(f"{worker} exited with status {process.returncode}")
+        seconds = time.perf_counter() - start
+        subprocess.run([sys.executable, script, 'merge', run_dir], stdout=subprocess.DEVNULL, check=True)
+    finally:
+        for process in workers.values():
+            if process.poll() is None:
+                process.kill()
+        server.shutdown()
+        server.server_close()
+
+    statuses = dict(query(queue, 'SELECT status, COUNT(*) FROM items GROUP BY status'))
+    takers = dict(query(queue, f"SELECT header, result IS NOT NULL FROM items WHERE header IN ({', '.join('?' * len(killed))})",
+                        *killed))
+    with open(os.path.join(run_dir, 'Protein_Functions.csv'), newline='') as file:
+        inferred = [row[0] for row in csv.reader(file)][1:]
+    counts = server.RequestHandlerClass.counts
+    limited = counts.get('foldSequence_limited', 0) + counts.get('ticket_limited', 0)
+    wal = [os.path.relpath(os.path.join(directory, name), run_dir)
+           for directory, _, names in os.walk(run_dir) for name in names
+           if name.endswith('.sqlite') and query(os.path.join(directory, name), 'PRAGMA journal_mode')[0][0] == 'wal']
+
+    print(f"{args.sequences} sequences, {args.workers} workers ({'own' if args.unshared else 'shared'} rate limits): "
+          f"{seconds:.1f} s")
+    print(f"Queue: {statuses}; {len(inferred)} protein functions merged")
+    print(f"ESMFold requests {counts.get('foldSequence', 0)} ({counts.get('foldSequence_limited', 0)} answered 429), "
+          f"Foldseek submissions {counts.get('ticket', 0)} ({counts.get('ticket_limited', 0)} answered RATELIMIT)")
+    shutil.rmtree(work, ignore_errors=True)
+
+    if statuses.get('done', 0) + statuses.get('failed', 0) != args.sequences or statuses.get('failed'):
+        sys.exit("Not every sequence was done")
+    if sorted(inferred) != sorted(set(inferred)) or len(inferred) != args.sequences:
+        sys.exit("Protein_Functions.csv does not hold every sequence exactly once")
+    if not all(takers.values()):
+        sys.exit("The sequences of the killed worker were not completed by the others")
+    if wal:
+        sys.exit(f"Databases in WAL mode: {', '.join(wal)}")
+    if limited and not args.unshared:
+        sys.exit(f"The workers exceeded the shared rate limits {limited} times")
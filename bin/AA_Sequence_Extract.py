@@ -1,16 +1,29 @@
 #!/usr/bin/env python
 
+import argparse
 import random
 import sys
 import os
-from Bio import SeqIO
 
-# Input and output file paths
-# Input gbff/gbk
-input_file = sys.argv[1]
-if not (input_file.endswith('.gbff') or input_file.endswith('.gbk')):
-    print(f"{sys.argv[1]} is not a .gbff or .gbk file.")
-    sys.exit(0)
+# Randomly extracts amino acid sequences (CDS translations) from a .gbff or .gbk file into a fasta file.
+# By default the GenBank file is read with a fast text scanner that only picks up the organism and the
+# locus_tag, product and translation qualifiers of CDS features; --biopython parses full records with
+# Bio.SeqIO instead. The file is read twice: once to count the CDS translations, and once to keep the ones
+# whose positions were drawn, so only the sequences requested are held in memory. The positions are drawn
+# exactly as random.sample draws from the full list, so a seed selects the same sequences as before.
+# The seed can be given with --seed. Otherwise it is asked for when run interactively, and
+# generated randomly in batch runs. It is printed and included in the output file name.
+
+# First positional argument is the .gbff or .gbk file
+# Second positional argument is the number of sequences to extract (10 by default)
+
+# Qualifiers a leading '/' line can belong to; everything else in the feature table is skipped
+QUALIFIERS = ('locus_tag', 'product', 'translation')
+FEATURE_INDENT = 21
+# Single-word taxonomy lines, which (like any line containing ';') end a wrapped organism name
+LINEAGE_ROOTS = ('Bacteria.', 'Archaea.', 'Eukaryota.', 'Unclassified.', 'Viruses.', 'cellular organisms.',
+                 'other sequences.', 'unclassified sequences.')
+
 
 # Function to optionally set the seed
 def get_seed(user_seed=None):
@@ -22,40 +35,163 @@ def get_seed(user_seed=None):
         random.seed(seed)
         return seed
 
-# Parse the GenBank file and extract amino acid sequences (protein-coding)
-sequences = []
-for record in SeqIO.parse(input_file, "genbank"):
-    organism = record.annotations.get("organism", "Unknown organism").replace(" ", "_")
 
-    # Iterate over features to find CDS (protein-coding sequences)
-    for feature in record.features:
-        if feature.type == "CDS" and "translation" in feature.qualifiers:
-            locus_tag = feature.qualifiers.get("locus_tag", ["Unknown_locus_tag"])[0]
-            product = feature.qualifiers.get("product", ["Unknown_product"])[0]
-            sequence = feature.qualifiers["translation"][0]
+# Joins the lines of a qualifier value the way Biopython does: enclosing quotes removed, escaped
+# quotes undone, and translations without whitespace. Other values are joined with spaces.
+def qualifier_value(key, lines):
+    value = '\n'.join(lines)
+    if len(value) > 1 and value[0] == '"' and value[-1] == '"':
+        value = value[1:-1]
+    value = value.replace('""', '"')
+    if key == 'translation':
+        return ''.join(value.split())
+    return value.replace('\n', ' ')
+
+
+# Yields (locus_tag, organism, product, translation) for every CDS with a translation, reading the
+# GenBank flat file line by line without building records.
+def scan_genbank(input_file):
+    organism = "Unknown organism"
+    in_organism = in_features = False
+    qualifiers = None   # qualifier -> list of values (each a list of lines) of the current CDS
+    current = None      # lines of the qualifier value being read, if it is one we keep
+    open_quote = False
+
+    def finish(qualifiers):
+        if qualifiers and 'translation' in qualifiers:
+            yield (qualifier_value('locus_tag', qualifiers['locus_tag'][0]) if 'locus_tag' in qualifiers else "Unknown_locus_tag",
+                   organism,
+                   qualifier_value('product', qualifiers['product'][0]) if 'product' in qualifiers else "Unknown_product",
+                   qualifier_value('translation', qualifiers['translation'][0]))
+
+    with open(input_file, 'r') as file:
+        for line in file:
+            if not in_features:
+                if line.startswith('LOCUS'):
+                    organism = "Unknown organism"
+                elif line.startswith('  ORGANISM'):
+                    organism = line[12:].strip()
+                    in_organism = True
+                    continue
+                elif line.startswith('FEATURES'):
+                    in_features = True
+                elif in_organism and line.startswith(' ' * 12):
+                    # the organism name can wrap; the taxonomy lineage that follows is ';' separated
+                    text = line[12:].strip()
+                    if ';' in text or text in LINEAGE_ROOTS:
+                        in_organism = False
+                    else:
+                        organism += ' ' + text
+                    continue
+                in_organism = False
+                continue
+
+            if open_quote:
+                text = line.strip()
+                if current is not None:
+                    current.append(text)
+                open_quote = not text.endswith('"')
+                continue
+            if line[:1] not in (' ', '\n', '\r'):
+                # end of the feature table (ORIGIN, CONTIG, BASE COUNT or //)
+                yield from finish(qualifiers)
+                qualifiers = current = None
+                in_features = False
+                continue
+            if line[2:FEATURE_INDENT].strip():
+                # a new feature
+                yield from finish(qualifiers)
+                qualifiers = {} if line[2:FEATURE_INDENT].strip() == 'CDS' else None
+                current = None
+                continue
+            text = line[FEATURE_INDENT:].strip()
+            if not text:
+                continue
+            if text.startswith('/'):
+                key, equals, value = text[1:].partition('=')
+                current = None
+                if qualifiers is not None and key in QUALIFIERS and equals:
+                    current = [value]
+                    qualifiers.setdefault(key, []).append(current)
+                open_quote = value.startswith('"') and value != '"' and not (len(value) > 1 and value.endswith('"'))
+            elif current is not None:
+                # unquoted continuation
+                current.append(text)
+        yield from finish(qualifiers)
+
+
+# Same records, parsed with Biopython
+def parse_genbank_biopython(input_file):
+    from Bio import SeqIO
+
+    for record in SeqIO.parse(input_file, "genbank"):
+        organism = record.annotations.get("organism", "Unknown organism")
+
+        # Iterate over features to find CDS (protein-coding sequences)
+        for feature in record.features:
+            if feature.type == "CDS" and "translation" in feature.qualifiers:
+                locus_tag = feature.qualifiers.get("locus_tag", ["Unknown_locus_tag"])[0]
+                product = feature.qualifiers.get("product", ["Unknown_product"])[0]
+                sequence = feature.qualifiers["translation"][0]
+                yield locus_tag, organism, product, sequence
+
+
+# Yields (header, sequence) fasta entries for every CDS translation
+def extract_sequences(input_file, use_biopython=False):
+    records = parse_genbank_biopython(input_file) if use_biopython else scan_genbank(input_file)
+    for locus_tag, organism, product, sequence in records:
+        # Build the FASTA header with the desired fields
+        header = f">{locus_tag} {organism.replace(' ', '_')} {product}"
+        yield header, sequence
+
+
+# Draws `k` of the `count` items of `make_items()` (an iterable that can be read again) the way
+# random.sample(list(items), k) would, holding only the selected items. Returns them in selection order.
+def sample_sequences(make_items, count, k):
+    positions = random.sample(range(count), min(k, count))
+    wanted = set(positions)
+    selected = {i: item for i, item in enumerate(make_items()) if i in wanted}
+    return [selected[i] for i in positions]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Randomly extracts amino acid sequences from a .gbff or .gbk file.")
+    parser.add_argument('input_file', help="GenBank file (.gbff or .gbk).")
+    parser.add_argument('count', type=int, nargs='?', default=10, help="Number of sequences to extract (default 10).")
+    parser.add_argument('--seed', type=int, help="Seed for the random selection. Asked for if omitted and run interactively.")
+    parser.add_argument('--stream', action='store_true',
+                        help="Accepted for compatibility; only the selected sequences are ever kept in memory.")
+    parser.add_argument('--biopython', action='store_true', help="Parse the GenBank file with Biopython instead of the fast scanner.")
+    args = parser.parse_args()
 
-            # Build the FASTA header with the desired fields
-            header = f">{locus_tag} {organism} {product}"
-            sequences.append((header, sequence))
+    # Input gbff/gbk
+    input_file = args.input_file
+    if not (input_file.endswith('.gbff') or input_file.endswith('.gbk')):
+        print(f"{input_file} is not a .gbff or .gbk file.")
+        sys.exit(0)
 
-# Ask for seed input (optional)
-user_seed = input("Enter seed for random sequence selection or press enter to generate one randomly: ")
+    user_seed = args.seed
+    if user_seed is None and sys.stdin.isatty():
+        # Ask for seed input (optional)
+        answer = input("Enter seed for random sequence selection or press enter to generate one randomly: ")
+        user_seed = int(answer) if answer else None
 
-seed = get_seed(int(user_seed) if user_seed else None)
-print(f"Using seed: {seed}")
+    seed = get_seed(user_seed)
+    print(f"Using seed: {seed}")
 
-# Select random sequences - 10 by default
-random_sequences = random.sample(sequences, min(int(sys.argv[2]), len(sequences)))
+    # Select random sequences - 10 by default
+    count = sum(1 for _ in extract_sequences(input_file, args.biopython))
+    random_sequences = sample_sequences(lambda: extract_sequences(input_file, args.biopython), count, args.count)
 
-# output fasta (.faa)
-output_file = os.path.basename(input_file).replace('.gb*', '_random_seqs') + "_seed" + str(seed) + ".faa"
+    # output fasta (.faa)
+    output_file = os.path.basename(input_file).replace('.gb*', '_random_seqs') + "_seed" + str(seed) + ".faa"
 
-# Write the selected sequences to a FASTA file
-with open(output_file, "w") as fasta_out:
-    for header, seq in random_sequences:
-        fasta_out.write(f"{header}\n")
-        # Split sequence into lines of 60 characters (FASTA format standard)
-        for i in range(0, len(seq), 60):
-            fasta_out.write(f"{seq[i:i+60]}\n")
+    # Write the selected sequences to a FASTA file
+    with open(output_file, "w") as fasta_out:
+        for header, seq in random_sequences:
+            fasta_out.write(f"{header}\n")
+            # Split sequence into lines of 60 characters (FASTA format standard)
+            for i in range(0, len(seq), 60):
+                fasta_out.write(f"{seq[i:i+60]}\n")
 
-print(f"{sys.argv[2]} amino acid sequences written to {output_file}")
+    print(f"{args.count} amino acid sequences written to {output_file}")
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+import random
+import sqlite3
+import threading
+import time
+
+import requests
+
+# Shared helpers for talking to the ESMFold and Foldseek web APIs.
+# Both services are shared resources, so every request goes through a token bucket
+# and transient failures (429 and 5xx responses, timeouts, dropped connections)
+# are retried with exponential backoff instead of aborting the run.
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` requests per second with bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        """Takes a token if one is available without waiting. Returns True if a token was taken."""
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def acquire(self):
+        """Blocks until a token is available and returns the number of seconds spent waiting."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class SharedTokenBucket:
+    """Token bucket kept in the `rate_limits` table of a SQLite file, so that every process using the file
+    draws from one limit of `rate` requests per second with bursts of up to `capacity`, on one host or on
+    several hosts sharing the file. Buckets are named, so one file can hold the limits of several services.
+    Refills use the wall clock, so the clocks of the hosts should be synchronised."""
+
+    def __init__(self, path, name, rate, capacity):
+        self.name = name
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.lock = threading.Lock()
+        # transactions are started explicitly; the connection is shared by the threads of the process
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS rate_limits (name TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+
+    # Takes a token if one is available. Returns 0 if a token was taken, otherwise the seconds until one is.
+    def _take(self):
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                now = time.time()
+                row = self.connection.execute('SELECT tokens, updated FROM rate_limits WHERE name = ?',
+                                              (self.name,)).fetchone()
+                tokens = self.capacity if row is None else min(self.capacity, row[0] + max(0.0, now - row[1]) * self.rate)
+                delay = 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+                if not delay:
+                    tokens -= 1
+                self.connection.execute('INSERT OR REPLACE INTO rate_limits VALUES (?, ?, ?)', (self.name, tokens, now))
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+            self.connection.execute('COMMIT')
+            return delay
+
+    def try_acquire(self):
+        """Takes a token if one is available without waiting. Returns True if a token was taken."""
+        return self._take() == 0
+
+    def acquire(self):
+        """Blocks until a token is available and returns the number of seconds spent waiting."""
+        waited = 0.0
+        while True:
+            delay = self._take()
+            if not delay:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+
+# Token bucket named `name` in the SQLite file `shared` if given, otherwise one for this process only
+def make_rate_limiter(rate, capacity, name, shared=None):
+    if shared:
+        return SharedTokenBucket(shared, name, rate, capacity)
+    return TokenBucket(rate, capacity)
+
+
+# Command line option shared by the scripts that call the APIs
+def add_rate_limit_arguments(parser):
+    parser.add_argument('--shared-rate-limits', metavar='SQLITE',
+                        help="Share the ESMFold and Foldseek rate limits with every process given the same file, on any "
+                             "host that can lock it, instead of applying them to this process alone.")
+
+
+# Exponential backoff with full jitter: 1s, 2s, 4s, ... capped at max_delay.
+def backoff_delay(attempt, base_delay=1.0, max_delay=60.0):
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+# Honours a numeric Retry-After header if the server sent one.
+def retry_after(response):
+    value = response.headers.get('Retry-After') if response is not None else None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def request_with_retry(session, method, url, rate_limiter=None, max_retries=5, timeout=120,
+                       base_delay=1.0, max_delay=60.0, metrics=None, **kwargs):
+    """Sends a request, retrying on 429/5xx responses and connection errors.
+
+    Returns the final response, which may still carry an error status once the retries are used up.
+    Connection errors are re-raised after the last attempt.
+    Time spent waiting for the rate limiter or backing off, and retries, are recorded in `metrics` if given.
+    """
+    for attempt in range(max_retries + 1):
+        if rate_limiter is not None:
+            waited = rate_limiter.acquire()
+            if metrics is not None and waited:
+                metrics.record('ratelimit.token_wait', waited, url=url)
+        response = None
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as error:
+            if attempt == max_retries:
+                raise
+            print(f"Request to {url} failed ({error.__class__.__name__}). Retrying.")
+            if metrics is not None:
+                metrics.count('retries', url=url, error=error.__class__.__name__)
+        else:
+            if response.status_code not in RETRY_STATUS_CODES or attempt == max_retries:
+                return response
+            print(f"Request to {url} returned status {response.status_code}. Retrying.")
+            if metrics is not None:
+                metrics.count('retries', url=url, status=response.status_code)
+
+        delay = retry_after(response)
+        if delay is None:
+            delay = backoff_delay(attempt, base_delay, max_delay)
+        if metrics is not None:
+            metrics.record('ratelimit.backoff', delay, url=url)
+        time.sleep(delay)
+    return response
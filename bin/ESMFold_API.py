@@ -1,14 +1,23 @@
 #!/usr/bin/env python
 
+import argparse
 import requests
+import shutil
 import ssl
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from requests.adapters import HTTPAdapter
 import urllib3
 from urllib3.poolmanager import PoolManager
 import os
-import pandas as pd
-import fnmatch
+
+from API_utils import add_rate_limit_arguments, make_rate_limiter, request_with_retry
+from Fasta_reader import normalize_header, read_fasta
+from Results_store import ResultsStore
+from Run_state import RunState
+from Structure_cache import add_cache_arguments, cache_kind, make_cache
 
 # ESMFold has known SSL certificate issues. Due to SAN mismatch in current certificate
 # a custom SSL context was created to disable hostname verification and bypass certificate validation
@@ -30,120 +39,302 @@ class SSLAdapter(HTTPAdapter):
         return super().proxy_manager_for(*args, **kwargs)
 
 # Creates a custom SSL context
-context = ssl.create_default_context()
-pem_file_path = sys.argv[3] # File path for the .pem file
-context.load_verify_locations(pem_file_path) # Loads the .pem file
-context.check_hostname = False  # Disable hostname verification
-context.verify_mode = ssl.CERT_NONE  # Bypass certificate validation
+def make_ssl_context(pem_file_path):
+    context = ssl.create_default_context()
+    context.load_verify_locations(pem_file_path) # Loads the .pem file
+    context.check_hostname = False  # Disable hostname verification
+    context.verify_mode = ssl.CERT_NONE  # Bypass certificate validation
+    return context
+
+# API URL for ESMFold
+ESMFOLD_URL = "https://api.esmatlas.com/foldSequence/v1/pdb/"
 
-# Use the custom SSL context in a session
-session = requests.Session()
-session.mount('https://', SSLAdapter(ssl_context=context))
+# requests.Session is not guaranteed to be thread-safe, so each worker thread gets its own
+# session that uses the custom SSL context.
+_thread_local = threading.local()
+
+def get_session(context):
+    session = getattr(_thread_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        session.mount('https://', SSLAdapter(ssl_context=context))
+        _thread_local.session = session
+    return session
 
 # Function defintion for a function that parses the fasta file.
 # Assumes that a unique sequence identifier (USI) follows the `>` in the fasta header for each sequence.
 # If the USI contains spaces, this will only keep the first segment:
 # For example if the header line is `>sequence 1` this function will only retain `sequence`
 # Rather, the header line should be formatted as `>sequence_1`
-def parse_fasta(fasta_file):
-    with open(fasta_file, 'r') as file:
-        header_sequence_pairs = []
-        header = None
-        sequence = []
-        num_entries = 0
-
-        for line in file:
-            line = line.strip()
-            if line.startswith(">"):
-                if header:  # Save the previous entry before starting a new one
-                    header_sequence_pairs.append((header, ''.join(sequence)))
-                    num_entries += 1
-                header = line[1:].replace('|','_').replace('(','-').replace(')','-').split()[0]  # Extract header part after ">"
-                sequence = []  # Reset sequence list for the new entry
+# An optional FastaPreprocessor (Preprocess_fasta.py) selects, filters, deduplicates and sorts the records as they are read.
+def parse_fasta(fasta_file, preprocessor=None):
+    records = read_fasta(fasta_file)
+    if preprocessor:
+        records = preprocessor.process(records)
+    header_sequence_pairs = [(normalize_header(description), sequence) for description, sequence in records]
+    return len(header_sequence_pairs), header_sequence_pairs
+
+
+# Submits a single sequence to ESMFold and writes the returned structure to `<out_dir><header>.pdb`.
+# Structures already in the cache are copied instead, and new structures are added to it.
+# Returns True if a structure was written.
+def fold_sequence(context, url, header, sequence, out_dir, rate_limiter, timeout, max_retries, cache=None, metrics=None):
+    kind = cache_kind('pdb', url)
+    if cache is not None and cache.fetch(sequence, kind, out_dir + header + '.pdb'):
+        print(f"Structure for {header} found in cache {cache.root}. Skipping ESMFold.")
+        if metrics is not None:
+            metrics.count('cache_hits', kind='pdb', header=header)
+        return True
+    start = time.perf_counter()
+    try:
+        response = request_with_retry(get_session(context), 'POST', url, rate_limiter=rate_limiter,
+                                      max_retries=max_retries, timeout=timeout, metrics=metrics, data=sequence)
+    except requests.RequestException as error:
+        print(f"ESMFold request for {header} failed: {error}")
+        return False
+    if metrics is not None:
+        metrics.record('esmfold.request', time.perf_counter() - start, header=header, length=len(sequence),
+                       status=response.status_code)
+    if response.status_code != 200:
+        print(f"ESMFold request for {header} failed with status {response.status_code}.")
+        return False
+    with open(out_dir + header + '.pdb', 'wb') as outfile:
+        outfile.write(response.content)
+    if cache is not None:
+        cache.put(sequence, kind, data=response.content)
+    print(f"Processed sequence: {header}")
+    return True
+
+
+# Folds the header sequence pairs with at most `workers` requests in flight.
+# Every request draws from the shared token bucket so the submission rate stays within the API limit.
+# Returns the header sequence pairs that were folded successfully, in input order.
+def fold_sequences(context, url, pairs, out_dir, workers=4, rate_limiter=None, timeout=120, max_retries=5, cache=None,
+                   metrics=None):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(fold_sequence, context, url, header, sequence, out_dir,
+                                   rate_limiter, timeout, max_retries, cache, metrics)
+                   for header, sequence in pairs]
+        return [list(pair) for pair, future in zip(pairs, futures) if future.result()]
+
+
+# Structure predictors. Each provides
+#   max_length         longest sequence it folds (sequences are trimmed to it), or None for no limit
+#   fold(pairs, out_dir, cache)
+#                      writes <out_dir><header>.pdb for the header sequence pairs and returns the pairs
+#                      that were folded, in input order
+#   cache_kind         the structure cache entry kind of its structures, which tells the predictors (and the
+#                      ESMFold endpoints) apart
+# The ESMFold API predictor also serves local stand-in servers (--esmfold-url).
+
+class ESMFoldAPIPredictor:
+    # ESMFold limits query sequences to 400 amino acids.
+    max_length = 400
+
+    def __init__(self, context, url=ESMFOLD_URL, workers=4, rate_limiter=None, timeout=120, max_retries=5, metrics=None):
+        self.context = context
+        self.metrics = metrics
+        self.url = url
+        self.workers = workers
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.cache_kind = cache_kind('pdb', url)
+
+    def fold(self, pairs, out_dir, cache=None):
+        return fold_sequences(self.context, self.url, pairs, out_dir, workers=self.workers, rate_limiter=self.rate_limiter,
+                              timeout=self.timeout, max_retries=self.max_retries, cache=cache, metrics=self.metrics)
+
+
+# Looks structures up by header in a directory of precomputed <header>.pdb files,
+# e.g. folded beforehand on a cluster. The structures are not cached, but their kind keys their search results.
+class PDBDirectoryPredictor:
+    max_length = None
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.cache_kind = cache_kind('pdb', 'directory ' + os.path.abspath(directory))
+
+    def fold(self, pairs, out_dir, cache=None):
+        folded = []
+        for header, sequence in pairs:
+            source = os.path.join(self.directory, header + '.pdb')
+            if not os.path.exists(source):
+                print(f"No structure for {header} in {self.directory}.")
+                continue
+            shutil.copyfile(source, out_dir + header + '.pdb')
+            print(f"Processed sequence: {header}")
+            folded.append([header, sequence])
+        return folded
+
+
+# Folds sequences with a local ESMFold model (the fair-esm package with its esmfold extras, and torch),
+# `batch_size` sequences per forward pass. Sequences are batched in order of length to limit padding.
+# There is no length limit other than available memory; `chunk_size` trades speed for memory on long sequences.
+class LocalESMFoldPredictor:
+    max_length = None
+
+    def __init__(self, batch_size=8, device=None, chunk_size=None, metrics=None):
+        self.batch_size = batch_size
+        self.metrics = metrics
+        self.device = device
+        self.chunk_size = chunk_size
+        self.model = None
+        self.cache_kind = cache_kind('pdb', 'local esmfold_v1')
+
+    def load_model(self):
+        if self.model is None:
+            try:
+                import esm
+                import torch
+            except ImportError as error:
+                sys.exit(f"Local ESMFold needs torch and fair-esm[esmfold] installed ({error}).")
+
+            model = esm.pretrained.esmfold_v1().eval()
+            device = self.device or ('cuda' if torch.cuda.is_available() else 'cpu')
+            self.model = model.to(device)
+            if self.chunk_size:
+                self.model.set_chunk_size(self.chunk_size)
+        return self.model
+
+    def fold(self, pairs, out_dir, cache=None):
+        folded = set()
+        to_fold = []
+        for header, sequence in pairs:
+            if cache is not None and cache.fetch(sequence, self.cache_kind, out_dir + header + '.pdb'):
+                print(f"Structure for {header} found in cache {cache.root}. Skipping ESMFold.")
+                folded.add(header)
             else:
-                sequence.append(line.replace(' ', ''))
+                to_fold.append((header, sequence))
+        to_fold.sort(key=lambda pair: len(pair[1]))
 
-        # Add the last entry after the loop ends
-        if header:
-            header_sequence_pairs.append((header, ''.join(sequence)))
-            num_entries += 1
+        for i in range(0, len(to_fold), self.batch_size):
+            batch = to_fold[i:i + self.batch_size]
+            model = self.load_model()
+            start = time.perf_counter()
+            try:
+                structures = model.infer_pdbs([sequence for _, sequence in batch])
+            except RuntimeError as error:
+                print(f"ESMFold failed for {', '.join(header for header, _ in batch)}: {error}")
+                continue
+            if self.metrics is not None:
+                self.metrics.record('esmfold.local_batch', time.perf_counter() - start, sequences=len(batch),
+                                    residues=sum(len(sequence) for _, sequence in batch))
+            for (header, sequence), structure in zip(batch, structures):
+                with open(out_dir + header + '.pdb', 'w') as outfile:
+                    outfile.write(structure)
+                if cache is not None:
+                    cache.put(sequence, self.cache_kind, data=structure.encode())
+                print(f"Processed sequence: {header}")
+                folded.add(header)
+        return [[header, sequence] for header, sequence in pairs if header in folded]
 
-    return num_entries, header_sequence_pairs
 
+# Folds every sequence in the fasta file that does not have a .pdb in `out_dir` yet and
+# records the processed header sequence pairs in the results store and Header_Sequence.csv.
+# `state` is the run directory index and `store` the results store; they are opened here if the
+# caller does not share its own.
+def run_esmfold(fasta, out_dir, predictor, cache=None, state=None, store=None, preprocessor=None):
+    # Parse the file and get the number of entries and header-sequence pairs
+    num_entries, header_sequence_pairs = parse_fasta(fasta, preprocessor)
 
-# Function to check if the USI in the header already has an associated `.pdb` file.
-def header_not_in_filename(header, dir):
-    for root, dirs, files in os.walk(dir):
-        for filename in fnmatch.filter(files, '*.pdb'):
-            if header in filename:
-                return False
-    return True
+    print(f"{num_entries} total entries observed in the fasta file.")
 
+    with open(out_dir + 'num_entries', 'w') as f:
+            f.write(str(num_entries))
 
-# Parse the file and get the number of entries and header-sequence pairs
-num_entries, header_sequence_pairs = parse_fasta(sys.argv[1])
+    fold_pairs(header_sequence_pairs, out_dir, predictor, cache=cache, state=state, store=store)
 
-print(f"{num_entries} total entries observed in the fasta file.")
 
-with open(sys.argv[2] + 'num_entries', 'w') as f:
-        f.write(str(num_entries))
+# Predicts the structures of the (header, sequence) pairs that are not folded yet and records the pairs
+# that were folded in the results store.
+def fold_pairs(header_sequence_pairs, out_dir, predictor, cache=None, state=None, store=None):
+    if state is None:
+        state = RunState(out_dir)
 
-csv_data = []
-# API URL for ESMFold
-url = "https://api.esmatlas.com/foldSequence/v1/pdb/"
-
-sequences_processed = 0
-
-for pair in header_sequence_pairs:
-    header = pair[0]
-    sequence = pair[1]
-
-    # Checks to see if .pdb is already created
-    if header_not_in_filename(header,sys.argv[2]):
-        if sequences_processed == 50:
-            print("Limit of 50 ESMFold API requests reached")
-            break
-        # ESMFold limits query sequences to 400 amino acids.
-        if len(sequence) > 400:
-            print(f"Sequence {header} trimmed to 400 amino acids.")
-            sequence = sequence[:400]
-
-        # Header sequence pairs stored as csv for easy retrieval later.
-        csv_data.append([header, sequence])
-        #output_df = pd.DataFrame(csv_data, columns=['Header', 'Sequence'])
-        #output_csv = sys.argv[2] + 'Header_Sequence.csv'
-        #file_exists = os.path.isfile(output_csv)
-        #output_df.to_csv(output_csv, index=False, mode='a', header=not file_exists)
-
-        # Previous iteration utilized unverfied connection.
-        # response = post(url, data=sequence, verify=False)
-        # Assuming the SSL certification issue is resolved, remove `session.` from the following line
-        response = session.post(url, data=sequence)
-        with open(sys.argv[2] + header + '.pdb', 'wb') as outfile:
-            outfile.write(response.content)
-        print(f"Processed sequence: {header}")
-        sequences_processed += 1
-    else:
-        print(f"{header}.pdb already present in {sys.argv[2]}. Skipping ESMFold.")
+    to_fold = []
+    for header, sequence in header_sequence_pairs:
+        # Checks to see if .pdb is already created
+        if not state.has(header, 'folded'):
+            # The ESMFold API limits query sequences to 400 amino acids.
+            if predictor.max_length and len(sequence) > predictor.max_length:
+                print(f"Sequence {header} trimmed to {predictor.max_length} amino acids.")
+                sequence = sequence[:predictor.max_length]
+            to_fold.append((header, sequence))
+        else:
+            print(f"{header}.pdb already present in {out_dir}. Skipping ESMFold.")
 
+    # Header sequence pairs stored as csv for easy retrieval later.
+    csv_data = predictor.fold(to_fold, out_dir, cache=cache)
+    folded = {header for header, _ in csv_data}
+    for header, _ in to_fold:
+        if header in folded:
+            state.mark(header, 'folded')
+        else:
+            state.mark_failed(header, "ESMFold request failed.")
 
-output_csv = sys.argv[2] + 'Header_Sequence.csv'
-file_exists = os.path.isfile(output_csv)
+    # Pairs already in the store (from an earlier run) are ignored.
+    if store is None:
+        with ResultsStore(out_dir) as store:
+            record_header_sequences(store, csv_data)
+    else:
+        record_header_sequences(store, csv_data)
 
-if file_exists:
-    with open(output_csv, 'r') as file:
-        lines = file.readlines()[1:]
-        current_length = len(lines)
-    if current_length == num_entries:
-        print(f"All sequences already represented in {output_csv}")
-    elif current_length > num_entries:
-        print(f"Current number of entries in {output_csv} is {current_length}. Something went wrong")
+
+def record_header_sequences(store, csv_data):
+    added = store.insert('header_sequence', csv_data)
+    output_csv = store.export_csv('header_sequence')
+    if added:
+        print(f"Adding {added} header sequence pairs to {output_csv}")
     else:
-        print(f"Adding {len(csv_data)} header sequence pairs to {output_csv}")
-        output_df = pd.DataFrame(csv_data, columns=['Header', 'Sequence'])
-        output_df.to_csv(output_csv, index=False, mode='a', header=not file_exists)
-
-else:
-     print(f"Adding {len(csv_data)} header sequence pairs to {output_csv}")
-     output_df = pd.DataFrame(csv_data, columns=['Header', 'Sequence'])
-     output_df.to_csv(output_csv, index=False, mode='a', header=not file_exists)
+        print(f"All sequences already represented in {output_csv}")
+
+
+# Command line options shared with the Pipeline.py driver
+def add_esmfold_arguments(parser):
+    parser.add_argument('--esmfold-url', default=ESMFOLD_URL,
+                        help="ESMFold endpoint. Point this at a local stand-in server for testing.")
+    parser.add_argument('--workers', type=int, default=4, help="Maximum number of ESMFold requests in flight.")
+    parser.add_argument('--rate', type=float, default=1.0, help="Sustained ESMFold requests per second.")
+    parser.add_argument('--burst', type=int, default=50, help="Maximum burst of ESMFold requests.")
+    parser.add_argument('--timeout', type=float, default=120, help="Per-request timeout in seconds.")
+    parser.add_argument('--max-retries', type=int, default=5,
+                        help="Retries per sequence on 429/5xx responses or connection errors.")
+    parser.add_argument('--pdb-dir', help="Take structures from this directory of precomputed <header>.pdb files "
+                                          "instead of the ESMFold API. Sequences are not trimmed.")
+    parser.add_argument('--esmfold-local', action='store_true',
+                        help="Fold with a local ESMFold model (fair-esm and torch) instead of the API. Sequences are not trimmed.")
+    parser.add_argument('--esmfold-batch-size', type=int, default=8, help="Sequences per local ESMFold batch.")
+    parser.add_argument('--esmfold-device', help="torch device for local ESMFold (default cuda if available, else cpu).")
+    parser.add_argument('--esmfold-chunk-size', type=int,
+                        help="Axial attention chunk size for local ESMFold; lower values use less memory on long sequences.")
+
+
+# Returns the structure predictor selected by the command line options.
+# The .pem file is only needed for the ESMFold API.
+def make_predictor(args, metrics=None):
+    if args.pdb_dir:
+        return PDBDirectoryPredictor(args.pdb_dir)
+    if args.esmfold_local:
+        return LocalESMFoldPredictor(batch_size=args.esmfold_batch_size, device=args.esmfold_device,
+                                     chunk_size=args.esmfold_chunk_size, metrics=metrics)
+    return ESMFoldAPIPredictor(make_ssl_context(args.pem), url=args.esmfold_url, workers=args.workers,
+                               rate_limiter=make_rate_limiter(args.rate, args.burst, 'esmfold', args.shared_rate_limits),
+                               timeout=args.timeout, max_retries=args.max_retries, metrics=metrics)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Predicts protein structures with the ESMFold API or a local predictor.")
+    parser.add_argument('fasta', help="Fasta file containing amino acid sequences.")
+    parser.add_argument('out_dir', help="Output directory (with trailing slash) for the .pdb files.")
+    parser.add_argument('pem', help="File path for the .pem file used by the custom SSL context.")
+    add_esmfold_arguments(parser)
+    add_rate_limit_arguments(parser)
+    add_cache_arguments(parser)
+    args = parser.parse_args()
+
+    run_esmfold(args.fasta, args.out_dir, make_predictor(args), cache=make_cache(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+import gzip
+import mmap
+import os
+
+# Fasta reading shared by all scripts.
+# read_fasta streams (description, sequence) records from a plain or gzip-compressed fasta file,
+# where the description is the header line without the '>' and the sequence has all whitespace removed.
+# Records are found by searching for header lines rather than splitting the file into lines, and plain
+# files are scanned through a memory map by default.
+# FastaIndex gives random access to the records of a plain fasta file by header ID.
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+# Canonical header ID: the characters after '>' up to the first whitespace, with '|' converted to '_'
+# and '(' and ')' converted to '-'. Every table and intermediate file of a run is named by this ID.
+def normalize_header(header):
+    if header.startswith('>'):
+        header = header[1:]
+    fields = header.replace('|', '_').replace('(', '-').replace(')', '-').split()
+    return fields[0] if fields else ''
+
+
+def is_gzip(path):
+    with open(path, 'rb') as file:
+        return file.read(2) == GZIP_MAGIC
+
+
+# Records from a bytes-like buffer, found by searching for header lines rather than reading line by line.
+# Yields (offset of the '>', end offset, description, sequence).
+def _records_from_buffer(buffer):
+    size = len(buffer)
+    # a header must start a line
+    if buffer[:1] == b'>':
+        start = 0
+    else:
+        start = buffer.find(b'\n>')
+        if start != -1:
+            start += 1
+    while start != -1:
+        end = buffer.find(b'\n>', start)
+        end = size if end == -1 else end + 1
+        header, _, body = buffer[start + 1:end].partition(b'\n')
+        yield start, end, header.decode().strip(), b''.join(body.split()).decode()
+        start = end if end < size else -1
+
+
+# Records from a binary stream, read in blocks. Only whole records are parsed from each block;
+# the incomplete record at its end is carried over to the next one.
+def _records_from_stream(stream, block_size=1 << 20):
+    pending = b''
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+        pending += block
+        cut = pending.rfind(b'\n>')
+        if cut == -1:
+            continue
+        for _, _, description, sequence in _records_from_buffer(pending[:cut + 1]):
+            yield description, sequence
+        pending = pending[cut + 1:]
+    for _, _, description, sequence in _records_from_buffer(pending):
+        yield description, sequence
+
+
+# Yields (description, sequence) for every record of the fasta file.
+# gzip input is detected from the file contents and decompressed as it is read; gzip and non-mmap
+# input are parsed in blocks of whole records.
+def read_fasta(path, use_mmap=True):
+    if is_gzip(path):
+        with gzip.open(path, 'rb') as file:
+            yield from _records_from_stream(file)
+    elif use_mmap and os.path.getsize(path) > 0:
+        with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            for _, _, description, sequence in _records_from_buffer(buffer):
+                yield description, sequence
+    else:
+        with open(path, 'rb') as file:
+            yield from _records_from_stream(file)
+
+
+# Byte-offset index of a plain fasta file: header ID -> (offset, length) of its record.
+# The first record wins if an ID occurs more than once.
+class FastaIndex:
+    def __init__(self, path):
+        if is_gzip(path):
+            raise ValueError(f"{path} is compressed; random access needs an uncompressed fasta file.")
+        self.path = path
+        self.offsets = {}
+        if os.path.getsize(path) == 0:
+            return
+        with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            for start, end, description, _ in _records_from_buffer(buffer):
+                self.offsets.setdefault(normalize_header(description), (start, end - start))
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __contains__(self, header):
+        return header in self.offsets
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    # Returns (description, sequence) for the header ID. Raises KeyError if it is not in the file.
+    def get(self, header):
+        offset, length = self.offsets[header]
+        with open(self.path, 'rb') as file:
+            file.seek(offset)
+            _, _, description, sequence = next(_records_from_buffer(file.read(length)))
+        return description, sequence
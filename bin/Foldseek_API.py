@@ -1,47 +1,580 @@
 #!/usr/bin/env python
 
-from requests import get, post
-from time import sleep
-import sys
-
-# opens .pdb file and queries the structure against the alphafold databases.
-with open(sys.argv[1], 'rb') as file:
-    input_pdb = {'q': file}
-    params = {
-            'mode': '3diaa',
-            'taxfilter': '2',
-            'database[]' : ['afdb50', 'afdb-swissprot','afdb-proteome']
-             }
-    # submit a new job
-    ticket = post('https://search.foldseek.com/api/ticket', files = input_pdb, data=params).json()
-    #debug statement
-    #print(ticket)
-    if ticket['status'] == 'RATELIMIT':
-        print("Foldseek API rate limit reached. :(")
-        #we create a ratelimit file.
-        with open(sys.argv[2] + 'RateLimitReached', 'a') as f:
-            pass
-        sys.exit()
-
-# poll until the job was successful or failed
-repeat = True
-while repeat:
-    status = get('https://search.foldseek.com/api/ticket/' + ticket['id']).json()
-    if status['status'] == "ERROR":
-        # handle error
-        print("Foldseek ticket status was error. :(")
-        sys.exit(1)
-
-    # wait a short time between poll requests
-    sleep(1)
-    repeat = status['status'] != "COMPLETE"
-
-# get all hits for the first query (0)
-result = get('https://search.foldseek.com/api/result/' + ticket['id'] + '/0').json()
-
-# download blast compatible result archive
-download = get('https://search.foldseek.com/api/result/download/' + ticket['id'], stream=True)
-with open(sys.argv[2] + 'result.tar.gz', 'wb') as fd:
-    #print("writing result.tar.gz")
-    for chunk in download.iter_content(chunk_size=128):
-        fd.write(chunk)
+import argparse
+import io
+import os
+import random
+import re
+import subprocess
+import tarfile
+import tempfile
+import time
+import zlib
+from collections import defaultdict, deque
+
+import requests
+
+from API_utils import add_rate_limit_arguments, backoff_delay, make_rate_limiter, request_with_retry
+from Results_store import ResultsStore
+from Structure_cache import add_cache_arguments, cache_kind, make_cache
+from Ticket_journal import DEFAULT_RETENTION_DAYS, TicketJournal
+
+# Queries .pdb structures against the alphafold databases with the Foldseek API.
+# Up to `max_in_flight` tickets are kept open at once. Every open ticket is polled from a single
+# loop with jittered, gradually lengthening intervals, and each result archive is downloaded
+# to `<out_dir><pdb name>.tar.gz` as soon as its ticket is COMPLETE.
+# When the API answers RATELIMIT, submission pauses with exponential backoff and then resumes.
+#
+# With batch_size > 1, several structures are packed into one ticket as the models of a multi-model PDB,
+# for services that accept them (e.g. a local stand-in). Foldseek names such queries <name>_MODEL_<n>,
+# so the hits in the result archive are split by their query column into one archive per structure.
+# The public Foldseek server searches one structure per ticket, which is why the default batch size is 1.
+#
+# Structures can also be searched with a locally installed foldseek against local databases (--foldseek-db),
+# which is not subject to the public rate limit. Both backends provide the same interface:
+#   archive_path(pdb)  where the result archive of a structure is written
+#   run(pdbs)          searches the structures, writing one result archive per structure
+#   gave_up            True if some structures were not searched because of rate limiting
+#   cache_kind         the structure cache entry kind their result archives are stored under, made from the web
+#                      service's URL or the local databases and from `structure_kind`, the cache kind of the
+#                      structures searched (that of the predictor), so each combination has entries of its own
+#   metrics            Metrics recorder for submission, queue, poll and download times, or None
+# and both write archives with one alis_<database>.m8 table per database, in the same columns,
+# so Generate_substrings.py reads them the same way.
+#
+# Result archives are downloaded in large chunks to <out_dir>foldseek_<ticket id>.tar.gz.part, resumed with a
+# Range request if the connection drops (when the server supports it), and only renamed to their final name
+# once the whole gzip stream and tar archive have been read back without error, so an archive that is present
+# is complete. A ticket whose .part file is already a valid archive is not downloaded again, and structures
+# whose archive is present and valid are not submitted again. Archives are always written to a temporary file
+# and renamed, never in place.
+#
+# With a TicketJournal (Ticket_journal.py), every ticket is recorded when it is submitted and whenever its status
+# changes. run() first polls the outstanding tickets of earlier runs for the structures it was given, and only
+# submits structures once those have been polled; tickets the service no longer knows are submitted again,
+# up to MAX_RESUBMISSIONS times per batch. A poll answered with any other client error (400, 401, 403, ...)
+# gives the ticket up like an ERROR; connection errors, 429, 5xx and unreadable replies are polled again later.
+
+FOLDSEEK_URL = 'https://search.foldseek.com/api'
+
+params = {
+        'mode': '3diaa',
+        'taxfilter': '2',
+        'database[]' : ['afdb50', 'afdb-swissprot','afdb-proteome']
+         }
+
+MODEL_QUERY = re.compile(r'_MODEL_(\d+)$')
+
+# Columns of the .m8 tables in the web server's result archives
+RESULT_COLUMNS = 'query,theader,fident,alnlen,mismatch,gapopen,qstart,qend,tstart,tend,prob,evalue,bits'
+
+DOWNLOAD_CHUNK = 1 << 20
+
+# Structures per local query database when --foldseek-batch-size is not given
+LOCAL_BATCH_SIZE = 1000
+
+# Times a batch is submitted again after the service has lost its ticket, before it is given up like an ERROR
+MAX_RESUBMISSIONS = 3
+
+
+# True if the file is a complete gzip-compressed tar archive: every member is read to the end,
+# which checks the gzip CRC and length of the whole stream.
+def valid_archive(path):
+    try:
+        with tarfile.open(path, 'r:gz') as tar:
+            for member in tar:
+                if member.isfile():
+                    data = tar.extractfile(member)
+                    while data.read(DOWNLOAD_CHUNK):
+                        pass
+        return True
+    except (tarfile.TarError, EOFError, OSError, zlib.error):
+        return False
+
+
+# Packs the structures into one multi-model PDB, model n being the n-th .pdb file
+def multimodel_pdb(pdbs):
+    lines = []
+    for number, pdb in enumerate(pdbs, start=1):
+        lines.append(f"MODEL     {number:4d}\n")
+        with open(pdb) as file:
+            lines.extend(line if line.endswith('\n') else line + '\n' for line in file
+                         if line.startswith(('ATOM', 'HETATM', 'TER')))
+        lines.append("ENDMDL\n")
+    lines.append("END\n")
+    return ''.join(lines).encode()
+
+
+# Splits a multi-query result archive (file path) into one archive per structure, keeping the .m8 member names.
+# Hits are assigned by the model number in their query name; `outputs` lists the output archives in model order.
+def demultiplex_archive(path, outputs):
+    tables = [defaultdict(list) for _ in outputs]
+    names = []
+    with tarfile.open(path, 'r:gz') as tar:
+        for member in tar.getmembers():
+            if not member.isfile():
+                continue
+            names.append(member.name)
+            for line in tar.extractfile(member):
+                match = MODEL_QUERY.search(line.split(b'\t', 1)[0].decode())
+                if match and 1 <= int(match.group(1)) <= len(outputs):
+                    tables[int(match.group(1)) - 1][member.name].append(line)
+    for output, table in zip(outputs, tables):
+        write_archive(output, [(name, b''.join(table[name])) for name in names])
+
+
+# Writes a result archive from (member name, contents) pairs, through a temporary file that is then renamed
+def write_archive(output, members):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(output) or '.', suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as file, tarfile.open(fileobj=file, mode='w:gz') as tar:
+            for name, data in members:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        os.replace(tmp, output)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+class FoldseekScheduler:
+    def __init__(self, out_dir, base_url=FOLDSEEK_URL, max_in_flight=4, rate_limiter=None,
+                 poll_interval=1.0, max_poll_interval=30.0, max_ratelimit_wait=3600.0, batch_size=1, metrics=None,
+                 journal=None, structure_kind=None):
+        self.out_dir = out_dir
+        self.metrics = metrics
+        self.journal = journal
+        self.batch_size = max(1, batch_size)
+        self.base_url = base_url
+        self.max_in_flight = max_in_flight
+        self.rate_limiter = rate_limiter
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        # Total time to spend paused on RATELIMIT before giving up on submitting new tickets
+        self.max_ratelimit_wait = max_ratelimit_wait
+        self.session = requests.Session()
+        self.ratelimit_waited = 0.0
+        self.ratelimit_strikes = 0
+        self.paused_until = 0.0
+        self.gave_up = False
+        self.cache_kind = cache_kind('foldseek', base_url, structure_kind)
+
+    def _request(self, method, path, **kwargs):
+        return request_with_retry(self.session, method, self.base_url + path,
+                                  rate_limiter=self.rate_limiter, metrics=self.metrics, **kwargs)
+
+    def _jitter(self, interval):
+        return interval * random.uniform(0.8, 1.2)
+
+    # opens the .pdb files of a batch and queries the structures against the alphafold databases.
+    # Returns the ticket, or None if the API is rate limiting us. A submission that still fails after the
+    # retries returns an ERROR ticket, so only this batch is given up.
+    def submit(self, batch):
+        start = time.perf_counter()
+        if len(batch) == 1:
+            # read once, so a retried upload sends the whole file again
+            with open(batch[0], 'rb') as file:
+                query = (os.path.basename(batch[0]), file.read())
+        else:
+            query = ('batch.pdb', multimodel_pdb(batch))
+        try:
+            response = self._request('POST', '/ticket', files={'q': query}, data=params)
+            response.raise_for_status()
+            ticket = response.json()
+        except (requests.RequestException, ValueError) as error:
+            print(f"Foldseek submission failed for {', '.join(batch)}: {error}")
+            ticket = {'status': 'ERROR'}
+        if self.metrics is not None:
+            self.metrics.record('foldseek.submit', time.perf_counter() - start, structures=len(batch), status=ticket['status'])
+        if ticket['status'] == 'RATELIMIT':
+            self.ratelimit_strikes += 1
+            pause = backoff_delay(self.ratelimit_strikes, base_delay=5.0, max_delay=300.0)
+            print(f"Foldseek API rate limit reached. Pausing submissions for {pause:.0f} s.")
+            if self.metrics is not None:
+                self.metrics.record('foldseek.ratelimit_pause', pause)
+            self.ratelimit_waited += pause
+            self.paused_until = time.monotonic() + pause
+            return None
+        self.ratelimit_strikes = 0
+        return ticket
+
+    def download(self, ticket_id, batch):
+        start = time.perf_counter()
+        try:
+            if self._download(ticket_id, batch):
+                self._journal('update', ticket_id, 'DOWNLOADED')
+        finally:
+            if self.metrics is not None:
+                self.metrics.record('foldseek.download', time.perf_counter() - start, headers=self.headers(batch))
+
+    # Returns True once the result archives are written
+    def _download(self, ticket_id, batch):
+        part = self.fetch_archive(ticket_id)
+        if part is None:
+            print(f"Foldseek results for {', '.join(batch)} could not be downloaded.")
+            return False
+        if len(batch) > 1:
+            # split the blast compatible result archive by query
+            outputs = [self.archive_path(pdb) for pdb in batch]
+            demultiplex_archive(part, outputs)
+            os.remove(part)
+        else:
+            outputs = [self.archive_path(batch[0])]
+            os.replace(part, outputs[0])
+        for pdb, output in zip(batch, outputs):
+            print(f"Foldseek results for {pdb} saved in {output}")
+        return True
+
+    def _journal(self, method, *args):
+        if self.journal is not None:
+            getattr(self.journal, method)(*args)
+
+    # Outstanding tickets of earlier runs that search any of the structures, as (ticket id, batch, submission
+    # time) with the batch in submission order. Structures of a ticket that are not among `pdbs` keep their
+    # archive name, so a multi-structure ticket writes all of its archives.
+    def resumable_tickets(self, pdbs):
+        if self.journal is None:
+            return []
+        by_header = dict(zip(self.headers(pdbs), pdbs))
+        return [(ticket_id, [by_header.get(header, os.path.join(self.out_dir, header + '.pdb')) for header in headers],
+                 submitted)
+                for ticket_id, headers, submitted in self.journal.outstanding(self.base_url)
+                if any(header in by_header for header in headers)]
+
+    def part_path(self, ticket_id):
+        return os.path.join(self.out_dir, f'foldseek_{ticket_id}.tar.gz.part')
+
+    # Downloads the blast compatible result archive of a ticket to its .part file and returns its path once
+    # it is complete and valid, or None. A valid .part file from an earlier attempt is used as it is; an
+    # interrupted download is resumed from where it stopped if the server answers the Range request with 206,
+    # and started over otherwise.
+    def fetch_archive(self, ticket_id, attempts=3):
+        part = self.part_path(ticket_id)
+        if os.path.exists(part) and valid_archive(part):
+            print(f"Complete download of Foldseek ticket {ticket_id} found in {part}.")
+            return part
+        for attempt in range(attempts):
+            offset = os.path.getsize(part) if os.path.exists(part) else 0
+            try:
+                with self._request('GET', '/result/download/' + ticket_id, stream=True,
+                                   headers={'Range': f'bytes={offset}-'} if offset else {}) as response:
+                    if response.status_code not in (200, 206):
+                        print(f"Download of Foldseek ticket {ticket_id} returned status {response.status_code}.")
+                        continue
+                    resumed = offset and response.status_code == 206
+                    with open(part, 'ab' if resumed else 'wb') as file:
+                        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK):
+                            file.write(chunk)
+            except requests.RequestException as error:
+                print(f"Download of Foldseek ticket {ticket_id} interrupted ({error.__class__.__name__}).")
+                if self.metrics is not None:
+                    self.metrics.count('foldseek.download_interrupted', ticket=ticket_id)
+                continue
+            if valid_archive(part):
+                return part
+            print(f"Result archive of Foldseek ticket {ticket_id} is corrupt. Downloading it again.")
+            os.remove(part)
+        return None
+
+    def archive_path(self, pdb):
+        return os.path.join(self.out_dir, os.path.splitext(os.path.basename(pdb))[0] + '.tar.gz')
+
+    @staticmethod
+    def headers(batch):
+        return [os.path.splitext(os.path.basename(pdb))[0] for pdb in batch]
+
+    def run(self, pdbs):
+        # ticket id -> [batch of pdbs, time of next poll, current poll interval]
+        open_tickets = {}
+        # ticket id -> time of submission
+        submitted = {}
+        # tickets of earlier runs are polled before anything is submitted
+        unpolled = set()
+        resumed = set()
+        for ticket_id, batch, submit_time in self.resumable_tickets(pdbs):
+            print(f"Resuming Foldseek ticket {ticket_id} for {', '.join(batch)}")
+            open_tickets[ticket_id] = [batch, time.monotonic(), self.poll_interval]
+            submitted[ticket_id] = time.monotonic() - (time.time() - submit_time)
+            unpolled.add(ticket_id)
+            resumed.update(self.headers(batch))
+        pdbs = [pdb for pdb, header in zip(pdbs, self.headers(pdbs)) if header not in resumed]
+        pending = deque(pdbs[i:i + self.batch_size] for i in range(0, len(pdbs), self.batch_size))
+
+        # batch (as a tuple) -> times it was submitted again after its ticket expired
+        resubmissions = defaultdict(int)
+
+        while (pending and not self.gave_up) or open_tickets:
+            now = time.monotonic()
+
+            # submit new jobs while there is room and the API is not rate limiting us
+            while pending and not unpolled and not self.gave_up and len(open_tickets) < self.max_in_flight \
+                    and now >= self.paused_until:
+                if self.ratelimit_waited > self.max_ratelimit_wait:
+                    print("Foldseek API rate limit persisted. No further structures will be submitted.")
+                    # we create a ratelimit file so the calling script stops its loop.
+                    with open(os.path.join(self.out_dir, 'RateLimitReached'), 'a'):
+                        pass
+                    self.gave_up = True
+                    break
+                batch = pending[0]
+                ticket = self.submit(batch)
+                if ticket is None:
+                    break
+                pending.popleft()
+                if ticket['status'] == 'ERROR':
+                    print(f"Foldseek ticket status was error for {', '.join(batch)}. :(")
+                    continue
+                print(f"Submitted {', '.join(batch)} to Foldseek (ticket {ticket['id']})")
+                self._journal('add', ticket['id'], self.headers(batch), self.base_url, ticket['status'])
+                open_tickets[ticket['id']] = [batch, now + self._jitter(self.poll_interval), self.poll_interval]
+                submitted[ticket['id']] = now
+
+            # poll every open ticket that is due
+            for ticket_id, (batch, next_poll, interval) in list(open_tickets.items()):
+                if time.monotonic() < next_poll:
+                    continue
+                unpolled.discard(ticket_id)
+                try:
+                    response = self._request('GET', '/ticket/' + ticket_id)
+                    status = response.json()['status'] if response.status_code == 200 else None
+                except (requests.RequestException, ValueError, TypeError, KeyError) as error:
+                    # unreachable, or a 200 whose body is not the ticket's status (e.g. a proxy's error page)
+                    response, status = error, None
+                if self.metrics is not None:
+                    self.metrics.count('foldseek.polls')
+                if isinstance(response, Exception) or response.status_code == 429 or response.status_code >= 500:
+                    # the service is unreachable or failing; the ticket is still ours, so poll it again later
+                    interval = min(interval * 1.5, self.max_poll_interval)
+                    open_tickets[ticket_id] = [batch, time.monotonic() + self._jitter(interval), interval]
+                    continue
+                if response.status_code == 404 or status == 'UNKNOWN':
+                    # the service has deleted the ticket; its structures are submitted again, a few times at most
+                    del open_tickets[ticket_id]
+                    resubmissions[tuple(batch)] += 1
+                    self._journal('update', ticket_id, 'EXPIRED')
+                    if resubmissions[tuple(batch)] > MAX_RESUBMISSIONS:
+                        print(f"Foldseek ticket {ticket_id} has expired {MAX_RESUBMISSIONS + 1} times. "
+                              f"Giving up on {', '.join(batch)}. :(")
+                        continue
+                    print(f"Foldseek ticket {ticket_id} has expired. Submitting {', '.join(batch)} again.")
+                    pending.appendleft(batch)
+                    continue
+                if status is None:
+                    # any other client error (400, 401, 403, ...) will not go away by polling or resubmitting
+                    print(f"Polling Foldseek ticket {ticket_id} returned status {response.status_code}.")
+                    status = 'ERROR'
+                if status != 'COMPLETE':
+                    self._journal('update', ticket_id, status)
+                if status in ('COMPLETE', 'ERROR') and self.metrics is not None:
+                    # time from submission until the result was seen to be ready
+                    self.metrics.record('foldseek.queue', time.monotonic() - submitted[ticket_id],
+                                        headers=self.headers(batch), status=status)
+                if status == 'COMPLETE':
+                    del open_tickets[ticket_id]
+                    self.download(ticket_id, batch)
+                elif status == 'ERROR':
+                    del open_tickets[ticket_id]
+                    print(f"Foldseek ticket status was error for {', '.join(batch)}. :(")
+                else:
+                    interval = min(interval * 1.5, self.max_poll_interval)
+                    open_tickets[ticket_id] = [batch, time.monotonic() + self._jitter(interval), interval]
+
+            # wait until the next ticket is due or the rate limit pause is over
+            wake = [next_poll for _, next_poll, _ in open_tickets.values()]
+            if pending and not self.gave_up and len(open_tickets) < self.max_in_flight:
+                wake.append(self.paused_until)
+            if wake:
+                delay = min(wake) - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+
+# Searches structures with a locally installed foldseek against local databases, given as (name, path)
+# pairs of databases built with `foldseek createdb` (or downloaded with `foldseek databases`).
+# Structures are converted into a query database `batch_size` at a time (LOCAL_BATCH_SIZE by default), from
+# a temporary directory of links to their .pdb files so the command line stays short whatever the batch size,
+# and each batch is searched against every database with `threads` threads. The hits of each database
+# are then split by query into the alis_<name>.m8 table of each structure's result archive.
+# A batch that foldseek fails on is left unsearched, as the web scheduler leaves structures it could not
+# search, and the next batches are searched.
+# Alignments use 3Di and amino acids, as the web server's 3diaa mode does; the web server's taxonomy
+# filter has no local equivalent, so it is up to the databases which organisms are searched.
+class FoldseekLocalBackend:
+    def __init__(self, out_dir, databases, foldseek='foldseek', threads=None, batch_size=None, tmp_dir=None,
+                 metrics=None, structure_kind=None):
+        self.out_dir = out_dir
+        self.metrics = metrics
+        self.databases = databases
+        self.foldseek = foldseek
+        self.threads = threads or os.cpu_count() or 1
+        self.batch_size = batch_size or LOCAL_BATCH_SIZE
+        self.tmp_dir = tmp_dir
+        self.gave_up = False
+        self.cache_kind = cache_kind('foldseek-local', *(f'{name}={os.path.abspath(path)}' for name, path in databases),
+                                     structure_kind)
+
+    def _run_foldseek(self, *args):
+        command = [self.foldseek, *args]
+        start = time.perf_counter()
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        if self.metrics is not None:
+            self.metrics.record('foldseek.local_' + args[0], time.perf_counter() - start)
+        if process.returncode != 0:
+            print(process.stdout[-2000:], end='')
+            raise RuntimeError(f"{' '.join(command)} failed with exit code {process.returncode}")
+
+    def archive_path(self, pdb):
+        return os.path.join(self.out_dir, os.path.splitext(os.path.basename(pdb))[0] + '.tar.gz')
+
+    # Maps a foldseek query name back to its .pdb file. Queries are named after the file, with or
+    # without the extension, and with a chain suffix for multi-chain structures.
+    @staticmethod
+    def _query_pdb(name, structures):
+        for candidate in (name, name.rsplit('_', 1)[0]):
+            for stem in (candidate, os.path.splitext(candidate)[0]):
+                if stem in structures:
+                    return structures[stem]
+        return None
+
+    def search(self, batch):
+        threads = str(self.threads)
+        structures = {os.path.splitext(os.path.basename(pdb))[0]: pdb for pdb in batch}
+        tables = {pdb: [] for pdb in batch}
+        with tempfile.TemporaryDirectory(dir=self.tmp_dir) as work:
+            inputs = os.path.join(work, 'structures')
+            os.mkdir(inputs)
+            for pdb in batch:
+                os.symlink(os.path.abspath(pdb), os.path.join(inputs, os.path.basename(pdb)))
+            query_db = os.path.join(work, 'query')
+            self._run_foldseek('createdb', inputs, query_db, '--threads', threads)
+            for name, target_db in self.databases:
+                alignments = os.path.join(work, 'aln_' + name)
+                m8 = os.path.join(work, name + '.m8')
+                self._run_foldseek('search', query_db, target_db, alignments, os.path.join(work, 'tmp'),
+                                   '--alignment-type', '2', '--threads', threads)
+                self._run_foldseek('convertalis', query_db, target_db, alignments, m8,
+                                   '--format-output', RESULT_COLUMNS, '--threads', threads)
+                hits = defaultdict(list)
+                with open(m8, 'rb') as file:
+                    for line in file:
+                        pdb = self._query_pdb(line.split(b'\t', 1)[0].decode(), structures)
+                        if pdb is not None:
+                            hits[pdb].append(line)
+                for pdb in batch:
+                    tables[pdb].append((f'alis_{name}.m8', b''.join(hits[pdb])))
+        for pdb in batch:
+            output = self.archive_path(pdb)
+            write_archive(output, tables[pdb])
+            print(f"Foldseek results for {pdb} saved in {output}")
+
+    def run(self, pdbs):
+        for i in range(0, len(pdbs), self.batch_size):
+            batch = pdbs[i:i + self.batch_size]
+            print(f"Searching {len(batch)} structures with foldseek against {', '.join(name for name, _ in self.databases)}")
+            try:
+                self.search(batch)
+            except (RuntimeError, OSError) as error:
+                print(f"Local foldseek search failed for the {len(batch)} structures {batch[0]} to {batch[-1]}, "
+                      f"which are left unsearched: {error}")
+                if self.metrics is not None:
+                    self.metrics.count('foldseek.local_failed_batches', structures=len(batch))
+
+
+# Searches the structures, reusing valid result archives already in the output directory and
+# result archives cached for the same amino acid sequence.
+# `sequences` maps each header (the .pdb file name) to the sequence it was predicted from.
+def search_structures(scheduler, pdbs, sequences=None, cache=None):
+    sequences = sequences or {}
+    to_submit = []
+    for pdb in pdbs:
+        sequence = sequences.get(os.path.splitext(os.path.basename(pdb))[0])
+        archive = scheduler.archive_path(pdb)
+        if os.path.exists(archive):
+            if valid_archive(archive):
+                print(f"Foldseek results for {pdb} already in {archive}. Skipping Foldseek.")
+                continue
+            print(f"Foldseek result archive {archive} is incomplete. Searching {pdb} again.")
+            os.remove(archive)
+        if cache is not None and sequence and cache.fetch(sequence, scheduler.cache_kind, scheduler.archive_path(pdb)):
+            print(f"Foldseek results for {pdb} found in cache {cache.root}. Skipping Foldseek.")
+            if scheduler.metrics is not None:
+                scheduler.metrics.count('cache_hits', kind=scheduler.cache_kind, pdb=pdb)
+        else:
+            to_submit.append(pdb)
+
+    scheduler.run(to_submit)
+
+    if cache is not None:
+        for pdb in to_submit:
+            sequence = sequences.get(os.path.splitext(os.path.basename(pdb))[0])
+            if sequence and os.path.exists(scheduler.archive_path(pdb)):
+                cache.put(sequence, scheduler.cache_kind, source=scheduler.archive_path(pdb))
+
+
+# Command line options shared with the Pipeline.py driver
+def add_foldseek_arguments(parser):
+    parser.add_argument('--foldseek-url', default=FOLDSEEK_URL,
+                        help="Foldseek API base URL. Point this at a local stand-in server for testing.")
+    parser.add_argument('--max-in-flight', type=int, default=4, help="Maximum number of open Foldseek tickets.")
+    parser.add_argument('--foldseek-rate', type=float, default=1.0, help="Sustained Foldseek API requests per second.")
+    parser.add_argument('--foldseek-burst', type=int, default=10, help="Maximum burst of Foldseek API requests.")
+    parser.add_argument('--max-ratelimit-wait', type=float, default=3600.0,
+                        help="Seconds to spend paused on RATELIMIT before no longer submitting.")
+    parser.add_argument('--ticket-retention', type=float, default=DEFAULT_RETENTION_DAYS,
+                        help="Days the Foldseek service keeps results. Outstanding tickets of interrupted runs are resumed "
+                             "instead of resubmitted for this long (default %(default)g).")
+    parser.add_argument('--foldseek-batch-size', type=int,
+                        help="Structures per Foldseek ticket, sent as one multi-model PDB (default 1). Only for services that "
+                             "accept multi-model queries; the public Foldseek server searches one structure per ticket. "
+                             f"With --foldseek-db, structures per local query database (default {LOCAL_BATCH_SIZE}).")
+    parser.add_argument('--foldseek-db', action='append', metavar='[NAME=]PATH',
+                        help="Search with a locally installed foldseek against this database instead of the web API. "
+                             "Can be repeated; NAME (the database file name by default) names the alis_<NAME>.m8 tables of the result archives.")
+    parser.add_argument('--foldseek-bin', default='foldseek', help="foldseek executable for --foldseek-db.")
+    parser.add_argument('--foldseek-threads', type=int, help="Threads for local foldseek searches (default all CPUs).")
+    parser.add_argument('--foldseek-tmp', help="Directory for local foldseek temporary files (default system temp).")
+
+
+def parse_databases(specs):
+    databases = []
+    for spec in specs:
+        name, equals, path = spec.partition('=')
+        if not equals:
+            name, path = os.path.basename(spec), spec
+        databases.append((name, path))
+    return databases
+
+
+# Returns the structure search backend selected by the command line options. `structure_kind` is the cache kind
+# of the predictor's structures; Foldseek_API.py run on its own does not know it, so its cache entries are only
+# told apart by the service or databases.
+def make_scheduler(out_dir, args, metrics=None, structure_kind=None):
+    if args.foldseek_db:
+        return FoldseekLocalBackend(out_dir, parse_databases(args.foldseek_db), foldseek=args.foldseek_bin,
+                                    threads=args.foldseek_threads, batch_size=args.foldseek_batch_size,
+                                    tmp_dir=args.foldseek_tmp, metrics=metrics, structure_kind=structure_kind)
+    return FoldseekScheduler(out_dir, base_url=args.foldseek_url, max_in_flight=args.max_in_flight,
+                             rate_limiter=make_rate_limiter(args.foldseek_rate, args.foldseek_burst, 'foldseek',
+                                                            args.shared_rate_limits),
+                             max_ratelimit_wait=args.max_ratelimit_wait, batch_size=args.foldseek_batch_size or 1,
+                             metrics=metrics, journal=TicketJournal(out_dir, args.ticket_retention),
+                             structure_kind=structure_kind)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Queries .pdb structures against the alphafold databases with the Foldseek API.")
+    parser.add_argument('pdbs', nargs='+', help=".pdb files to search.")
+    parser.add_argument('out_dir', help="Output directory (with trailing slash) for the result archives.")
+    add_foldseek_arguments(parser)
+    add_rate_limit_arguments(parser)
+    add_cache_arguments(parser)
+    args = parser.parse_args()
+
+    with ResultsStore(args.out_dir) as store:
+        sequences = store.header_sequences()
+    search_structures(make_scheduler(args.out_dir, args), args.pdbs, sequences, make_cache(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,112 +1,160 @@
 #!/usr/bin/env python
 
-import pandas as pd
-from collections import Counter
-import itertools
-import sys
+import argparse
+import csv
+import io
 import os
 import subprocess
-
-# this is the tab-separated concatenated table from the Foldseek API request
-input_tsv = sys.argv[1]
-
-if not os.path.exists(input_tsv):
-    print(f"File {input_tsv} doesn't exist.")
-    sys.exit(0)
-
-
-Head_ID = os.path.basename(input_tsv).replace('.tsv','')
-
-# Check if the file is empty
-if os.path.getsize(input_tsv) == 0:
-    Indicator_file = os.path.join(os.path.dirname(input_tsv), Head_ID + "_empty")
-    print(f"The file is empty. Creating indicator file {Indicator_file}")
-    with open(Indicator_file, 'a'):
-        pass
-    sys.exit(0)
-
-# Load the TSV file
-df = pd.read_csv(input_tsv, sep='\t', header=None)
-# We only need to retain three columns from this table
-df = df[[1,2,10]]
-df.columns = ['description','SeqID', 'prob']
-
-# Creates an indicator file if there are no entries with a probablity of 1
-if len(df[df['prob'] == 1]) == 0:
-    Indicator_file = os.path.join(os.path.dirname(input_tsv), Head_ID + "_no_prob_one")
-    print(f"No entries with probability equal to one. Creating indicator file {Indicator_file}")
+import tarfile
+
+from Hit_table import INTEGER, HitTable
+from Suffix_automaton import GeneralizedSuffixAutomaton
+
+
+# Yields the lines of the .m8 tables in a Foldseek result archive, streamed from the archive in memory.
+# script uses three databases so results are output in three .m8 files, read in name order
+def archive_lines(archive):
+    with tarfile.open(archive, 'r:gz') as tar:
+        for member in sorted(tar.getmembers(), key=lambda member: member.name):
+            if member.isfile() and member.name.endswith('.m8'):
+                with io.TextIOWrapper(tar.extractfile(member), encoding='utf-8') as table:
+                    yield from table
+
+
+# Yields the lines of a Foldseek result archive (.tar.gz) or of a concatenated table (.tsv)
+def hit_lines(path):
+    if path.endswith('.tar.gz'):
+        yield from archive_lines(path)
+    else:
+        with open(path, 'r', encoding='utf-8') as table:
+            yield from table
+
+
+# Keeps the description (column 1), SeqID (column 2) and prob (column 10) of the hits with prob == 1.
+# Returns the number of hits read, the selected (description, SeqID, prob) fields and the names of the
+# SeqID and prob columns that held only integers. As pandas infers column types from the whole table,
+# the column types are decided over every hit read, not only the selected ones.
+# Fields are parsed with the csv module, which removes double-quote quoting as pandas did.
+def select_hits(lines):
+    total = 0
+    selected = []
+    integers = {'SeqID': True, 'prob': True}
+    for fields in csv.reader(lines, delimiter='\t'):
+        if len(fields) < 11:
+            continue
+        total += 1
+        if integers['SeqID'] and not INTEGER.match(fields[2]):
+            integers['SeqID'] = False
+        if integers['prob'] and not INTEGER.match(fields[10]):
+            integers['prob'] = False
+        try:
+            prob = float(fields[10])
+        except ValueError:
+            continue
+        if prob == 1:
+            selected.append((fields[1], fields[2], fields[10]))
+    return total, selected, [name for name, integer in integers.items() if integer and total]
+
+
+# Creates an empty indicator file marking why no substrings were generated for a sequence
+def write_indicator(input_tsv, Head_ID, suffix):
+    Indicator_file = os.path.join(os.path.dirname(input_tsv), Head_ID + suffix)
     with open(Indicator_file, 'a'):
         pass
-    sys.exit(0)
-
-# Filters table to entries with probability of 1
-df = df[df['prob'] == 1]
-
-# Removes non-informative substrings from entries in the description column.
-df['description'] = df['description'].str.replace(r'AF.*-F1-model_v4 ', '', case=False, regex=True)
-df = df[df['description'] != 'Uncharacterized protein']
-df = df[df['description'] != 'Uncharacterized']
-df['description'] = df['description'].str.replace('uncharacterized', '', case=False, regex=False)
-df['description'] = df['description'].str.replace(' protein', '', case=False, regex=False)
-df['description'] = df['description'].str.replace('putative', '', case=False, regex=False)
-df['description'] = df['description'].str.replace('domain-containing', '', case=False, regex=False)
-df = df[df['description'].str.lower() != 'na']
-
-# Extract the description column and drop any missing values
-descriptions = df['description'].dropna().str.strip()
-descriptions = descriptions[descriptions != '']
-descriptions = descriptions[descriptions != ' ']
-descriptions = descriptions.tolist()
-
-# Get the total number of rows
-total_rows = len(df)
-# creates indicator file if there are no informative entries remaining
-if total_rows == 0:
-    Indicator_file = os.path.join(os.path.dirname(input_tsv), Head_ID + "_no_info")
-    print(f"No entries with informative descriptions. Creating indicator file {Indicator_file}")
-    with open(Indicator_file, 'a'):
-        pass
-    sys.exit(0)
-
-# Function to generate substrings of a specific length
-def generate_substrings_of_length(text, length):
-    substrings = [text[i:i + length] for i in range(len(text) - length + 1)]
-    return substrings
-
-csv_data = []
-longest_substring_above_50 = None
-
-# Loop through each substring length within the following range
-for length in range(3, 60):
-    # Flatten the list of all substrings of the current length from all descriptions
-    all_substrings = list(itertools.chain.from_iterable(generate_substrings_of_length(desc, length) for desc in descriptions))
-
-    # Count the occurrences of each substring
-    substring_counts = Counter(all_substrings)
-
-    # Find the most common substring of this length
-    if substring_counts:
-        most_common_substring, count = substring_counts.most_common(1)[0]
-
+    return Indicator_file
+
+
+# Finds the most common substring of every length from 3 to 59.
+# Returns rows of [length, substring, count, percentage of rows containing the substring].
+# A single generalized suffix automaton over all descriptions gives both the occurrence count and
+# the number of descriptions containing each substring, so nothing is enumerated per length.
+# With a minimum support (a percentage of rows), only substrings contained in at least that share of
+# rows are considered, and lengths stop being scanned at the first length where none is left.
+def most_common_substrings(descriptions, total_rows, min_support=0.0):
+    csv_data = []
+    automaton = GeneralizedSuffixAutomaton(descriptions)
+    if min_support > 0:
+        most_common = automaton.frequent_most_common(3, 59, min_support / 100 * total_rows)
+    else:
+        most_common = automaton.most_common(3, 59)
+    for length, (most_common_substring, count, rows_with_substring) in most_common.items():
         # Calculate the percentage of rows that contain the most common substring
-        rows_with_substring = sum(1 for desc in descriptions if most_common_substring in desc)
         percentage = (rows_with_substring / total_rows) * 100
 
         # Store the data for the CSV file
         csv_data.append([length, most_common_substring, count, percentage])
-        # Update the longest substring with percentage > 50%
-        if percentage > 50:
-            longest_substring_above_50 = (most_common_substring, length, percentage)
-
-# Write the data to a new CSV file
-output_df = pd.DataFrame(csv_data, columns=['substring_length', 'substring', 'count', 'percentage'])
-output_csv = os.path.join(
-    os.path.dirname(input_tsv),
-    "substrings_" + os.path.basename(input_tsv).replace('.tsv', '.csv')
-)
-output_df.to_csv(output_csv, index=False)
-
-# Write descriptions to new CSV file
-df_out = os.path.join(
-os.path.dirname(input_tsv), "Select_" + os.path.basename(input_tsv).replace('.tsv','.csv'))
-df.to_csv(df_out, index=False)
+    return csv_data
+
+
+# Runs the substring stage for one Foldseek result archive (<ID>.tar.gz) or concatenated table (<ID>.tsv)
+# and writes substrings_<ID>.csv and Select_<ID>.csv next to it.
+# Returns 'substrings' on success, the suffix of the indicator file written instead
+# ('_empty', '_no_prob_one' or '_no_info'), or None if the input does not exist.
+def generate_substrings(input_path, min_support=0.0):
+    if not os.path.exists(input_path):
+        print(f"File {input_path} doesn't exist.")
+        return None
+
+    Head_ID = os.path.basename(input_path).replace('.tar.gz','').replace('.tsv','')
+    out_dir = os.path.dirname(input_path)
+
+    # Only the hits with a probability of 1 are kept, and only the three columns we need,
+    # so the rest of the table is never loaded
+    total, selected, integer_columns = select_hits(hit_lines(input_path))
+
+    # Check if there are no hits
+    if total == 0:
+        Indicator_file = write_indicator(input_path, Head_ID, "_empty")
+        print(f"The file is empty. Creating indicator file {Indicator_file}")
+        return "_empty"
+
+    # Creates an indicator file if there are no entries with a probablity of 1
+    if not selected:
+        Indicator_file = write_indicator(input_path, Head_ID, "_no_prob_one")
+        print(f"No entries with probability equal to one. Creating indicator file {Indicator_file}")
+        return "_no_prob_one"
+
+    # Removes non-informative substrings from the descriptions, once per distinct description
+    hits = HitTable.from_fields(selected, integer_columns).clean()
+    print(f"{len(hits)} informative hits with {len(hits.descriptions)} distinct descriptions held in {hits.nbytes() / 1024:.1f} KiB")
+
+    # Get the total number of rows
+    total_rows = len(hits)
+    # creates indicator file if there are no informative entries remaining
+    if total_rows == 0:
+        Indicator_file = write_indicator(input_path, Head_ID, "_no_info")
+        print(f"No entries with informative descriptions. Creating indicator file {Indicator_file}")
+        return "_no_info"
+
+    csv_data = most_common_substrings(hits.informative_descriptions(), total_rows, min_support)
+
+    # Write the data to a new CSV file
+    output_csv = os.path.join(out_dir, "substrings_" + Head_ID + ".csv")
+    with open(output_csv, 'w', newline='') as file:
+        writer = csv.writer(file, lineterminator='\n')
+        writer.writerow(['substring_length', 'substring', 'count', 'percentage'])
+        writer.writerows([length, substring, count, repr(float(percentage))] for length, substring, count, percentage in csv_data)
+
+    # Write descriptions to new CSV file, and the table itself for Protein_function_inference.py
+    df_out = os.path.join(out_dir, "Select_" + Head_ID + ".csv")
+    hits.to_csv(df_out)
+    hits.save(os.path.join(out_dir, "Select_" + Head_ID + ".npz"))
+    return 'substrings'
+
+
+# Command line options shared with the Pipeline.py driver
+def add_substrings_arguments(parser):
+    parser.add_argument('--min-support', type=float, default=0.0,
+                        help="Only consider substrings found in at least this percentage of the informative hits, and stop "
+                             "at the first length without one. Protein_function_inference.py never reports substrings "
+                             "below 10%%, but they still take part in its scores, so results can differ from the default "
+                             "exhaustive scan (0).")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Finds the most common description substrings of the hits with prob = 1.")
+    # this is the Foldseek result archive, or the tab-separated concatenated table, from the Foldseek API request
+    parser.add_argument('input_path', help="Foldseek result archive (<ID>.tar.gz) or concatenated table (<ID>.tsv).")
+    add_substrings_arguments(parser)
+    args = parser.parse_args()
+    generate_substrings(args.input_path, args.min_support)
@@ -1,9 +1,10 @@
 #!/usr/bin/env python
 import sys
-import os
-import pandas as pd
 import re
 
+from Fasta_reader import normalize_header, read_fasta
+from Results_store import ResultsStore
+
 # Extracts header ID and annotated function from a fasta header.
 # First positional argument is the filepath to the fasta file.
 # Second positional argument is the path for the intended output directory
@@ -16,39 +17,23 @@ import re
 # >ABC12_1234   Escherichia_coli_K12   ABC transporter permease
 # Here, everything from the third word 'ABC' on is assumed to be the functional annotation.
 
-def parse_fasta(fasta_file):
-    with open(fasta_file, 'r') as file:
-        header_sequence_pairs = []
-        header = None
-        sequence = []
-        num_entries = 0
-
-        for line in file:
-            line = line.strip()
-            if line.startswith(">"):
-                if header:  # Save the previous entry before starting a new one
-                    header_sequence_pairs.append((header, ''.join(sequence), ' '.join(function)))
-                    num_entries += 1
-                header = line[1:].replace('|', '_').replace('(', '-').replace(')', '-').split()[0]  # Extract header part after ">"
-                if len(sys.argv) > 3:
-                    try:
-                        int_val = int(sys.argv[3]) - 1
-                        function = line[1:].replace('|', '_').replace('(', '-').replace(')', '-').split()[int_val]
-                    except:
-                        match = re.search(sys.argv[3], line[1:].replace('|','_').replace('(','-').replace(')','-'))
-                        function = match.group(1)
-                else:
-                    function = line[1:].replace('|', '_').replace('(', '-').replace(')', '-').split()[2:]
-                sequence = []  # Reset sequence list for the new entry
-            else:
-                sequence.append(line)
+# Annotated function in a header description: everything from the third word on by default, or the word
+# at the given word number, or the first group matched by the given regex pattern.
+def annotated_function(description, pattern=None):
+    description = description.replace('|', '_').replace('(', '-').replace(')', '-')
+    if pattern is None:
+        return ' '.join(description.split()[2:])
+    try:
+        return description.split()[int(pattern) - 1]
+    except (ValueError, IndexError):
+        return re.search(pattern, description).group(1)
 
-        # Add the last entry after the loop ends
-        if header:
-            header_sequence_pairs.append((header, ''.join(sequence), ' '.join(function)))
-            num_entries += 1
 
-    return num_entries, header_sequence_pairs
+def parse_fasta(fasta_file):
+    pattern = sys.argv[3] if len(sys.argv) > 3 else None
+    header_sequence_pairs = [(normalize_header(description), sequence, annotated_function(description, pattern))
+                             for description, sequence in read_fasta(fasta_file)]
+    return len(header_sequence_pairs), header_sequence_pairs
 
 
 # Parse the file and get the number of entries and header-sequence pairs
@@ -65,8 +50,9 @@ for pair in header_sequence_pairs:
     csv_data.append([header, function, sequence])
 
 
-output_df = pd.DataFrame(csv_data, columns=['Header','Function', 'Sequence'])
-output_csv = sys.argv[2] + 'Original_Header_Function.csv'
-file_exists = os.path.isfile(output_csv)
-output_df.to_csv(output_csv, index=False, mode='a', header=not file_exists, encoding="utf-8")
+# Rows are recorded in the results store of the output directory (identifiers already present are ignored)
+# and the table is exported as CSV.
+with ResultsStore(sys.argv[2]) as store:
+    store.insert('original_header_function', csv_data)
+    output_csv = store.export_csv('original_header_function')
 print(f"{output_csv} created.")
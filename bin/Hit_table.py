@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+import csv
+import math
+import re
+import sys
+from functools import lru_cache
+
+import numpy as np
+
+# Columnar in-memory form of the Foldseek hits of one sequence, used by Generate_substrings.py and
+# Protein_function_inference.py instead of pandas DataFrames.
+# Descriptions are dictionary encoded: each distinct description is stored (and interned) once and rows
+# refer to it by an int32 code, with -1 for a missing description. Hit tables repeat a few names many
+# times, and the same names recur across the sequences of a proteome, so cleaning and substring
+# containment are computed once per distinct description rather than once per row.
+# SeqID is kept as float64, as Mean_SeqID is averaged from it; prob, which is only ever 1 here, as float32.
+# Whether SeqID and prob are written as integers is decided over the whole hit table, as pandas did.
+#
+# Select_<ID>.csv keeps its format; the table is also saved next to it as Select_<ID>.npz, which
+# Protein_function_inference.py loads instead of parsing the CSV.
+
+# Values pandas reads as missing, which the CSV files of earlier versions were read with
+NA_VALUES = frozenset(['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+                       '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'])
+INTEGER = re.compile(r'[+-]?\d+$')
+
+# Non-informative parts of the descriptions, removed in this order. Compiled once.
+ALPHAFOLD_ID = re.compile(r'AF.*-F1-model_v4 ', re.IGNORECASE)
+NON_INFORMATIVE = [re.compile(re.escape(word), re.IGNORECASE)
+                   for word in ('uncharacterized', ' protein', 'putative', 'domain-containing')]
+DROPPED = ('Uncharacterized protein', 'Uncharacterized')
+
+
+# Cleaned description, or None if the hit carries no information and is dropped.
+# Memoized by raw description for the life of the process, so the AlphaFold entries that recur across the
+# sequences of a proteome are cleaned once per run (once per worker with -j) and cost a dictionary lookup after.
+# The results are not kept between runs: cleaning takes about 3 us per description, less than reading a
+# cleaned description back from an on-disk store such as SQLite.
+@lru_cache(maxsize=None)
+def clean_description(description):
+    description = ALPHAFOLD_ID.sub('', description)
+    if description in DROPPED:
+        return None
+    for pattern in NON_INFORMATIVE:
+        description = pattern.sub('', description)
+    if description.lower() == 'na':
+        return None
+    return sys.intern(description)
+
+
+def parse_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return math.nan
+
+
+# Formats a number column the way pandas writes it: integers if every value was an integer, otherwise floats
+def format_numbers(values, integers):
+    if integers:
+        return [str(int(value)) for value in values]
+    return ['' if math.isnan(value) else repr(float(value)) for value in values]
+
+
+class HitTable:
+    def __init__(self, descriptions, codes, seq_ids, probs, integer_columns=()):
+        # distinct descriptions; codes index into them, -1 for a missing description
+        self.descriptions = descriptions
+        self.codes = codes
+        self.seq_ids = seq_ids
+        self.probs = probs
+        # columns that held only integers in the hit table, which are written as integers
+        self.integer_columns = tuple(integer_columns)
+
+    # Builds the table from (description, SeqID, prob) string triples. integer_columns names the columns
+    # written as integers; like pandas' dtypes, it is decided over every hit read (see select_hits in
+    # Generate_substrings.py), not over the prob == 1 hits given here.
+    @classmethod
+    def from_fields(cls, hits, integer_columns):
+        index = {}
+        codes = np.empty(len(hits), dtype=np.int32)
+        for row, (description, _, _) in enumerate(hits):
+            if description in NA_VALUES:
+                codes[row] = -1
+            else:
+                codes[row] = index.setdefault(description, len(index))
+        seq_ids = np.array([parse_float(seq_id) for _, seq_id, _ in hits], dtype=np.float64)
+        probs = np.array([parse_float(prob) for _, _, prob in hits], dtype=np.float32)
+        return cls([sys.intern(description) for description in index], codes, seq_ids, probs, integer_columns)
+
+    # Builds the table from a description column (None or NaN for missing) and a SeqID array
+    @classmethod
+    def from_columns(cls, descriptions, seq_ids):
+        index = {}
+        codes = np.array([-1 if not isinstance(description, str) else index.setdefault(description, len(index))
+                          for description in descriptions], dtype=np.int32)
+        return cls(list(index), codes, np.asarray(seq_ids, dtype=np.float64), np.ones(len(codes), dtype=np.float32))
+
+    def __len__(self):
+        return len(self.codes)
+
+    # Description of every row, None where it is missing
+    def column(self):
+        return [self.descriptions[code] if code >= 0 else None for code in self.codes]
+
+    def _take(self, descriptions, codes, rows):
+        return HitTable(descriptions, codes, self.seq_ids[rows], self.probs[rows], self.integer_columns)
+
+    # Removes non-informative parts of the descriptions and drops the rows left without information.
+    # Each distinct description is cleaned once; rows without a description are kept.
+    def clean(self):
+        cleaned = [clean_description(description) for description in self.descriptions]
+        index = {}
+        remap = np.array([-2 if description is None else index.setdefault(description, len(index))
+                          for description in cleaned] + [-1], dtype=np.int32)
+        # code -1 maps to the last entry, which stays -1
+        codes = remap[self.codes]
+        rows = codes != -2
+        return self._take(list(index), codes[rows], rows)
+
+    # Stripped, non-empty descriptions of every row, in row order, for the substring search
+    def informative_descriptions(self):
+        stripped = [description.strip() for description in self.descriptions]
+        return [stripped[code] for code in self.codes if code >= 0 and stripped[code]]
+
+    # The rows Protein_function_inference.py uses: those whose description and SeqID survive a CSV round trip
+    def complete_rows(self):
+        missing = [description in NA_VALUES for description in self.descriptions]
+        rows = np.array([code >= 0 and not missing[code] for code in self.codes], dtype=bool)
+        rows &= ~np.isnan(self.seq_ids)
+        return self._take(self.descriptions, self.codes[rows], rows)
+
+    # Boolean matrix with entry [k, r] True if substring k occurs in the description of row r.
+    # Containment is tested once per distinct description and expanded to the rows through the codes.
+    def containment_matrix(self, substrings):
+        matrix = np.array([[substring in description for description in self.descriptions] for substring in substrings],
+                          dtype=bool).reshape(len(substrings), len(self.descriptions))
+        return matrix[:, self.codes]
+
+    # Bytes held by the table: the column arrays plus the distinct description strings
+    def nbytes(self):
+        return (self.codes.nbytes + self.seq_ids.nbytes + self.probs.nbytes
+                + sum(sys.getsizeof(description) for description in self.descriptions))
+
+    # Writes the table in the Select_<ID>.csv format
+    def to_csv(self, path):
+        seq_ids = format_numbers(self.seq_ids, 'SeqID' in self.integer_columns)
+        probs = format_numbers(self.probs, 'prob' in self.integer_columns)
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file, lineterminator='\n')
+            writer.writerow(['description', 'SeqID', 'prob'])
+            for description, seq_id, prob in zip(self.column(), seq_ids, probs):
+                writer.writerow([description if description is not None else '', seq_id, prob])
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            np.savez(file, descriptions=np.array(self.descriptions, dtype=str), codes=self.codes,
+                     seq_ids=self.seq_ids, probs=self.probs, integer_columns=np.array(self.integer_columns, dtype=str))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls([sys.intern(str(description)) for description in data['descriptions']], data['codes'],
+                       data['seq_ids'], data['probs'], [str(name) for name in data['integer_columns']])
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+import argparse
+import contextlib
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+# Per-stage and per-sequence instrumentation for a pipeline run.
+# Every measurement is written as one JSON line to the metrics file (if one is given) and kept in memory
+# for the summary report printed at the end of the run. Events look like
+#   {"time": 1712000000.1, "event": "timing", "name": "esmfold.request", "header": "WP_1", "seconds": 3.2}
+#   {"time": 1712000000.2, "event": "count", "name": "retries", "n": 1, "status": 429}
+#   {"time": 1712000000.3, "event": "stage", "name": "search", "seconds": 812.4, "cpu_seconds": 3.1}
+# Stages can also be profiled with cProfile, one <stage>.prof file per stage in the profile directory,
+# to be read with `python -m pstats` or snakeviz.
+# Usage:
+#   Metrics.py run/metrics.jsonl    prints the summary report of a finished run
+
+PERCENTILES = (50, 90, 99)
+
+
+# Nearest-rank percentile of sorted values
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class Metrics:
+    def __init__(self, path=None, profile_dir=None):
+        self.path = path
+        self.profile_dir = profile_dir
+        self.lock = threading.Lock()
+        self.file = open(path, 'a') if path else None
+        # name -> list of (start, seconds, cpu_seconds)
+        self.timings = defaultdict(list)
+        self.counters = defaultdict(int)
+        # stage name -> (seconds, cpu_seconds), in run order
+        self.stages = {}
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def event(self, event, name, **fields):
+        record = {'time': round(time.time(), 3), 'event': event, 'name': name, **fields}
+        with self.lock:
+            self._add(record)
+            if self.file is not None:
+                self.file.write(json.dumps(record) + '\n')
+                self.file.flush()
+
+    # Updates the in-memory summary from an event
+    def _add(self, record):
+        if record['event'] == 'timing':
+            self.timings[record['name']].append((record['time'] - record['seconds'], record['seconds'],
+                                                 record.get('cpu_seconds')))
+        elif record['event'] == 'count':
+            self.counters[record['name']] += record['n']
+        elif record['event'] == 'stage':
+            self.stages[record['name']] = (record['seconds'], record['cpu_seconds'])
+
+    # Records a duration measured elsewhere, e.g. in a worker process or by the API
+    def record(self, name, seconds, cpu_seconds=None, **fields):
+        if cpu_seconds is not None:
+            fields['cpu_seconds'] = round(cpu_seconds, 6)
+        self.event('timing', name, seconds=round(seconds, 6), **fields)
+
+    def count(self, name, n=1, **fields):
+        self.event('count', name, n=n, **fields)
+
+    # Times the block (wall clock and CPU time of this process)
+    @contextlib.contextmanager
+    def timer(self, name, **fields):
+        start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, time.process_time() - cpu_start, **fields)
+
+    # Times a whole pipeline stage, profiling it if a profile directory was given
+    @contextlib.contextmanager
+    def stage(self, name):
+        profiler = cProfile.Profile() if self.profile_dir else None
+        start, cpu_start = time.perf_counter(), time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profile = os.path.join(self.profile_dir, name + '.prof')
+                profiler.dump_stats(profile)
+                print(f"Profile of the {name} stage written to {profile}")
+            self.event('stage', name, seconds=round(time.perf_counter() - start, 6),
+                       cpu_seconds=round(time.process_time() - cpu_start, 6))
+
+    # Prints the stage times, percentiles and throughput of every timed operation, and the counters.
+    # Throughput is operations per second over the span from the first operation's start to the last one's end.
+    def report(self, file=sys.stdout):
+        print("Run metrics", file=file)
+        if self.stages:
+            print(f"  {'stage':<28} {'seconds':>10} {'cpu s':>10}", file=file)
+            for name, (seconds, cpu_seconds) in self.stages.items():
+                print(f"  {name:<28} {seconds:>10.2f} {cpu_seconds:>10.2f}", file=file)
+        if self.timings:
+            columns = ''.join(f"{'p' + str(p):>9}" for p in PERCENTILES)
+            print(f"  {'operation':<28} {'count':>7} {'total s':>10} {'mean':>9}{columns} {'max':>9} {'per s':>9}", file=file)
+            for name, timings in sorted(self.timings.items()):
+                durations = sorted(seconds for _, seconds, _ in timings)
+                total = sum(durations)
+                span = max(start + seconds for start, seconds, _ in timings) - min(start for start, _, _ in timings)
+                throughput = f"{len(timings) / span:>9.2f}" if span > 0 else f"{'-':>9}"
+                values = ''.join(f"{percentile(durations, p):>9.3f}" for p in PERCENTILES)
+                print(f"  {name:<28} {len(timings):>7} {total:>10.2f} {total / len(timings):>9.3f}{values} "
+                      f"{durations[-1]:>9.3f} {throughput}", file=file)
+        if self.counters:
+            print(f"  {'counter':<28} {'count':>7}", file=file)
+            for name, n in sorted(self.counters.items()):
+                print(f"  {name:<28} {n:>7}", file=file)
+
+    # Rebuilds the summary of a metrics file
+    @classmethod
+    def load(cls, path):
+        metrics = cls()
+        with open(path) as file:
+            for line in file:
+                if line.strip():
+                    metrics._add(json.loads(line))
+        return metrics
+
+
+# Command line options shared with the Pipeline.py driver
+def add_metrics_arguments(parser):
+    parser.add_argument('--metrics', metavar='FILE',
+                        help="Append timing and counter events to this JSON lines file and print a summary report at the end.")
+    parser.add_argument('--profile', metavar='DIR', help="Profile every stage with cProfile, writing <stage>.prof files to DIR.")
+
+
+def make_metrics(args):
+    return Metrics(args.metrics, args.profile)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Prints the summary report of a metrics file.")
+    parser.add_argument('metrics', help="JSON lines metrics file written by a pipeline run.")
+    args = parser.parse_args()
+    Metrics.load(args.metrics).report()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+import argparse
+import gzip
+import io
+import json
+import random
+import re
+import tarfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from API_utils import TokenBucket
+
+# Local stand-ins for the ESMFold and Foldseek APIs, used to exercise the submission engines
+# without touching the shared public services.
+# Usage:
+#   Mock_API_servers.py --port 8000 --fail-rate 0.2 --ratelimit-rate 0.1
+#   Mock_API_servers.py --port 8000 --fold-latency 0.5 --esmfold-limit 1 --foldseek-limit 2
+#   Mock_API_servers.py --port 8000 --truncate-rate 0.5
+#   ESMFold_API.py seqs.faa ./out/ ESM.pem --esmfold-url http://127.0.0.1:8000/foldSequence/v1/pdb/
+#   Foldseek_API.py ./out/*.pdb ./out/ --foldseek-url http://127.0.0.1:8000/api
+
+DATABASES = ['afdb50', 'afdb-swissprot', 'afdb-proteome']
+
+DESCRIPTIONS = [
+    'ABC transporter permease', 'ABC transporter ATP-binding protein', 'Uncharacterized protein',
+    'Putative lipoprotein', 'DNA-binding response regulator', 'Two-component sensor histidine kinase',
+    'Transcriptional regulator, TetR family', 'Glycosyltransferase', 'Serine protease',
+    'Methyltransferase domain-containing protein', 'ATP-dependent Clp protease proteolytic subunit',
+]
+
+
+# Builds a minimal but well-formed PDB with one CA atom per residue.
+def fake_pdb(sequence):
+    lines = []
+    for i, residue in enumerate(sequence[:9999], start=1):
+        lines.append(f"ATOM  {i:5d}  CA  {residue:>3} A{i:4d}    {i * 3.8:8.3f}{0.0:8.3f}{0.0:8.3f}  1.00 90.00           C")
+    lines.append("END")
+    return ('\n'.join(lines) + '\n').encode()
+
+
+# Builds a Foldseek-style result archive with one .m8 table per database.
+# A multi-model query (models > 1) gets hits for every model, named <name>_MODEL_<n> as Foldseek does.
+# The archive is the same bytes every time for the same seed, so downloads can be resumed.
+def fake_result_archive(seed, hits_per_database=20, models=1):
+    rng = random.Random(seed)
+    queries = ['query'] if models == 1 else [f'batch_MODEL_{n}' for n in range(1, models + 1)]
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', mtime=0) as compressed, \
+            tarfile.open(fileobj=compressed, mode='w') as tar:
+        for database in DATABASES:
+            rows = []
+            for query in queries:
+                for i in range(hits_per_database):
+                    description = rng.choice(DESCRIPTIONS)
+                    prob = 1.0 if rng.random() < 0.7 else round(rng.random(), 3)
+                    rows.append('\t'.join([query, f'AF-P{i:05d}-F1-model_v4 {description}', f'{rng.random():.3f}',
+                                           '100', '0', '0', '1', '100', '1', '100', f'{prob}', '1e-10', '100']))
+            data = ('\n'.join(rows) + '\n').encode()
+            info = tarfile.TarInfo(f'alis_{database}.m8')
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    # Set by make_server
+    fail_rate = 0.0
+    ratelimit_rate = 0.0
+    search_time = 0.0
+    hits_per_database = 20
+    # fraction of result downloads cut off half way, to exercise resumed downloads
+    truncate_rate = 0.0
+    # seconds per ESMFold request, plus seconds per residue
+    fold_latency = 0.0
+    residue_latency = 0.0
+    # token buckets enforcing request rate limits like the public services, or None
+    esmfold_limit = None
+    foldseek_limit = None
+    counts = None
+    tickets = None
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _count(self, key):
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def _reply(self, status, body=b'', content_type='text/plain', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path.startswith('/foldSequence/'):
+            self._count('foldSequence')
+            if self.esmfold_limit is not None and not self.esmfold_limit.try_acquire():
+                self._count('foldSequence_limited')
+                self._reply(429, b'rate limited', headers={'Retry-After': '1'})
+                return
+            if random.random() < self.fail_rate:
+                self._reply(random.choice([429, 503]), b'try again', headers={'Retry-After': '0'})
+                return
+            time.sleep(self.fold_latency + self.residue_latency * len(body))
+            self._reply(200, fake_pdb(body.decode()))
+        elif self.path == '/api/ticket':
+            self._count('ticket')
+            if random.random() < self.ratelimit_rate or (self.foldseek_limit is not None
+                                                          and not self.foldseek_limit.try_acquire()):
+                self._count('ticket_limited')
+                self._json({'id': '', 'status': 'RATELIMIT'})
+                return
+            ticket_id = uuid.uuid4().hex
+            # multi-model uploads are searched as one query per model
+            models = max(1, body.count(b'\nMODEL ') + body.startswith(b'MODEL '))
+            with self.lock:
+                self.tickets[ticket_id] = (time.monotonic(), models)
+            self._json({'id': ticket_id, 'status': 'PENDING'})
+        else:
+            self._reply(404)
+
+    def _json(self, data):
+        self._reply(200, json.dumps(data).encode(), content_type='application/json')
+
+    # Sends a result archive, honouring `Range: bytes=<start>-` with 206, and sometimes stopping half way
+    def _download(self, archive):
+        status, headers = 200, {'Accept-Ranges': 'bytes'}
+        match = re.fullmatch(r'bytes=(\d+)-', self.headers.get('Range', ''))
+        if match and int(match.group(1)) < len(archive):
+            start = int(match.group(1))
+            headers['Content-Range'] = f'bytes {start}-{len(archive) - 1}/{len(archive)}'
+            status, archive = 206, archive[start:]
+        if random.random() < self.truncate_rate:
+            self._count('download_truncated')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(archive)))
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(archive[:len(archive) // 2])
+            self.close_connection = True
+            return
+        self._reply(status, archive, content_type='application/octet-stream', headers=headers)
+
+    def do_GET(self):
+        # /api/ticket/<id>, /api/result/<id>/<entry> and /api/result/download/<id>
+        parts = self.path.strip('/').split('/') + ['']
+        ticket_id = parts[3] if parts[:3] == ['api', 'result', 'download'] else parts[2]
+        if ticket_id not in self.tickets:
+            self._reply(404)
+            return
+        submitted, models = self.tickets[ticket_id]
+        if parts[:2] == ['api', 'ticket']:
+            self._count('poll')
+            done = time.monotonic() - submitted >= self.search_time
+            self._json({'id': ticket_id, 'status': 'COMPLETE' if done else 'RUNNING'})
+        elif parts[:3] == ['api', 'result', 'download']:
+            self._count('download')
+            self._download(fake_result_archive(ticket_id, self.hits_per_database, models))
+        elif parts[:2] == ['api', 'result']:
+            self._json({'queries': [], 'results': []})
+        else:
+            self._reply(404)
+
+
+# esmfold_limit and foldseek_limit are requests per second (with bursts of the same size) for ESMFold
+# requests and Foldseek ticket submissions; requests over the limit get 429 and RATELIMIT respectively.
+def make_server(host='127.0.0.1', port=0, fail_rate=0.0, ratelimit_rate=0.0, search_time=0.0,
+                fold_latency=0.0, residue_latency=0.0, esmfold_limit=None, foldseek_limit=None, hits_per_database=20,
+                truncate_rate=0.0):
+    handler = type('Handler', (MockHandler,), {
+        'fail_rate': fail_rate, 'ratelimit_rate': ratelimit_rate, 'search_time': search_time,
+        'hits_per_database': hits_per_database, 'truncate_rate': truncate_rate,
+        'fold_latency': fold_latency, 'residue_latency': residue_latency,
+        'esmfold_limit': TokenBucket(esmfold_limit, max(1, esmfold_limit)) if esmfold_limit else None,
+        'foldseek_limit': TokenBucket(foldseek_limit, max(1, foldseek_limit)) if foldseek_limit else None,
+        'counts': {}, 'tickets': {}})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Runs local stand-ins for the ESMFold and Foldseek APIs.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--fail-rate', type=float, default=0.0,
+                        help="Fraction of ESMFold requests answered with 429 or 503.")
+    parser.add_argument('--ratelimit-rate', type=float, default=0.0,
+                        help="Fraction of Foldseek ticket submissions answered with RATELIMIT.")
+    parser.add_argument('--search-time', type=float, default=2.0,
+                        help="Seconds before a Foldseek ticket is COMPLETE.")
+    parser.add_argument('--fold-latency', type=float, default=0.0, help="Seconds taken by every ESMFold request.")
+    parser.add_argument('--residue-latency', type=float, default=0.0,
+                        help="Additional ESMFold seconds per residue of the submitted sequence.")
+    parser.add_argument('--esmfold-limit', type=float,
+                        help="ESMFold requests per second; requests over the limit are answered with 429.")
+    parser.add_argument('--foldseek-limit', type=float,
+                        help="Foldseek ticket submissions per second; submissions over the limit are answered with RATELIMIT.")
+    parser.add_argument('--hits', type=int, default=20, help="Hits per database in every Foldseek result archive.")
+    parser.add_argument('--truncate-rate', type=float, default=0.0,
+                        help="Fraction of Foldseek result downloads whose connection is closed half way through.")
+    args = parser.parse_args()
+    server = make_server(args.host, args.port, args.fail_rate, args.ratelimit_rate, args.search_time,
+                         args.fold_latency, args.residue_latency, args.esmfold_limit, args.foldseek_limit, args.hits,
+                         args.truncate_rate)
+    print(f"Serving mock APIs on http://{args.host}:{server.server_port}/")
+    server.serve_forever()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import sys
+
+# Local stand-in for the foldseek executable, used to exercise the local search backend (--foldseek-db)
+# where foldseek is not installed. It implements the three commands FoldseekLocalBackend runs, on databases
+# that are tab-separated text files of (name, header, sequence) taken from the CA atoms of .pdb files:
+#   createdb INPUT... DB                     INPUT is a .pdb file or a directory of them. Fails on a file
+#                                            without CA atoms, as foldseek fails on a structure it cannot read.
+#   search QUERY TARGET ALN TMP              aligns every query with every target sharing 3-mers with it
+#   convertalis QUERY TARGET ALN OUT --format-output COLUMNS
+#                                            writes the alignments as .m8 rows in the requested columns
+# Entries are named after their file name without the extension, as foldseek names them. The header of a
+# target is its TITLE record if it has one (the description of an AlphaFold entry), and its name otherwise.
+# Other options, such as --threads and --alignment-type, are accepted and ignored.
+# With MOCK_FOLDSEEK_LOG set, the length in bytes of every command line is appended to that file.
+# Usage:
+#   Foldseek_API.py ./out/*.pdb ./out/ --foldseek-db tiny=db/tiny --foldseek-bin bin/Mock_foldseek.py
+
+KMER = 3
+
+
+def read_structure(path):
+    title, residues = [], []
+    with open(path) as file:
+        for line in file:
+            if line.startswith('TITLE'):
+                title.append(line[10:].strip())
+            elif line.startswith('ATOM') and line[12:16].strip() == 'CA':
+                residues.append(line[17:20].strip()[-1:] or 'X')
+    return ' '.join(title), ''.join(residues)
+
+
+def structure_files(inputs):
+    for path in inputs:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                yield os.path.join(path, name)
+        else:
+            yield path
+
+
+def read_db(path):
+    with open(path) as file:
+        return [line.rstrip('\n').split('\t') for line in file if line.strip()]
+
+
+def kmers(sequence):
+    return {sequence[i:i + KMER] for i in range(len(sequence) - KMER + 1)}
+
+
+def createdb(inputs, db):
+    entries = []
+    for path in structure_files(inputs):
+        title, sequence = read_structure(path)
+        if not sequence:
+            sys.exit(f"Could not read a structure from {path}")
+        name = os.path.splitext(os.path.basename(path))[0]
+        entries.append((name, title or name, sequence))
+    with open(db, 'w') as file:
+        file.writelines('\t'.join(entry) + '\n' for entry in entries)
+
+
+# One alignment per query-target pair sharing 3-mers: (query, target index, fraction of the query's 3-mers shared)
+def search(query_db, target_db, alignments):
+    targets = [(index, kmers(sequence)) for index, (_, _, sequence) in enumerate(read_db(target_db))]
+    with open(alignments, 'w') as file:
+        for name, _, sequence in read_db(query_db):
+            query = kmers(sequence)
+            for index, target in targets:
+                shared = len(query & target)
+                if shared:
+                    file.write(f"{name}\t{index}\t{shared / max(1, len(query)):.3f}\n")
+
+
+def convertalis(target_db, alignments, output, columns):
+    targets = read_db(target_db)
+    with open(alignments) as file, open(output, 'w') as out:
+        for line in file:
+            query, index, fident = line.rstrip('\n').split('\t')
+            _, header, sequence = targets[int(index)]
+            length = len(sequence)
+            values = {
+                'query': query, 'target': header, 'theader': header, 'fident': fident, 'alnlen': str(length),
+                'mismatch': str(round(length * (1 - float(fident)))), 'gapopen': '0', 'qstart': '1', 'qend': str(length),
+                'tstart': '1', 'tend': str(length), 'prob': '1.0' if float(fident) >= 0.5 else fident,
+                'evalue': f'{10 ** (-20 * float(fident)):.2e}', 'bits': str(round(100 * float(fident))),
+            }
+            out.write('\t'.join(values[column] for column in columns.split(',')) + '\n')
+
+
+if __name__ == '__main__':
+    if os.environ.get('MOCK_FOLDSEEK_LOG'):
+        with open(os.environ['MOCK_FOLDSEEK_LOG'], 'a') as log:
+            log.write(f"{sum(len(argument.encode()) + 1 for argument in sys.argv)}\n")
+
+    parser = argparse.ArgumentParser(description="Stand-in for the foldseek commands used by the local search backend.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('createdb')
+    command.add_argument('inputs', nargs='+')
+    command.add_argument('db')
+    command = commands.add_parser('search')
+    command.add_argument('query_db')
+    command.add_argument('target_db')
+    command.add_argument('alignments')
+    command.add_argument('tmp')
+    command = commands.add_parser('convertalis')
+    command.add_argument('query_db')
+    command.add_argument('target_db')
+    command.add_argument('alignments')
+    command.add_argument('output')
+    command.add_argument('--format-output', default='query,target,fident,alnlen,mismatch,gapopen,qstart,qend,'
+                                                     'tstart,tend,evalue,bits')
+    args, _ = parser.parse_known_args()
+
+    if args.command == 'createdb':
+        createdb(args.inputs, args.db)
+    elif args.command == 'search':
+        search(args.query_db, args.target_db, args.alignments)
+    else:
+        convertalis(args.target_db, args.alignments, args.output, args.format_output)
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+import argparse
+import contextlib
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from API_utils import add_rate_limit_arguments
+from ESMFold_API import add_esmfold_arguments, make_predictor, run_esmfold
+from Foldseek_API import add_foldseek_arguments, make_scheduler, search_structures, valid_archive
+from Generate_substrings import add_substrings_arguments, generate_substrings
+from Metrics import add_metrics_arguments, make_metrics
+from Preprocess_fasta import add_preprocess_arguments, make_preprocessor
+from Protein_function_inference import infer_function
+from Results_store import ResultsStore
+from Run_state import RunState
+from Structure_cache import add_cache_arguments, make_cache
+
+# Runs structure prediction, structure search, substring generation and protein function inference
+# for every sequence in a fasta file from a single interpreter.
+# Header selection, duplicate removal and length filtering (Preprocess_fasta.py options) are applied as the
+# fasta file is read, so no filtered copy of it is written.
+# Results are recorded in the run directory's results store, which is opened once and shared by all stages;
+# Protein_Functions.csv is exported from it once at the end of the run.
+
+# First positional argument is the fasta file
+# Second positional argument is the run directory (with trailing slash)
+# Third positional argument is the .pem file for the ESMFold SSL context
+
+# Result of a task that raised, so that one failing sequence does not end its stage
+class TaskError:
+    def __init__(self, error):
+        self.reason = f"{type(error).__name__}: {error}"
+
+
+# Calls function(*args) and returns (result, wall clock seconds, CPU seconds of the calling process)
+def call_timed(function, args):
+    start, cpu_start = time.perf_counter(), time.process_time()
+    try:
+        result = function(*args)
+    except Exception as error:
+        print(f"Task failed with {type(error).__name__}: {error}")
+        result = TaskError(error)
+    return result, time.perf_counter() - start, time.process_time() - cpu_start
+
+
+# Calls function(*args) with its printed output captured, so that the output of worker processes
+# can be printed in task order by the parent
+def call_captured(function, args):
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        timed = call_timed(function, args)
+    return timed, output.getvalue()
+
+
+# Runs function(*args) for every argument tuple in `tasks` on up to `jobs` processes.
+# (result, seconds, CPU seconds) are yielded in task order whatever order the workers finish in,
+# and printed output is printed in the same order. A task that raises yields a TaskError as its result.
+def run_tasks(function, tasks, jobs=1):
+    if jobs <= 1 or len(tasks) <= 1:
+        for args in tasks:
+            yield call_timed(function, args)
+        return
+    with ProcessPoolExecutor(max_workers=min(jobs, len(tasks))) as executor:
+        for timed, output in executor.map(call_captured, repeat(function), tasks):
+            print(output, end='')
+            yield timed
+
+
+# Keeps the headers that are in `only`, or all of them if `only` is None
+def restrict(headers, only=None):
+    return list(headers) if only is None else [header for header in headers if header in only]
+
+
+# Returns the .pdb files in `out_dir` that still need a Foldseek search, of the headers in `only` if given
+def structures_to_search(out_dir, state, only=None):
+    pdbs = []
+    for header in restrict(state.headers('folded'), only):
+        pdb = os.path.join(out_dir, header + '.pdb')
+        if state.failure(header):
+            print(f"Skipping Foldseek for {pdb} because Foldseek has already been run and {state.describe_failure(header)}")
+        elif state.has(header, 'substrings'):
+            print(f"Skipping Foldseek for {pdb} because substrings_{header}.csv and Select_{header}.csv found")
+        elif state.has(header, 'searched') and valid_archive(os.path.join(out_dir, header + '.tar.gz')):
+            print(f"Skipping Foldseek for {pdb} because {header}.tar.gz found")
+        else:
+            # an archive truncated by an interrupted run is replaced by search_structures
+            pdbs.append(pdb)
+    return pdbs
+
+
+def search_stage(out_dir, args, header_sequences, cache, state, metrics=None, only=None, structure_kind=None):
+    pdbs = structures_to_search(out_dir, state, only)
+    if not pdbs:
+        return
+    print(f"Processing {len(pdbs)} structures with Foldseek")
+    scheduler = make_scheduler(out_dir, args, metrics, structure_kind)
+    search_structures(scheduler, pdbs, header_sequences, cache)
+    if scheduler.gave_up:
+        print("Foldseek API rate limit persisted. Remaining structures will be submitted on the next run.")
+        os.remove(os.path.join(out_dir, 'RateLimitReached'))
+
+    for pdb in pdbs:
+        header = os.path.basename(os.path.splitext(pdb)[0])
+        archive = scheduler.archive_path(pdb)
+        if not os.path.exists(archive):
+            print(f"Foldseek API request not completed for {pdb}. Skipping substring generation.")
+            continue
+        state.mark(header, 'searched')
+
+
+def substrings_task(header, archive, min_support=0.0):
+    print(f"Generating substrings for {header}")
+    # the .m8 tables are read straight from the archive
+    return generate_substrings(archive, min_support)
+
+
+# Generates substrings for every Foldseek result archive in the run directory.
+# Each worker writes only the files of its own sequence; the archives and the index are updated by the parent.
+# An archive is removed once its outcome is recorded; the archive of a task that raised is kept, so a later
+# run tries it again.
+def substrings_stage(out_dir, state, jobs=1, metrics=None, min_support=0.0, only=None):
+    headers = restrict(state.pending('substrings', after='searched'), only)
+    tasks = [(header, os.path.join(out_dir, header + '.tar.gz'), min_support) for header in headers]
+    for (header, archive, _), (outcome, seconds, cpu_seconds) in zip(tasks, run_tasks(substrings_task, tasks, jobs)):
+        failed = isinstance(outcome, TaskError)
+        if metrics is not None:
+            metrics.record('substrings', seconds, cpu_seconds, header=header, outcome='error' if failed else outcome)
+        if failed:
+            state.mark_failed(header, outcome.reason)
+            continue
+        if outcome == 'substrings':
+            state.mark(header, 'substrings')
+        elif outcome:
+            state.mark_failed(header, outcome)
+        if outcome and os.path.exists(archive):
+            os.remove(archive)
+
+
+# Failure reason of a sequence whose substrings gave no protein function
+NO_PAIR_PASSED = "no substring pair passed the inference thresholds."
+
+
+def inference_task(input_csv, Head_ID, header_sequences):
+    print(f"Determining protein function for sequence Select_{Head_ID}")
+    return infer_function(input_csv, header_sequences=header_sequences)
+
+
+# Infers protein functions on up to `jobs` processes. Rows are recorded by the parent, in sorted
+# identifier order, so Protein_Functions.csv is the same whatever the number of jobs.
+def inference_stage(out_dir, header_sequences, state, store, jobs=1, metrics=None, only=None):
+    # sequences whose protein function has already been determined are not in the pending list.
+    headers = restrict(state.pending('inferred', after='substrings'), only)
+    # each worker is only sent the sequence it needs
+    tasks = [(os.path.join(out_dir, f"Select_{Head_ID}.csv"), Head_ID, {Head_ID: header_sequences.get(Head_ID)})
+             for Head_ID in headers]
+    for Head_ID, (row, seconds, cpu_seconds) in zip(headers, run_tasks(inference_task, tasks, jobs)):
+        failed = isinstance(row, TaskError)
+        if metrics is not None:
+            metrics.record('inference', seconds, cpu_seconds, header=Head_ID, inferred=bool(row) and not failed)
+        if failed:
+            state.mark_failed(Head_ID, row.reason)
+        elif row:
+            store.add_protein_functions([row])
+            state.mark(Head_ID, 'inferred')
+        else:
+            state.mark_failed(Head_ID, NO_PAIR_PASSED)
+
+
+# Options of the stages, shared with the work queue workers of Work_queue.py
+def add_stage_arguments(parser):
+    add_esmfold_arguments(parser)
+    add_foldseek_arguments(parser)
+    add_rate_limit_arguments(parser)
+    add_cache_arguments(parser)
+    add_substrings_arguments(parser)
+    add_metrics_arguments(parser)
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="Number of processes for substring generation and protein function inference.")
+
+
+# Runs the structure search, substring and inference stages for the folded sequences of the run directory,
+# or only for the headers in `only`. `structure_kind` is the cache kind of the predictor's structures.
+def downstream_stages(out_dir, args, cache, state, store, metrics, only=None, structure_kind=None):
+    header_sequences = store.header_sequences()
+    with metrics.stage('search'):
+        search_stage(out_dir, args, header_sequences, cache, state, metrics, only, structure_kind)
+    with metrics.stage('substrings'):
+        substrings_stage(out_dir, state, args.jobs, metrics, args.min_support, only)
+    with metrics.stage('inference'):
+        inference_stage(out_dir, header_sequences, state, store, args.jobs, metrics, only)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Infers protein function from predicted structure for every sequence in a fasta file.")
+    parser.add_argument('fasta', help="Fasta file containing amino acid sequences.")
+    parser.add_argument('out_dir', help="Run directory (with trailing slash).")
+    parser.add_argument('pem', help="File path for the .pem file used by the ESMFold SSL context.")
+    add_preprocess_arguments(parser)
+    add_stage_arguments(parser)
+    args = parser.parse_args()
+
+    cache = make_cache(args)
+    # the run directory is listed once; every stage consults and updates the same index
+    state = RunState(args.out_dir)
+    with ResultsStore(args.out_dir) as store, make_metrics(args) as metrics:
+        predictor = make_predictor(args, metrics)
+        with metrics.stage('fold'):
+            run_esmfold(args.fasta, args.out_dir, predictor, cache=cache, state=state, store=store,
+                        preprocessor=make_preprocessor(args))
+        try:
+            downstream_stages(args.out_dir, args, cache, state, store, metrics, structure_kind=predictor.cache_kind)
+        finally:
+            print(f"Results written to: {store.export_csv('protein_functions')}")
+            if args.metrics:
+                metrics.report()
+
+if __name__ == '__main__':
+    main()
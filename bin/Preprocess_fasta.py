@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+import argparse
+import contextlib
+import csv
+import hashlib
+import re
+
+from Fasta_reader import normalize_header, read_fasta
+
+# Single-pass preprocessing of the input fasta file: header selection, length filtering, duplicate
+# removal and sorting are applied to the records as they are read, without intermediate fasta files.
+# Pipeline.py applies it to its input directly; this script writes the preprocessed records to a file.
+#   Header selection  keep records whose header contains one of the keywords or matches one of the regular
+#                     expressions, case-insensitively (the shell script's -e keeps "hypothetical" headers)
+#   Length filtering  keep records with min_length <= sequence length <= max_length
+#   Duplicates        keep the first record of every distinct sequence; removed records are listed in the
+#                     mapping file as Duplicate_Header,Representative_Header like Remove_Fasta_Duplicates.py
+#   Sorting           longest sequences first, as filter_sort_fasta.py does (stable for equal lengths)
+# Usage:
+#   Preprocess_fasta.py input.faa output.faa --select hypothetical --dedup --mapping duplicates.csv
+#   Preprocess_fasta.py input.faa output.faa --min-length 500 --sort
+
+
+class FastaPreprocessor:
+    def __init__(self, keywords=(), patterns=(), min_length=None, max_length=None, deduplicate=False,
+                 mapping_file=None, sort=False):
+        expressions = [re.escape(keyword) for keyword in keywords] + list(patterns)
+        # one alternation, so each header is searched once whatever the number of keywords
+        self.select = re.compile('|'.join(f'(?:{expression})' for expression in expressions),
+                                 re.IGNORECASE) if expressions else None
+        self.min_length = min_length
+        self.max_length = max_length
+        self.deduplicate = deduplicate
+        self.mapping_file = mapping_file
+        self.sort = sort
+        self.counts = {}
+
+    # True if any step would change the records
+    def __bool__(self):
+        return bool(self.select or self.min_length or self.max_length is not None or self.deduplicate or self.sort)
+
+    def _filtered(self, records, mapping):
+        # sequence digest -> description of the record kept for it
+        representatives = {}
+        for description, sequence in records:
+            self.counts['read'] += 1
+            if self.select is not None and not self.select.search(description):
+                self.counts['not_selected'] += 1
+                continue
+            if (self.min_length and len(sequence) < self.min_length) or \
+                    (self.max_length is not None and len(sequence) > self.max_length):
+                self.counts['length'] += 1
+                continue
+            if self.deduplicate:
+                digest = hashlib.sha256(sequence.encode()).digest()
+                representative = representatives.get(digest)
+                if representative is not None:
+                    self.counts['duplicates'] += 1
+                    if mapping:
+                        mapping.writerow([normalize_header(description), normalize_header(representative)])
+                    continue
+                representatives[digest] = description
+            self.counts['kept'] += 1
+            yield description, sequence
+
+    # Yields the preprocessed (description, sequence) records. Sorting holds the kept records in memory;
+    # everything else streams.
+    def process(self, records):
+        self.counts = dict.fromkeys(['read', 'not_selected', 'length', 'duplicates', 'kept'], 0)
+        with (open(self.mapping_file, 'w', newline='') if self.mapping_file else contextlib.nullcontext()) as handle:
+            mapping = None
+            if handle:
+                mapping = csv.writer(handle, lineterminator='\n')
+                mapping.writerow(['Duplicate_Header', 'Representative_Header'])
+            filtered = self._filtered(records, mapping)
+            if self.sort:
+                filtered = sorted(filtered, key=lambda record: len(record[1]), reverse=True)
+            yield from filtered
+        print(self.summary())
+
+    def summary(self):
+        counts = self.counts
+        return (f"Preprocessing kept {counts['kept']} of {counts['read']} fasta entries "
+                f"({counts['not_selected']} not selected by header, {counts['length']} outside the length limits, "
+                f"{counts['duplicates']} duplicate sequences).")
+
+
+# Writes the records with sequence lines of `width` characters. Returns the number of records written.
+def write_fasta(records, output_file, width=80):
+    count = 0
+    with open(output_file, 'w') as outfile:
+        for description, sequence in records:
+            outfile.write(f">{description}\n")
+            # Write the sequence in `width` character chunks for proper FASTA format
+            for i in range(0, len(sequence), width):
+                outfile.write(sequence[i:i+width] + '\n')
+            count += 1
+    return count
+
+
+# Command line options shared with the Pipeline.py driver
+def add_preprocess_arguments(parser):
+    parser.add_argument('--select', action='append', default=[], metavar='KEYWORD',
+                        help="Keep only entries whose header contains this keyword, case-insensitively. Repeatable.")
+    parser.add_argument('--select-regex', action='append', default=[], metavar='REGEX',
+                        help="Keep only entries whose header matches this regular expression, case-insensitively. Repeatable.")
+    parser.add_argument('--min-length', type=int, help="Drop sequences shorter than this many amino acids.")
+    parser.add_argument('--max-length', type=int, help="Drop sequences longer than this many amino acids.")
+    parser.add_argument('--dedup', action='store_true',
+                        help="Keep only the first entry of every distinct amino acid sequence.")
+    parser.add_argument('--mapping', help="With --dedup, CSV file listing each removed header and the header kept in its place.")
+    parser.add_argument('--sort', action='store_true', help="Order the entries by sequence length, longest first.")
+
+
+def make_preprocessor(args):
+    return FastaPreprocessor(keywords=args.select, patterns=args.select_regex, min_length=args.min_length,
+                             max_length=args.max_length, deduplicate=args.dedup, mapping_file=args.mapping,
+                             sort=args.sort)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Selects, filters, deduplicates and sorts fasta entries in a single pass.")
+    parser.add_argument('input_file', help="Original fasta file.")
+    parser.add_argument('output_file', help="File path for the preprocessed fasta file.")
+    add_preprocess_arguments(parser)
+    args = parser.parse_args()
+
+    write_fasta(make_preprocessor(args).process(read_fasta(args.input_file)), args.output_file)
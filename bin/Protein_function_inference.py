@@ -1,58 +1,32 @@
 #!/usr/bin/env python
 
+import numpy as np
 import pandas as pd
-from collections import Counter
-import itertools
+from functools import lru_cache
 import sys
 import os
 import subprocess
 import csv
 
-# File path to the descriptions table with only select columns.
-input_csv = sys.argv[1]
-input_csv = input_csv.strip()
-input_csv = os.path.normpath(input_csv)
-# Check if the file is empty.
-# This might happen if no target proteins have a probabilty = 1.
-if os.path.getsize(input_csv) == 0:
-    print("The file is empty.")
-    sys.exit(0)
+from Hit_table import HitTable
+from Results_store import ResultsStore
 
-# Load the column-selected descriptions CSV file into a pandas dataframe
-df = pd.read_csv(input_csv, header=0)
-
-# last removal of blank rows
-df = df.dropna()
-
-total_rows = len(df) # gets the total number of rows
-
-
-# We don't want duplicate entries so we check if the file exists and if so, is there already a matching entry.
-
-# Check if the file exists
-pf_path = os.path.join(os.path.dirname(input_csv),"Protein_functions.csv")
-Head_ID = os.path.basename(input_csv).replace('Select_','').replace('.csv','')
-
-if os.path.exists(pf_path):
-    pf = pd.read_csv(pf_path, header=0)
-    # Checks if the protein function has already been inferred.
-    if pf['Input_Sequence_Identifier'].isin([Head_ID]).any():
-        print(f"Protein function for {Head_ID} already determined.")
-        sys.exit(1)
 
 # Loads the substring CSV file
-csv_data = []
-with open(os.path.join(os.path.dirname(input_csv), os.path.basename(input_csv).replace('Select_', 'substrings_')), 'r') as file:
-    reader = csv.reader(file)
-    next(reader) # skips the first row
-    for row in reader:
-        row[0] = float(row[0])
-        row[2] = float(row[2])
-        row[3] = float(row[3])
-        csv_data.append(row)
-output_df = pd.DataFrame(csv_data, columns=['substring_length', 'substring', 'count', 'percentage'])
-
-
+def load_substrings(substrings_csv):
+    csv_data = []
+    with open(substrings_csv, 'r') as file:
+        reader = csv.reader(file)
+        next(reader) # skips the first row
+        for row in reader:
+            row[0] = float(row[0])
+            row[2] = float(row[2])
+            row[3] = float(row[3])
+            csv_data.append(row)
+    return csv_data
+
+
+@lru_cache(maxsize=None)
 def calculate_overlap(substr1, substr2):
     """Calculate the maximum number of sequential overlapping characters."""
     max_overlap = 0
@@ -71,10 +45,19 @@ def calculate_overlap(substr1, substr2):
 
     return max_overlap
 
-# instantiates with starting values.
-max_overlap = 0
-best_pair = None
-max_score = 0
+
+# Loads the hits of a Select_<ID>.csv table, from the Select_<ID>.npz table saved next to it if it is
+# up to date, keeping only the rows with a description and a SeqID.
+def load_hits(input_csv):
+    saved = input_csv[:-len('.csv')] + '.npz'
+    if os.path.exists(saved) and os.path.getmtime(saved) >= os.path.getmtime(input_csv):
+        return HitTable.load(saved).complete_rows()
+    # Load the column-selected descriptions CSV file into a pandas dataframe
+    df = pd.read_csv(input_csv, header=0)
+    # last removal of blank rows
+    df = df.dropna()
+    return HitTable.from_columns(df['description'].tolist(), df['SeqID'].to_numpy(dtype=float))
+
 
 # Iterate through all pairs of substrings to determine overlap, percentage of entries containing substring
 # and the average SeqID for entries containing the substring.
@@ -90,75 +73,119 @@ max_score = 0
 
 # Finally, we ignore any substrings that are not found in at least 10% of the entries returned by Foldseek.
 
-for i in range(len(csv_data) - 1):
-    substring_1 = csv_data[i][1]
-    length_1 = csv_data[i][0]
-
-    for j in range(i + 1, len(csv_data)):
-        substring_2 = csv_data[j][1]
-        length_2 = csv_data[j][0]
-        if j < len(csv_data)-1:
-            substring_3 = csv_data[j+1][1]
-            # calculates percentage of rows with substring_3
-            pct_count_substr3 = df['description'].str.contains(substring_3, regex=False).sum() / total_rows
-        else:
-            # by setting this to 1 we ignore it.
-            pct_count_substr3 = 1
-
-        overlap = calculate_overlap(substring_1, substring_2) # calculates overlap
-
-        # Calculate percentage of rows with substring_2
-        pct_entry_count = df['description'].str.contains(substring_2, regex=False).sum() / total_rows
-
-        # Calculate average SeqID for rows containing substring_2
-        avg_SeqID = df[df['description'].str.contains(substring_2, regex=False)]['SeqID'].mean()
-        # determines weight to be applied to the average SeqID
-        weight = (length_2**0.25)*pct_entry_count/pct_count_substr3
-        #debug print statement
-        #print(f"Substring 1:{substring_1}, Substring 2:{substring_2}, avg_SeqID*weight=score: {avg_SeqID}*{weight}={avg_SeqID*weight} and pct_entry_count {pct_entry_count}%\n")
-
-        # Update best_pair if this is the best overlap found so far
-        if overlap > max_overlap and (weight*avg_SeqID > max_score) and (pct_entry_count > 0.10):
-            max_overlap = overlap
-            max_score = weight*avg_SeqID
-            best_pair = (substring_1, substring_2)
-            #debug print statement
-            #print(f"best pair: {best_pair[0]},{best_pair[1]}, max_score: {max_score}\n")
-
-# Print the longest substring with the highest degree of overlap
-if best_pair:
+# Containment is computed once as a matrix. The percentage of entries, the average SeqID and the score of
+# substring_2 only depend on j, so they are computed per candidate, and the pair loop only compares numbers.
+# Returns the best pair and the average SeqID of the last candidate, as the pair loop used to leave it.
+def find_best_pair(hits, csv_data):
+    total_rows = len(hits) # gets the total number of rows
+    if len(csv_data) < 2:
+        return None, None
+
+    substrings = [row[1] for row in csv_data]
+    contains = hits.containment_matrix(substrings)
+
+    # percentage of rows with each substring
+    pct_entry_count = contains.sum(axis=1) / total_rows
+    # percentage of rows with the next substring; by setting this to 1 for the last substring we ignore it.
+    pct_count_next = np.append(pct_entry_count[1:], 1.0)
+    # average SeqID of the rows containing each substring
+    seq_ids = hits.seq_ids
+    avg_SeqID = np.array([seq_ids[mask].mean() if mask.any() else np.nan for mask in contains], dtype=float)
+    # determines weight to be applied to the average SeqID
+    length_weight = np.array([row[0]**0.25 for row in csv_data], dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        score = (length_weight*pct_entry_count/pct_count_next)*avg_SeqID
+
+    # instantiates with starting values.
+    max_overlap = 0
+    best_pair = None
+    max_score = 0
+
+    for i in range(len(csv_data) - 1):
+        substring_1 = substrings[i]
+        for j in range(i + 1, len(csv_data)):
+            overlap = calculate_overlap(substring_1, substrings[j]) # calculates overlap
+
+            # Update best_pair if this is the best overlap found so far
+            if overlap > max_overlap and (score[j] > max_score) and (pct_entry_count[j] > 0.10):
+                max_overlap = overlap
+                max_score = score[j]
+                best_pair = (substring_1, substrings[j])
+
+    return best_pair, avg_SeqID[-1]
+
+
+# Infers the protein function for one Select_<ID>.csv table.
+# `header_sequences` may be passed in by a long-lived caller so that the header sequence pairs
+# are only read from the results store once per run.
+# Returns the result row as a dictionary, or None if no function could be inferred.
+def infer_function(input_csv, header_sequences=None):
+    # Check if the file is empty.
+    # This might happen if no target proteins have a probabilty = 1.
+    if os.path.getsize(input_csv) == 0:
+        print("The file is empty.")
+        return None
+
+    hits = load_hits(input_csv)
+
+    Head_ID = os.path.basename(input_csv).replace('Select_','').replace('.csv','')
+
+    csv_data = load_substrings(os.path.join(os.path.dirname(input_csv), os.path.basename(input_csv).replace('Select_', 'substrings_')))
+    output_df = pd.DataFrame(csv_data, columns=['substring_length', 'substring', 'count', 'percentage'])
+
+    best_pair, avg_SeqID = find_best_pair(hits, csv_data)
+
+    # Print the longest substring with the highest degree of overlap
+    if not best_pair:
+        return None
     print(f"The most likely protein based on predicted structure was: '{best_pair[1]}' with a percent entry count (for prob=1): {output_df[output_df['substring'] == best_pair[1]]['percentage'].iloc[0]:.2f}%, and mean SeqID of: {avg_SeqID:.2f}")
-    Head_ID = os.path.basename(input_csv).replace('Select_','').replace('.csv', '')
     longest_substring = best_pair[1]
     percent_entry_count = output_df[output_df['substring'] == best_pair[1]]['percentage'].iloc[0]
     mean_seq_id = avg_SeqID
 
-    sequence_data = pd.read_csv(os.path.dirname(input_csv) + '/Header_Sequence.csv')
-    AA_sequence =  sequence_data.loc[sequence_data['Header'] == Head_ID, 'Sequence'].values
+    if header_sequences is None:
+        with ResultsStore(os.path.dirname(input_csv) or '.') as store:
+            header_sequences = store.header_sequences()
+    AA_sequence = header_sequences[Head_ID]
 
     # Create a dictionary with the data
-    data = {
+    return {
         # Header of the input amino acid sequence
-        'Input_Sequence_Identifier': [Head_ID],
+        'Input_Sequence_Identifier': Head_ID,
         # Best guess of protein function based on structure-based comparison
-        'Inferred_Protein_Function': [longest_substring],
+        'Inferred_Protein_Function': longest_substring,
         # Percent of entries with probability = 1 that contain the substring
-        'Percent_Entry_Count': [f'{percent_entry_count:.2f}'],
+        'Percent_Entry_Count': f'{percent_entry_count:.2f}',
         # Average SeqID score of entries containing the substring
-        'Mean_SeqID': [f'{mean_seq_id:.2f}'],
+        'Mean_SeqID': f'{mean_seq_id:.2f}',
         # Processed amino acid sequence
-        'Amino_acid_sequence': [AA_sequence[0]]
+        'Amino_acid_sequence': AA_sequence
     }
-    # Convert to DataFrame
-    df = pd.DataFrame(data)
-    # Define the output file name
-    output_file = 'Protein_Functions.csv'
-
-    # Check if the file exists
-    if os.path.exists(os.path.join(os.path.dirname(input_csv),output_file)):
-        # Append to the file without writing the header
-        df.to_csv(os.path.join(os.path.dirname(input_csv),output_file), mode='a', header=False, index=False)
-    else:
-        # Write to the file with the header
-        df.to_csv(os.path.join(os.path.dirname(input_csv),output_file), mode='w', header=True, index=False)
-        print(f"Results written to: {os.path.join(os.path.dirname(input_csv),output_file)}")
+
+
+# Records inferred protein functions in the results store of `out_dir` and exports Protein_Functions.csv.
+# Rows for identifiers that are already in the store are ignored.
+def write_results(rows, out_dir):
+    with ResultsStore(out_dir) as store:
+        store.add_protein_functions(rows)
+        output_file = store.export_csv('protein_functions')
+    print(f"Results written to: {output_file}")
+
+
+if __name__ == '__main__':
+    # File path to the descriptions table with only select columns.
+    input_csv = sys.argv[1]
+    input_csv = input_csv.strip()
+    input_csv = os.path.normpath(input_csv)
+
+    # We don't want duplicate entries so we check if there is already a matching entry in the results store.
+    Head_ID = os.path.basename(input_csv).replace('Select_','').replace('.csv','')
+    with ResultsStore(os.path.dirname(input_csv) or '.') as store:
+        determined = store.contains('protein_functions', Head_ID)
+    if determined:
+        print(f"Protein function for {Head_ID} already determined.")
+        sys.exit(1)
+
+    row = infer_function(input_csv)
+    if row:
+        write_results([row], os.path.dirname(input_csv) or '.')
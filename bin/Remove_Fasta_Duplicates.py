@@ -1,42 +1,56 @@
 #!/usr/bin/env python
-import sys
-
-def remove_duplicates_fasta(input_file, output_file):
-    # Dictionary to store unique sequences
-    unique_sequences = {}
-    
-    with open(input_file, 'r') as infile:
-        header = None
-        sequence = []
-        
-        for line in infile:
-            line = line.strip()
-            
-            if line.startswith('>'):  # It's a header line
-                # If there's a previous sequence, check if it's unique
-                if header and ''.join(sequence) not in unique_sequences.values():
-                    unique_sequences[header] = ''.join(sequence)
-                
-                # Start a new sequence
-                header = line
-                sequence = []
-            
-            else:
-                # It's part of the sequence, so add to the current sequence
-                sequence.append(line)
-        
-        # Add the last sequence to the dictionary if unique
-        if header and ''.join(sequence) not in unique_sequences.values():
-            unique_sequences[header] = ''.join(sequence)
-    
-    # Write unique sequences to the output file
-    with open(output_file, 'w') as outfile:
-        for header, seq in unique_sequences.items():
-            outfile.write(f"{header}\n")
+import argparse
+import contextlib
+import csv
+import hashlib
+
+from Fasta_reader import normalize_header, read_fasta
+
+
+# Writes the first record of every distinct sequence to the output file as the input is read.
+# Only the SHA-256 digest of each sequence seen so far is kept in memory, so each record is checked in
+# constant time. If `mapping_file` is given, every removed record is listed there as
+# Duplicate_Header,Representative_Header (header IDs) so that inferred functions can be propagated back.
+# Returns the number of records written and the number removed.
+def remove_duplicates_fasta(input_file, output_file, mapping_file=None):
+    # sequence digest -> description of the record kept for it
+    representatives = {}
+    kept = removed = 0
+
+    with open(output_file, 'w') as outfile, \
+            (open(mapping_file, 'w', newline='') if mapping_file else contextlib.nullcontext()) as mapping_handle:
+        mapping = None
+        if mapping_handle:
+            mapping = csv.writer(mapping_handle, lineterminator='\n')
+            mapping.writerow(['Duplicate_Header', 'Representative_Header'])
+
+        for description, seq in read_fasta(input_file):
+            digest = hashlib.sha256(seq.encode()).digest()
+            representative = representatives.get(digest)
+            if representative is not None:
+                removed += 1
+                if mapping:
+                    mapping.writerow([normalize_header(description), normalize_header(representative)])
+                continue
+            representatives[digest] = description
+            kept += 1
+
+            outfile.write(f">{description}\n")
             # Write the sequence in 80 character chunks for proper FASTA format
             for i in range(0, len(seq), 80):
                 outfile.write(seq[i:i+80] + '\n')
 
-# first positional argument is the original fasta file.
-# second positional argument is the file path to the output file
-remove_duplicates_fasta(sys.argv[1], sys.argv[2])
+    return kept, removed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Removes fasta entries whose amino acid sequence matches an earlier entry exactly.")
+    # first positional argument is the original fasta file.
+    parser.add_argument('input_file', help="Original fasta file.")
+    # second positional argument is the file path to the output file
+    parser.add_argument('output_file', help="File path for the deduplicated fasta file.")
+    parser.add_argument('--mapping', help="Optional CSV file listing each removed header and the header kept in its place.")
+    args = parser.parse_args()
+
+    kept, removed = remove_duplicates_fasta(args.input_file, args.output_file, args.mapping)
+    print(f"{kept} unique entries kept, {removed} duplicate entries removed.")
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+import csv
+import os
+import sqlite3
+
+# Transactional store for the tables a run produces, kept in `<run_dir>results.sqlite`.
+# Rows are looked up by their identifier through the primary key index instead of re-reading
+# whole CSV files, duplicate identifiers are ignored, and concurrent writers are serialised by
+# SQLite. The CSV files used by the rest of the tooling (Comparison.py, the shell report) are
+# written from the store with export_csv.
+#
+# When a store is first opened in a run directory that already has CSV files from an earlier
+# version, their rows are imported so that old runs can be resumed.
+#
+# Stores use WAL mode, except in the run directory of a work queue and its worker directories (see journal_mode).
+
+TABLES = {
+    'header_sequence': {
+        'csv': 'Header_Sequence.csv',
+        'columns': ['Header', 'Sequence'],
+    },
+    'protein_functions': {
+        'csv': 'Protein_Functions.csv',
+        'columns': ['Input_Sequence_Identifier', 'Inferred_Protein_Function', 'Percent_Entry_Count',
+                    'Mean_SeqID', 'Amino_acid_sequence'],
+    },
+    'original_header_function': {
+        'csv': 'Original_Header_Function.csv',
+        'columns': ['Header', 'Function', 'Sequence'],
+    },
+}
+
+# Work queue file of a run directory shared by the workers of Work_queue.py
+WORK_QUEUE = 'work_queue.sqlite'
+
+
+# SQLite journal mode for the databases of a run directory: WAL, or the rollback journal (DELETE) in the run
+# directory of a work queue and in its worker directories (<run_dir>workers/<worker id>/). Those are on storage
+# shared by several hosts, where WAL's shared-memory index does not work, so they use the queue's journal mode.
+def journal_mode(run_dir):
+    run_dir = os.path.abspath(run_dir)
+    if os.path.basename(os.path.dirname(run_dir)) == 'workers':
+        run_dir = os.path.dirname(os.path.dirname(run_dir))
+    return 'DELETE' if os.path.exists(os.path.join(run_dir, WORK_QUEUE)) else 'WAL'
+
+
+class ResultsStore:
+    def __init__(self, run_dir, filename='results.sqlite'):
+        self.run_dir = run_dir
+        self.path = os.path.join(run_dir, filename)
+        self.connection = sqlite3.connect(self.path, timeout=60)
+        self.connection.execute(f'PRAGMA journal_mode={journal_mode(run_dir)}')
+        for table, spec in TABLES.items():
+            key, *others = spec['columns']
+            columns = ', '.join([f'"{key}" TEXT PRIMARY KEY'] + [f'"{column}" TEXT' for column in others])
+            with self.connection:
+                created = self.connection.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone() is None
+                self.connection.execute(f'CREATE TABLE IF NOT EXISTS {table} ({columns})')
+            if created:
+                self._import_csv(table)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _import_csv(self, table):
+        path = os.path.join(self.run_dir, TABLES[table]['csv'])
+        if not os.path.exists(path):
+            return
+        with open(path, newline='', encoding='utf-8') as file:
+            reader = csv.reader(file)
+            next(reader, None)
+            self.insert(table, (row for row in reader if row))
+
+    # Inserts rows (sequences of values in column order), ignoring identifiers already present.
+    # Returns the number of rows added.
+    def insert(self, table, rows):
+        columns = TABLES[table]['columns']
+        placeholders = ', '.join('?' * len(columns))
+        with self.connection:
+            before = self.connection.total_changes
+            self.connection.executemany(f'INSERT OR IGNORE INTO {table} VALUES ({placeholders})',
+                                        (list(row)[:len(columns)] for row in rows))
+            return self.connection.total_changes - before
+
+    def contains(self, table, key):
+        column = TABLES[table]['columns'][0]
+        return self.connection.execute(f'SELECT 1 FROM {table} WHERE "{column}" = ?', (key,)).fetchone() is not None
+
+    def count(self, table):
+        return self.connection.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+    # Rows in insertion order
+    def rows(self, table):
+        return self.connection.execute(f'SELECT * FROM {table} ORDER BY rowid').fetchall()
+
+    def keys(self, table):
+        column = TABLES[table]['columns'][0]
+        return {row[0] for row in self.connection.execute(f'SELECT "{column}" FROM {table}')}
+
+    def header_sequences(self):
+        return dict(self.rows('header_sequence'))
+
+    def add_protein_functions(self, rows):
+        columns = TABLES['protein_functions']['columns']
+        return self.insert('protein_functions', ([row[column] for column in columns] for row in rows))
+
+    # Writes the table to its CSV file in the run directory, replacing the file atomically.
+    def export_csv(self, table, path=None):
+        path = path or os.path.join(self.run_dir, TABLES[table]['csv'])
+        tmp = path + '.tmp'
+        with open(tmp, 'w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file, lineterminator='\n')
+            writer.writerow(TABLES[table]['columns'])
+            writer.writerows(self.rows(table))
+        os.replace(tmp, path)
+        return path
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+import csv
+import os
+from collections import defaultdict
+
+from Results_store import ResultsStore
+
+# In-memory index of how far each sequence of a run directory has progressed.
+# The run directory is listed once when the index is built, instead of being walked again for every
+# sequence, and the index is updated in place as stages complete.
+#
+# Stages, in pipeline order:
+#   folded      <header>.pdb exists
+#   searched    <header>.tar.gz (Foldseek result archive) exists
+#   substrings  substrings_<header>.csv and Select_<header>.csv exist
+#   inferred    <header> is in the protein_functions table of the results store
+#               (or in the first column of `protein_functions_csv`, if one is given)
+# A sequence can also have failed, with one of the reasons below. The indicator files are what
+# makes search failures persist between runs; other failures are only recorded for the current run.
+
+STAGES = ('folded', 'searched', 'substrings', 'inferred')
+
+INDICATORS = {
+    '_no_prob_one': "no hits were found with prob = 1.",
+    '_empty': "no hits were found.",
+    '_no_info': "no informative hits were found.",
+}
+
+
+# Extract the first column (excluding header) from the CSV file
+def get_first_column_values(csv_file):
+    values = set()
+    if not os.path.exists(csv_file):
+        return values
+    with open(csv_file, 'r', newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)  # Skip the header
+        for row in reader:
+            if row:
+                values.add(row[0].strip())
+    return values
+
+
+class RunState:
+    def __init__(self, run_dir, protein_functions_csv=None):
+        self.run_dir = run_dir
+        self.protein_functions_csv = protein_functions_csv
+        self.stages = defaultdict(set)
+        self.failures = {}
+        self.scan()
+
+    def scan(self):
+        self.stages.clear()
+        self.failures.clear()
+        names = set(os.listdir(self.run_dir)) if os.path.isdir(self.run_dir) else set()
+        for name in names:
+            if name.endswith('.pdb'):
+                self.stages[name[:-len('.pdb')]].add('folded')
+            elif name.endswith('.tar.gz'):
+                self.stages[name[:-len('.tar.gz')]].add('searched')
+            elif name.startswith('Select_') and name.endswith('.csv'):
+                header = name[len('Select_'):-len('.csv')]
+                if f"substrings_{header}.csv" in names:
+                    self.stages[header].add('substrings')
+            else:
+                for suffix in INDICATORS:
+                    if name.endswith(suffix):
+                        self.failures[name[:-len(suffix)]] = suffix
+                        break
+        if self.protein_functions_csv:
+            inferred = get_first_column_values(self.protein_functions_csv)
+        elif os.path.isdir(self.run_dir):
+            with ResultsStore(self.run_dir) as store:
+                inferred = store.keys('protein_functions')
+        else:
+            inferred = set()
+        for header in inferred:
+            self.stages[header].add('inferred')
+
+    def has(self, header, stage):
+        return stage in self.stages.get(header, ())
+
+    def mark(self, header, stage):
+        self.stages[header].add(stage)
+
+    # Returns the failure reason of a sequence (an indicator suffix or free text), or None
+    def failure(self, header):
+        return self.failures.get(header)
+
+    def mark_failed(self, header, reason):
+        self.failures[header] = reason
+
+    def describe_failure(self, header):
+        reason = self.failures.get(header)
+        return INDICATORS.get(reason, reason)
+
+    # Headers that completed `after` but not `stage` and have not failed, sorted
+    def pending(self, stage, after):
+        return sorted(header for header, done in self.stages.items()
+                      if after in done and stage not in done and header not in self.failures)
+
+    def headers(self, stage):
+        return sorted(header for header, done in self.stages.items() if stage in done)
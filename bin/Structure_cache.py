@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+# Persistent, content-addressed cache of predicted structures and Foldseek result archives.
+# Entries are keyed by the SHA-256 of the (trimmed) amino acid sequence that was submitted to ESMFold,
+# so identical sequences are only folded and searched once, whatever their header or run directory.
+# The cache is shared between runs and bounded in size: once it grows past `max_bytes`, the least
+# recently used entries are removed.
+#
+# A structure or search result depends on more than the sequence: on the ESMFold endpoint or local predictor
+# that folded it, and on the Foldseek service or local databases it was searched against (and so again on
+# the predictor). Entries are therefore stored under a kind made with cache_kind, e.g. `foldseek:<digest>`,
+# whose digest covers all of these, so results from one service, predictor or database are never returned
+# for another (a local stand-in server used for testing included).
+#
+# Layout: <root>/<kind>/<source digest>/<first two hex digits>/<sha256><extension>
+
+DEFAULT_CACHE_DIR = os.environ.get('HYPROFUNC_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'HyProFunc'))
+
+EXTENSIONS = {
+    'pdb': '.pdb',
+    'foldseek': '.tar.gz',
+    'foldseek-local': '.tar.gz',
+}
+
+
+def sequence_key(sequence):
+    return hashlib.sha256(sequence.strip().encode()).hexdigest()
+
+
+# The kind of the entries produced from `sources` (endpoint URLs, database paths, the kind of the structures
+# searched, ...), which may already be a kind made by cache_kind; sources that are None are left out
+def cache_kind(kind, *sources):
+    kind, _, source = kind.partition(':')
+    sources = [source] * bool(source) + [source for source in sources if source is not None]
+    if not sources:
+        return kind
+    return kind + ':' + hashlib.sha256('\n'.join(sources).encode()).hexdigest()[:16]
+
+
+class StructureCache:
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=10 * 1024**3):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._size = None
+        self._lock = threading.Lock()
+
+    def path(self, sequence, kind):
+        key = sequence_key(sequence)
+        kind, _, source = kind.partition(':')
+        return os.path.join(self.root, kind, source, key[:2], key + EXTENSIONS[kind])
+
+    # Returns the cached file for the sequence, or None.
+    # Reading an entry refreshes its modification time, which is what eviction orders by.
+    def get(self, sequence, kind):
+        path = self.path(sequence, kind)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    # Copies a cached entry to `destination`. Returns True on a cache hit.
+    def fetch(self, sequence, kind, destination):
+        path = self.get(sequence, kind)
+        if path is None:
+            return False
+        shutil.copyfile(path, destination)
+        return True
+
+    # Stores `data` (bytes) or the file at `source` for the sequence.
+    # Entries are written to a temporary file and renamed so that readers never see partial files.
+    def put(self, sequence, kind, data=None, source=None):
+        path = self.path(sequence, kind)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                if source is not None:
+                    with open(source, 'rb') as src:
+                        shutil.copyfileobj(src, out, 1024 * 1024)
+                else:
+                    out.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        with self._lock:
+            if self._size is not None:
+                self._size += os.path.getsize(path)
+            self.evict()
+
+    def _entries(self):
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    # Removes least recently used entries until the cache is below 90% of its size limit.
+    # The total size is only recomputed from disk when the running estimate exceeds the limit.
+    # Called with the lock held.
+    def evict(self):
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        if self._size <= self.max_bytes:
+            return
+        entries = sorted(self._entries())
+        self._size = sum(size for _, size, _ in entries)
+        target = 0.9 * self.max_bytes
+        for _, size, path in entries:
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+
+
+# Command line options shared by the scripts that use the cache
+def add_cache_arguments(parser):
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help="Directory of the structure cache shared between runs (default: $HYPROFUNC_CACHE or ~/.cache/HyProFunc).")
+    parser.add_argument('--cache-size', type=float, default=10.0, help="Maximum size of the structure cache in GB.")
+    parser.add_argument('--no-cache', action='store_true', help="Do not read or write the structure cache.")
+
+
+def make_cache(args):
+    if args.no_cache:
+        return None
+    return StructureCache(args.cache_dir, int(args.cache_size * 1024**3))
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+# Generalized suffix automaton over a list of descriptions.
+# A single pass over the descriptions gives, for every distinct substring, the number of times it
+# occurs (overlapping occurrences included), the number of descriptions containing it and the
+# position of its first occurrence. This replaces enumerating and counting every substring of
+# every length separately.
+#
+# Every automaton state represents the substrings whose lengths lie in (length[link], length],
+# and all of them share the same set of end positions. End positions are numbered globally in
+# description order, so the smallest one of a state is its first occurrence when the descriptions
+# are read one after the other.
+#
+# Hit tables repeat the same description many times, so each distinct description is added once
+# and weighted by its multiplicity. Distinct descriptions are kept in order of first appearance,
+# which leaves first occurrences, and therefore tie-breaking, unchanged.
+
+from collections import Counter
+
+
+class GeneralizedSuffixAutomaton:
+    def __init__(self, texts):
+        texts = list(texts)
+        self.weights = Counter(texts)
+        self.texts = list(dict.fromkeys(texts))
+        # per-state arrays: transitions, suffix link, longest length, occurrences,
+        # first end position and number of texts containing the state's substrings
+        self.next = [{}]
+        self.link = [-1]
+        self.length = [0]
+        self.count = [0]
+        self.first = [None]
+        self.docs = [0]
+        # text joined end to end so that a global end position can be turned back into a substring
+        self.joined = ''.join(self.texts)
+
+        prefix_states = []
+        position = 0
+        for text in self.texts:
+            weight = self.weights[text]
+            last = 0
+            states = []
+            for character in text:
+                last = self._extend(last, character)
+                self.count[last] += weight
+                if self.first[last] is None:
+                    self.first[last] = position
+                states.append(last)
+                position += 1
+            prefix_states.append(states)
+
+        self._propagate()
+        self._count_documents(prefix_states)
+
+    def _new_state(self, length, link, transitions):
+        self.next.append(transitions)
+        self.link.append(link)
+        self.length.append(length)
+        self.count.append(0)
+        self.first.append(None)
+        self.docs.append(0)
+        return len(self.length) - 1
+
+    # Splits q so that a state of length `length` ends at the same place
+    def _clone(self, p, q, character, length):
+        clone = self._new_state(length, self.link[q], dict(self.next[q]))
+        while p != -1 and self.next[p].get(character) == q:
+            self.next[p][character] = clone
+            p = self.link[p]
+        self.link[q] = clone
+        return clone
+
+    def _extend(self, last, character):
+        # The prefix already exists in the automaton (it occurred in an earlier text)
+        q = self.next[last].get(character)
+        if q is not None:
+            if self.length[q] == self.length[last] + 1:
+                return q
+            return self._clone(last, q, character, self.length[last] + 1)
+
+        cur = self._new_state(self.length[last] + 1, 0, {})
+        p = last
+        while p != -1 and character not in self.next[p]:
+            self.next[p][character] = cur
+            p = self.link[p]
+        if p != -1:
+            q = self.next[p][character]
+            if self.length[p] + 1 == self.length[q]:
+                self.link[cur] = q
+            else:
+                self.link[cur] = self._clone(p, q, character, self.length[p] + 1)
+        return cur
+
+    # Sums occurrences and takes the earliest end position along suffix links, longest states first
+    def _propagate(self):
+        order = sorted(range(1, len(self.length)), key=self.length.__getitem__, reverse=True)
+        for state in order:
+            parent = self.link[state]
+            self.count[parent] += self.count[state]
+            first = self.first[state]
+            if first is not None and (self.first[parent] is None or first < self.first[parent]):
+                self.first[parent] = first
+
+    # Counts the texts containing each state by walking up the suffix links from every prefix of
+    # each text and stopping at states already credited to that text.
+    def _count_documents(self, prefix_states):
+        seen = [-1] * len(self.length)
+        for index, states in enumerate(prefix_states):
+            weight = self.weights[self.texts[index]]
+            for state in states:
+                while state > 0 and seen[state] != index:
+                    seen[state] = index
+                    self.docs[state] += weight
+                    state = self.link[state]
+
+    def substring(self, state, length):
+        end = self.first[state] + 1
+        return self.joined[end - length:end]
+
+    def most_common(self, min_length, max_length):
+        """Returns {length: (substring, occurrences, texts containing it)} for every length in range.
+
+        Ties between equally frequent substrings go to the one that occurs first, matching
+        collections.Counter.most_common on substrings listed in text order.
+        """
+        lengths = range(min_length, max_length + 1)
+        best = {}
+        # Most frequent (earliest on ties) states claim every length they cover that is still free
+        order = sorted(range(1, len(self.length)), key=lambda state: (-self.count[state], self.first[state]))
+        for state in order:
+            low = max(self.length[self.link[state]] + 1, min_length)
+            high = min(self.length[state], max_length)
+            for length in range(low, high + 1):
+                if length not in best:
+                    best[length] = (self.substring(state, length), self.count[state], self.docs[state])
+            if len(best) == len(lengths):
+                break
+        return {length: best[length] for length in lengths if length in best}
+
+    def frequent_most_common(self, min_length, max_length, min_texts):
+        """Like most_common, but only over substrings contained in at least `min_texts` texts.
+
+        Substrings are visited level by level, Apriori-style: the candidates of length L + 1 are the
+        one-character extensions of the frequent substrings of length L, since no substring is contained
+        in more texts than its prefix. Extending u by c leads to the state of u + c, so a level is a list
+        of states, each holding exactly one substring of that length. The scan stops at the first length
+        with no frequent substring, so its cost follows the number of frequent substrings.
+        """
+        best = {}
+        level = [state for state in self.next[0].values() if self.docs[state] >= min_texts]
+        length = 1
+        while level and length <= max_length:
+            if length >= min_length:
+                state = min(level, key=lambda state: (-self.count[state], self.first[state]))
+                best[length] = (self.substring(state, length), self.count[state], self.docs[state])
+            level = [child for state in level for child in self.next[state].values() if self.docs[child] >= min_texts]
+            length += 1
+        return best
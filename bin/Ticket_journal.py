@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+from Results_store import journal_mode
+
+# Durable journal of the Foldseek tickets submitted for a run, kept in `<run_dir>foldseek_tickets.sqlite`.
+# Every ticket is recorded with the headers of the structures it searches, the service it was submitted to,
+# its submission time and its last known status, as soon as it is submitted and whenever its status changes.
+# When a run is interrupted (killed, or stopped submitting because of RATELIMIT), the next run polls and
+# downloads its outstanding tickets instead of submitting the structures again, which would use up the
+# rate limit a second time.
+#
+# Statuses: the service's PENDING, RUNNING, COMPLETE and ERROR, plus
+#   DOWNLOADED  the result archives were written
+#   EXPIRED     the service no longer knows the ticket, or it is older than the retention window
+# PENDING, RUNNING and COMPLETE tickets are outstanding. Tickets older than the retention window are deleted
+# when the journal is opened, as the service will have deleted their results.
+
+OUTSTANDING = ('PENDING', 'RUNNING', 'COMPLETE')
+
+# Days the public Foldseek server keeps the results of a ticket
+DEFAULT_RETENTION_DAYS = 7.0
+
+
+class TicketJournal:
+    def __init__(self, run_dir, retention_days=DEFAULT_RETENTION_DAYS, filename='foldseek_tickets.sqlite'):
+        self.path = os.path.join(run_dir, filename)
+        self.retention = retention_days * 86400
+        self.connection = sqlite3.connect(self.path, timeout=60)
+        self.connection.execute(f'PRAGMA journal_mode={journal_mode(run_dir)}')
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS tickets (ticket_id TEXT PRIMARY KEY, '
+                                    'headers TEXT, base_url TEXT, submitted REAL, status TEXT, updated REAL)')
+        self.expire()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, ticket_id, headers, base_url, status):
+        now = time.time()
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO tickets VALUES (?, ?, ?, ?, ?, ?)',
+                                    (ticket_id, json.dumps(list(headers)), base_url, now, status, now))
+
+    def update(self, ticket_id, status):
+        with self.connection:
+            self.connection.execute('UPDATE tickets SET status = ?, updated = ? WHERE ticket_id = ?',
+                                    (status, time.time(), ticket_id))
+
+    # Deletes tickets submitted more than the retention window ago. Returns the number deleted.
+    def expire(self):
+        with self.connection:
+            return self.connection.execute('DELETE FROM tickets WHERE submitted < ?',
+                                           (time.time() - self.retention,)).rowcount
+
+    # (ticket id, headers, submission time) of the tickets submitted to `base_url` that are still
+    # outstanding, oldest first
+    def outstanding(self, base_url):
+        rows = self.connection.execute(
+            f"SELECT ticket_id, headers, submitted FROM tickets WHERE base_url = ? "
+            f"AND status IN ({', '.join('?' * len(OUTSTANDING))}) ORDER BY submitted", (base_url, *OUTSTANDING))
+        return [(ticket_id, json.loads(headers), submitted) for ticket_id, headers, submitted in rows]
+
+    # Rows in submission order
+    def rows(self):
+        return self.connection.execute('SELECT ticket_id, headers, base_url, submitted, status, updated '
+                                       'FROM tickets ORDER BY submitted').fetchall()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Lists the Foldseek tickets recorded for a run directory.")
+    parser.add_argument('run_dir', help="Run directory (with trailing slash).")
+    args = parser.parse_args()
+
+    with TicketJournal(args.run_dir) as journal:
+        for ticket_id, headers, base_url, submitted, status, _ in journal.rows():
+            submitted = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(submitted))
+            print(f"{ticket_id}  {status:<10}  {submitted}  {base_url}  {', '.join(json.loads(headers))}")
@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from ESMFold_API import fold_pairs, make_predictor, parse_fasta
+from Metrics import make_metrics
+from Pipeline import NO_PAIR_PASSED, add_stage_arguments, downstream_stages
+from Preprocess_fasta import add_preprocess_arguments, make_preprocessor
+from Results_store import WORK_QUEUE, ResultsStore
+from Run_state import INDICATORS, RunState
+from Structure_cache import make_cache
+
+# Work queue for spreading the sequences of one run over many worker processes, on one or several hosts.
+# The queue is a SQLite database, `<run_dir>work_queue.sqlite`, on storage shared by the workers (SQLite's
+# file locking must work on it; the queue does not use WAL mode, which needs shared memory). The results stores
+# and ticket journals of the run directory and the worker directories use the same rollback journal.
+#
+#   coordinator  Work_queue.py enqueue fasta run_dir/     queues the (preprocessed) header-sequence pairs
+#   workers      Work_queue.py worker run_dir/ ESM.pem    on every host, as many as wanted
+#   coordinator  Work_queue.py merge run_dir/             writes Protein_Functions.csv once the queue is done
+#   one host     Work_queue.py local fasta run_dir/ ESM.pem --processes 4  all of the above with local processes
+#
+# A worker claims `batch_size` sequences at a time under a lease, extended by a heartbeat thread while it
+# folds, searches and infers them in its own directory, `<run_dir>workers/<worker id>/`, with the same stages
+# as Pipeline.py. It then records the outcome of each sequence, and the rows of the sequences that were inferred,
+# in the queue. Sequences whose lease runs out (the worker crashed or lost its host) are claimed again by
+# another worker. Only the worker holding the lease can record an outcome, so a worker that comes back after
+# losing its lease cannot overwrite the result of the worker that took over.
+#
+# Item statuses:
+#   pending  waiting to be claimed
+#   claimed  held by `worker` until `lease_until`
+#   done     protein function inferred; `result` holds its Protein_Functions and Header_Sequence rows
+#   failed   the sequence was processed and no function could be inferred (`reason`), or it was claimed
+#            `max_attempts` times without completing
+# Sequences that could not be processed (ESMFold failed, the Foldseek search did not complete, or substring
+# generation or inference raised) go back to pending until they have been attempted `max_attempts` times.
+#
+# --rate and --foldseek-rate are limits for all workers together, not per worker: the workers draw from token
+# buckets kept in the queue file (or in the file given with --shared-rate-limits), so adding workers does
+# not multiply the load on the public services.
+
+
+class WorkQueue:
+    def __init__(self, run_dir, filename=WORK_QUEUE, max_attempts=3):
+        self.path = os.path.join(run_dir, filename)
+        self.max_attempts = max_attempts
+        # transactions are started explicitly, so that claims take the write lock before reading
+        self.connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS items (header TEXT PRIMARY KEY, sequence TEXT, '
+                                'position INTEGER, status TEXT, worker TEXT, lease_until REAL, attempts INTEGER, '
+                                'reason TEXT, result TEXT)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS items_status ON items (status, position)')
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.connection.execute('COMMIT')
+
+    # Queues (header, sequence) pairs in order, ignoring headers already queued. Returns the number added.
+    def enqueue(self, pairs):
+        with self.transaction() as connection:
+            start = connection.execute('SELECT COALESCE(MAX(position) + 1, 0) FROM items').fetchone()[0]
+            before = connection.total_changes
+            connection.executemany("INSERT OR IGNORE INTO items VALUES (?, ?, ?, 'pending', NULL, NULL, 0, NULL, NULL)",
+                                   ((header, sequence, start + i) for i, (header, sequence) in enumerate(pairs)))
+            return connection.total_changes - before
+
+    # Claims up to `count` sequences, pending ones first and then those whose lease has run out, in queue
+    # order. Returns their (header, sequence) pairs.
+    def claim(self, worker, count, lease):
+        now = time.time()
+        with self.transaction() as connection:
+            connection.execute("UPDATE items SET status = 'failed', worker = NULL, lease_until = NULL, "
+                               "reason = 'not completed after ' || attempts || ' attempts' "
+                               "WHERE status = 'claimed' AND lease_until < ? AND attempts >= ?",
+                               (now, self.max_attempts))
+            rows = connection.execute("SELECT header, sequence FROM items WHERE status = 'pending' "
+                                      "OR (status = 'claimed' AND lease_until < ?) ORDER BY position LIMIT ?",
+                                      (now, count)).fetchall()
+            connection.executemany("UPDATE items SET status = 'claimed', worker = ?, lease_until = ?, "
+                                   "attempts = attempts + 1 WHERE header = ?",
+                                   ((worker, now + lease, header) for header, _ in rows))
+        return rows
+
+    # Extends the lease of the sequences still held by the worker. Returns the number extended.
+    def renew(self, worker, headers, lease):
+        with self.transaction() as connection:
+            return sum(connection.execute("UPDATE items SET lease_until = ? WHERE header = ? AND worker = ? "
+                                          "AND status = 'claimed'", (time.time() + lease, header, worker)).rowcount
+                       for header in headers)
+
+    # Records the outcome of a claimed sequence: 'done' with its result, 'failed' with a reason, or 'retry'
+    # to put it back in the queue. Returns False if the worker no longer holds the sequence.
+    def finish(self, worker, header, outcome, reason=None, result=None):
+        with self.transaction() as connection:
+            if outcome == 'retry':
+                attempts = connection.execute('SELECT attempts FROM items WHERE header = ?', (header,)).fetchone()
+                if attempts and attempts[0] >= self.max_attempts:
+                    outcome, reason = 'failed', f"{reason} Not completed after {attempts[0]} attempts."
+                else:
+                    outcome = 'pending'
+            return connection.execute("UPDATE items SET status = ?, worker = NULL, lease_until = NULL, reason = ?, "
+                                      "result = ? WHERE header = ? AND worker = ? AND status = 'claimed'",
+                                      (outcome, reason, json.dumps(result) if result else None,
+                                       header, worker)).rowcount == 1
+
+    def counts(self):
+        return dict(self.connection.execute('SELECT status, COUNT(*) FROM items GROUP BY status'))
+
+    # Number of sequences that are not done or failed yet
+    def unfinished(self):
+        return self.connection.execute("SELECT COUNT(*) FROM items WHERE status IN ('pending', 'claimed')").fetchone()[0]
+
+    # Results of the done sequences, in header order
+    def results(self):
+        return [json.loads(result) for (result,) in
+                self.connection.execute("SELECT result FROM items WHERE status = 'done' ORDER BY header")]
+
+    def failures(self):
+        return self.connection.execute("SELECT header, reason FROM items WHERE status = 'failed' ORDER BY header").fetchall()
+
+
+# Extends the worker's leases on `headers` every third of the lease, from a thread with its own connection,
+# for as long as the block runs
+@contextlib.contextmanager
+def heartbeat(run_dir, worker, headers, lease):
+    stop = threading.Event()
+
+    def beat():
+        with WorkQueue(run_dir) as queue:
+            while not stop.wait(lease / 3):
+                queue.renew(worker, headers, lease)
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+# Runs every stage for a batch of claimed sequences in the worker's directory and returns the outcome of
+# each as (header, outcome, reason, result) for WorkQueue.finish.
+# Only the claimed sequences are searched and inferred: the directory also holds the files of sequences
+# from earlier batches that were put back in the queue, which other workers may hold by now.
+def process_batch(pairs, worker_dir, args, predictor, cache, metrics):
+    state = RunState(worker_dir)
+    claimed = {header for header, _ in pairs}
+    with ResultsStore(worker_dir) as store:
+        with metrics.stage('fold'):
+            fold_pairs(pairs, worker_dir, predictor, cache=cache, state=state, store=store)
+        downstream_stages(worker_dir, args, cache, state, store, metrics, claimed, predictor.cache_kind)
+        functions = {row[0]: list(row) for row in store.rows('protein_functions')}
+        sequences = store.header_sequences()
+
+    outcomes = []
+    for header, _ in pairs:
+        if header in functions:
+            outcomes.append((header, 'done', None,
+                             {'protein_functions': functions[header], 'header_sequence': [header, sequences[header]]}))
+        elif state.failure(header) in INDICATORS or state.failure(header) == NO_PAIR_PASSED:
+            outcomes.append((header, 'failed', state.describe_failure(header), None))
+        else:
+            # not folded or not searched, or a stage raised; another attempt may succeed
+            outcomes.append((header, 'retry', state.describe_failure(header) or "Foldseek search not completed.", None))
+    return outcomes
+
+
+# Claims and processes batches until no sequence is left to claim. While other workers still hold
+# sequences, it waits in case their leases run out.
+def run_worker(args, worker_id):
+    worker_dir = os.path.join(args.run_dir, 'workers', worker_id) + os.sep
+    os.makedirs(worker_dir, exist_ok=True)
+    cache = make_cache(args)
+    with WorkQueue(args.run_dir, max_attempts=args.max_attempts) as queue, make_metrics(args) as metrics:
+        # the ESMFold and Foldseek rate limits apply to all workers together, through the queue file
+        if not args.shared_rate_limits:
+            args.shared_rate_limits = queue.path
+        predictor = make_predictor(args, metrics)
+        while True:
+            pairs = queue.claim(worker_id, args.batch_size, args.lease)
+            if not pairs:
+                if not queue.unfinished():
+                    break
+                time.sleep(min(args.lease / 10, 5))
+                continue
+            headers = [header for header, _ in pairs]
+            print(f"Worker {worker_id} claimed {', '.join(headers)}")
+            with heartbeat(args.run_dir, worker_id, headers, args.lease):
+                outcomes = process_batch(pairs, worker_dir, args, predictor, cache, metrics)
+            for header, outcome, reason, result in outcomes:
+                if not queue.finish(worker_id, header, outcome, reason, result):
+                    print(f"Worker {worker_id} lost its lease on {header}; its result was not recorded.")
+        if args.metrics:
+            metrics.report()
+    print(f"Worker {worker_id} found no more sequences to claim.")
+
+
+def enqueue(args):
+    num_entries, pairs = parse_fasta(args.fasta, make_preprocessor(args))
+    with WorkQueue(args.run_dir) as queue:
+        added = queue.enqueue(pairs)
+    with open(os.path.join(args.run_dir, 'num_entries'), 'w') as f:
+        f.write(str(num_entries))
+    print(f"{added} of {num_entries} sequences added to {queue.path}")
+
+
+# Writes the rows of the done sequences to the run directory's results store and exports
+# Protein_Functions.csv and Header_Sequence.csv from it
+def merge(args):
+    with WorkQueue(args.run_dir) as queue:
+        unfinished = queue.unfinished()
+        results = queue.results()
+        failures = queue.failures()
+    if unfinished:
+        print(f"{unfinished} sequences are still queued or being processed; merging the results so far.")
+    with ResultsStore(args.run_dir) as store:
+        store.insert('header_sequence', (result['header_sequence'] for result in results))
+        added = store.insert('protein_functions', (result['protein_functions'] for result in results))
+        store.export_csv('header_sequence')
+        print(f"{added} protein functions added. Results written to: {store.export_csv('protein_functions')}")
+    for header, reason in failures:
+        print(f"No protein function determined for {header}: {reason}")
+
+
+def status(args):
+    with WorkQueue(args.run_dir) as queue:
+        counts = queue.counts()
+    print(', '.join(f"{counts.get(name, 0)} {name}" for name in ('pending', 'claimed', 'done', 'failed')))
+
+
+# Queues the fasta file, runs `processes` local worker processes until the queue is done and merges the results
+def run_local(args):
+    enqueue(args)
+    processes = [multiprocessing.Process(target=run_worker, args=(args, f'{socket.gethostname()}-local{i}'))
+                 for i in range(args.processes)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    merge(args)
+
+
+def add_worker_arguments(parser):
+    parser.add_argument('pem', help="File path for the .pem file used by the ESMFold SSL context.")
+    add_stage_arguments(parser)
+    parser.add_argument('--batch-size', type=int, default=4, help="Sequences claimed at a time.")
+    parser.add_argument('--lease', type=float, default=1800.0,
+                        help="Seconds a claim lasts without a heartbeat before other workers may take it over.")
+    parser.add_argument('--max-attempts', type=int, default=3, help="Claims of a sequence before it is marked failed.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distributes the sequences of a run over worker processes through a shared queue.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('enqueue', help="Queue the sequences of a fasta file.")
+    command.add_argument('fasta', help="Fasta file containing amino acid sequences.")
+    command.add_argument('run_dir', help="Run directory (with trailing slash) on storage shared by the workers.")
+    add_preprocess_arguments(command)
+    command.set_defaults(function=enqueue)
+
+    command = commands.add_parser('worker', help="Claim and process queued sequences until none are left.")
+    command.add_argument('run_dir', help="Run directory (with trailing slash) on storage shared by the workers.")
+    add_worker_arguments(command)
+    command.add_argument('--worker-id', default=f'{socket.gethostname()}-{os.getpid()}',
+                         help="Name of this worker and of its directory (default host-pid).")
+    command.set_defaults(function=lambda args: run_worker(args, args.worker_id))
+
+    command = commands.add_parser('merge', help="Write the results of the queue to Protein_Functions.csv.")
+    command.add_argument('run_dir', help="Run directory (with trailing slash).")
+    command.set_defaults(function=merge)
+
+    command = commands.add_parser('status', help="Count the queued sequences by status.")
+    command.add_argument('run_dir', help="Run directory (with trailing slash).")
+    command.set_defaults(function=status)
+
+    command = commands.add_parser('local', help="Queue a fasta file, process it with local workers and merge the results.")
+    command.add_argument('fasta', help="Fasta file containing amino acid sequences.")
+    command.add_argument('run_dir', help="Run directory (with trailing slash).")
+    add_preprocess_arguments(command)
+    add_worker_arguments(command)
+    command.add_argument('--processes', type=int, default=2, help="Local worker processes.")
+    command.set_defaults(function=run_local)
+
+    args = parser.parse_args()
+    args.function(args)
+
+
+if __name__ == '__main__':
+    main()
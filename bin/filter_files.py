@@ -4,26 +4,21 @@ import os
 import glob
 import sys
 
-# Extract the first column (excluding header) from the CSV file
-def get_first_column_values(csv_file):
-    values = set()
-    with open(csv_file, 'r') as f:
-        next(f)  # Skip the header
-        for line in f:
-            values.add(line.split(',')[0].strip())
-    return values
-
-# Remove files containing these values from the list of files
-def filter_files(values, pattern):
-    all_files = glob.glob(pattern)
+from Run_state import RunState
+
+# Remove files belonging to sequences that have already been inferred from the list of files.
+# The sequence ID is the part of the file name matched by the '*' in the pattern
+# (e.g. 'Select_*.csv'), and it must match an ID in the CSV exactly.
+def filter_files(state, dir, pattern):
+    prefix, _, suffix = pattern.partition('*')
     files_to_process = []
-    
-    for file_path in all_files:
+
+    for file_path in sorted(glob.glob(os.path.join(dir, pattern))):
         file_name = os.path.basename(file_path)
-        # Check if any value from the first column is in the file name
-        if not any(value in file_name for value in values):
+        header = file_name[len(prefix):len(file_name) - len(suffix)]
+        if not state.has(header, 'inferred'):
             files_to_process.append(file_path)
-    
+
     return files_to_process
 
 # Example usage
@@ -33,17 +28,17 @@ dir = sys.argv[2]
 #file_pattern = './Select_*.csv'
 file_pattern = sys.argv[3]
 
-# Get values from the first column
-values = get_first_column_values(csv_file)
+# Index the run directory, taking the inferred IDs from the first column of the CSV
+state = RunState(dir, protein_functions_csv=csv_file)
 
 if 'print_values' in sys.argv:
     print("Sequence IDs already determined:")
-    for value in values:
+    for value in state.headers('inferred'):
         print(value)
     sys.exit(0)
 
 # Filter files based on the extracted values
-files_to_process = filter_files(values, dir + file_pattern)
+files_to_process = filter_files(state, dir, file_pattern)
 
 # Print each file path on a new line (Bash-friendly)
 for file in files_to_process:
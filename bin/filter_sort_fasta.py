@@ -1,24 +1,24 @@
 #!/usr/bin/env python
 
-from Bio import SeqIO
 import sys
 
+from Fasta_reader import read_fasta
+from Preprocess_fasta import FastaPreprocessor, write_fasta
+
+# Keeps the sequences of at least min_length amino acids, longest first.
+# The same as `Preprocess_fasta.py input output --min-length N --sort`, kept for existing workflows.
+
 def filter_and_sort_fasta(input_fasta, output_fasta, min_length):
-    # Parse the input fasta file and filter sequences by length
-    sequences = [record for record in SeqIO.parse(input_fasta, "fasta") if len(record.seq) >= min_length]
-    
-    # Sort sequences by length in descending order
-    sorted_sequences = sorted(sequences, key=lambda x: len(x.seq), reverse=True)
-    
-    # Write the filtered and sorted sequences to a new fasta file
-    with open(output_fasta, "w") as output_handle:
-        SeqIO.write(sorted_sequences, output_handle, "fasta")
-    
-    print(f"Filtered {len(sorted_sequences)} sequences and saved to {output_fasta}.")
+    # Parse the input fasta file, filter sequences by length and sort them by length in descending order
+    preprocessor = FastaPreprocessor(min_length=min_length, sort=True)
+
+    # Write the filtered and sorted sequences to a new fasta file, 60 residues per line as before
+    count = write_fasta(preprocessor.process(read_fasta(input_fasta)), output_fasta, width=60)
+
+    print(f"Filtered {count} sequences and saved to {output_fasta}.")
 
 input_fasta = sys.argv[1]
 output_fasta = sys.argv[2]
 min_length = int(sys.argv[3])
 
 filter_and_sort_fasta(input_fasta, output_fasta, min_length)
-